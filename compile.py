@@ -9,8 +9,14 @@
 #
 # The binaries are placed in 
 #     ~/polkadot-optimized/bin/VERSION
-# (change this in the code below if needed).
+# (change this in the code below if needed) and registered in
+#     ~/polkadot-optimized/bin/registry.sqlite
+# (see registry.py), option sets that were built before are skipped.
 # Beware that compiling takes a while (about 30 min per set of options).
+# Several builds can run at the same time (NB_PARALLEL at the bottom), they
+# share one checkout and the vendored dependencies. The git mirror, checkouts
+# and dependencies are cached in ~/polkadot-optimized/cache, so after the
+# first run a release can be rebuilt offline.
 # It is recommended to run the script in, for example, a screen session.
 
 from operator import truediv
@@ -18,79 +24,161 @@ import subprocess
 import os
 import shutil
 import re
-import glob
+import shlex
 import json
 import logging
 
 import datetime
+import time
 import dateutil.relativedelta
 import itertools
+import concurrent.futures
 
 import tomlkit
+import psutil # pip install psutil
 from pathlib import Path
 
-def extract_largest_number(files):    
-    if len(files) == 0:        
-        return -1
-    else:        
-        return max([int(re.findall("_\d+.bin",f)[0][1:-4]) for f in files])
-    
+import registry
+import run_benchmarks
+
+BASE_DIR = os.path.expanduser('~/polkadot-optimized')
+TARGET = 'x86_64-unknown-linux-gnu'
+# Mirror, checkouts and vendored dependencies (kept between runs)
+CACHE_DIR = BASE_DIR + '/cache'
+# Can point to a local repository
+POLKADOT_REPO = os.environ.get('POLKADOT_REPO', 'https://github.com/paritytech/polkadot.git')
+# Seconds between samples of the memory use of a build
+SAMPLE_INTERVAL = 0.5
+# BOLT post-link optimization (option 'bolt'), see https://github.com/llvm/llvm-project/tree/main/bolt
+LLVM_BOLT = 'llvm-bolt'
+MERGE_FDATA = 'merge-fdata'
+
 def hours_minutes(dt1, dt2):
     rd = dateutil.relativedelta.relativedelta(dt2, dt1)
-    return "{}H {}M {}S".format(rd.hours, rd.minutes, rd.seconds)
+    return "{}H {}M {}S".format(rd.days*24 + rd.hours, rd.minutes, rd.seconds)
+
+def tree_rss(proc):
+    "RSS (bytes) of a process and all its children"
+    rss = 0
+    for p in [proc] + proc.children(recursive=True):
+        try:
+            rss = rss + p.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
 
 def run(cmd, work_dir, log_file, env=None):    
-    os.chdir(work_dir)    
+    """
+    Run cmd with stderr to log_file. Returns the wall time, CPU time (user+system) 
+    in seconds and peak RSS (bytes, sampled) of the whole process tree.
+    """
+    # No os.chdir here: several builds can run at the same time from threads
     with open(log_file, "a+") as log:
-        if env==None:
-            subprocess.run(cmd, shell=True, check=True, universal_newlines=True, stderr=log)
-        else:
-            subprocess.run(cmd, shell=True, check=True, universal_newlines=True, stderr=log, env=env)        
-
-def compile(version, opts):
-    print(" === STARTING COMPILATION === ")
-    print(opts)
-    print(version)  
+        t0 = time.monotonic()
+        proc = subprocess.Popen(cmd, shell=True, universal_newlines=True, stderr=log, cwd=work_dir, env=env)
+        peak_rss = 0
+        try:
+            ps = psutil.Process(proc.pid)
+        except psutil.Error:
+            ps = None
+        # wait4 (instead of wait) to get the CPU time of all waited-for descendants
+        interval = 0.01
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            if ps is not None:
+                peak_rss = max(peak_rss, tree_rss(ps))
+            time.sleep(interval)
+            # short commands should not wait for a full interval
+            interval = min(2*interval, SAMPLE_INTERVAL)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return {'seconds': time.monotonic() - t0,
+            'cpu_seconds': rusage.ru_utime + rusage.ru_stime,
+            'peak_rss': peak_rss}
 
-    # Prepare build directory
-    os.chdir(os.path.expanduser('~/polkadot-optimized'))
-    bin_dir = 'bin/' + version
-    if not os.path.isdir(bin_dir):
-        os.makedirs(bin_dir)
-
-    # Check if opts was not compiled before
-    list_of_files = glob.glob(bin_dir + '/polkadot_*.json')
-    for f in list_of_files:
-        with open(f, "r") as file: 
-            json_dict = json.load(file)
-            if json_dict['build_options']==opts:
-                return
-    
-    # Get number of new polkadot build, set filenames
-    list_of_files = glob.glob(bin_dir + '/polkadot_*.bin')
-    nb = extract_largest_number(list_of_files) + 1
+def cargo_timings(target_dir, nb=10):
+    "The nb slowest crates of the last build from the cargo --timings report"
+    report = target_dir + '/cargo-timings/cargo-timing.html'
+    if not os.path.isfile(report):
+        return []
+    with open(report, "r") as f:
+        m = re.search(r'const UNIT_DATA = (\[.*?\]);', f.read(), re.S)
+    if m is None:
+        return []
+    try:
+        units = json.loads(m.group(1))
+    except ValueError:
+        return []
+    units.sort(key=lambda u: u['duration'], reverse=True)
+    return [{'name': u['name'], 'version': u['version'], 'target': u['target'].strip(), 
+             'duration': u['duration'], 'rmeta_time': u.get('rmeta_time')} for u in units[:nb]]
 
-    new_filename_root = bin_dir + '/polkadot_{}'.format(nb)
-    log_file = os.path.expanduser('~/polkadot-optimized/' + new_filename_root + ".log")
-
-    if os.path.isdir('polkadot'):
-        shutil.rmtree('polkadot')
+def toolchain_version(toolchain):
+    "Full version of the toolchain (part of the registry key since nightly changes daily)"
+    env = os.environ.copy()
+    env["RUSTUP_TOOLCHAIN"] = toolchain
+    out = subprocess.run(['rustc', '--version'], env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return out.stdout.strip()
 
-    # Clone git and run init
-    work_dir = os.path.expanduser('~/polkadot-optimized')
-    run("git clone --depth 1 --branch v{} https://github.com/paritytech/polkadot.git".format(version), work_dir, log_file)
+def mirror(version, log_file):
+    "Local bare mirror of the polkadot repo, the release tag is only fetched if it is missing"
+    git_dir = CACHE_DIR + '/polkadot.git'
+    if not os.path.isdir(git_dir):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        run("git init --bare {}".format(git_dir), BASE_DIR, log_file)
+    tag = 'v' + version
+    found = subprocess.run(['git', '--git-dir', git_dir, 'rev-parse', '--verify', '--quiet', 'refs/tags/{}^{{commit}}'.format(tag)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if found.returncode != 0:
+        run("git --git-dir={} fetch --depth 1 {} refs/tags/{}:refs/tags/{}".format(git_dir, POLKADOT_REPO, tag, tag), BASE_DIR, log_file)
+    return git_dir
 
-    work_dir = os.path.expanduser('~/polkadot-optimized/polkadot')
-    run("./scripts/init.sh", work_dir, log_file)
+def vendor(version, work_dir, log_file):
+    "Vendor the dependencies once per version (reused by later runs, also offline) and point cargo to them"
+    vendor_dir = CACHE_DIR + '/vendor/v' + version
+    vendor_config = vendor_dir + '.toml'
+    if not os.path.isfile(vendor_config):
+        os.makedirs(CACHE_DIR + '/vendor', exist_ok=True)
+        # cargo vendor prints the source replacement config; only keep it when vendoring succeeded
+        run("cargo vendor --locked {} > {}.tmp".format(vendor_dir, vendor_config), work_dir, log_file)
+        os.replace(vendor_config + '.tmp', vendor_config)
+    cargo_config = work_dir + '/.cargo/config'
+    if not os.path.isfile(cargo_config):
+        cargo_config = cargo_config + '.toml'
+    os.makedirs(work_dir + '/.cargo', exist_ok=True)
+    with open(vendor_config, "r") as f, open(cargo_config, "a") as out:
+        out.write('\n' + f.read())
 
-    # Set build options
-    if opts['toolchain'] == 'stable':
-        run("rustup override set stable", work_dir, log_file)
+def checkout(version, log_file, phases=None):
+    """
+    Checkout of the release from the local mirror, reset to a clean tree.
+    The cargo target directories are kept, so builds are incremental across runs.
+    Returns the directory of the checkout. The time (seconds) of every
+    phase is stored in the dict phases.
+    """
+    if phases is None:
+        phases = {}
+    t0 = time.monotonic()
+    git_dir = mirror(version, log_file)
+    phases['mirror'] = time.monotonic() - t0
+    tag = 'v' + version
+    work_dir = CACHE_DIR + '/src/' + tag
+    t0 = time.monotonic()
+    if not os.path.isdir(work_dir):
+        run("git --git-dir={} worktree prune".format(git_dir), BASE_DIR, log_file)
+        run("git --git-dir={} worktree add --detach {} {}".format(git_dir, work_dir, tag), BASE_DIR, log_file)
+        phases['checkout'] = time.monotonic() - t0
+        phases['init'] = run("./scripts/init.sh", work_dir, log_file)['seconds']
     else:
-        run("rustup override set nightly", work_dir, log_file)
-        # subprocess.Popen("rustup override set nightly", shell=True, check=True, universal_newlines=True)
-
-    run("cargo fetch", work_dir, log_file)
+        run("git reset --quiet --hard {}".format(tag), work_dir, log_file)
+        run("git clean --quiet -ffdx --exclude=/target/", work_dir, log_file)
+        phases['checkout'] = time.monotonic() - t0
+    t0 = time.monotonic()
+    vendor(version, work_dir, log_file)
+    phases['vendor'] = time.monotonic() - t0
 
     ## OLD CODE WITH RUSTFLAGS
     # RUSTFLAGS = "-C opt-level=3"
@@ -109,27 +197,141 @@ def compile(version, opts):
 
     ## NEW CODE AS CUSTOM PROFILE (
     # It overwrites the production profile -- otherwise still build errors.
+    # The actual settings are passed per build with profile_env() so that
+    # builds with different options can share this checkout.
     config = tomlkit.loads(Path(work_dir + "/Cargo.toml").read_text())    
     profile = {}
-    # TODO test if arch can be set here
-    # if not opts['arch'] == None:
-    #     profile['arch'] = opts['arch']    
     profile['inherits'] = 'release'    
-    profile['codegen-units'] = opts['codegen-units']    
-    profile['lto'] = opts['lto']    
-    profile['opt-level'] = opts['opt-level']          
-
     config['profile']['production'] = profile
     with Path(work_dir + "/Cargo.toml").open("w") as fout:
         fout.write(tomlkit.dumps(config))
-    
+    return work_dir
+
+def profile_env(opts):
+    "Settings of the production profile as cargo environment overrides"
+    # TODO test if arch can be set here
+    # if not opts['arch'] == None:
+    #     profile['arch'] = opts['arch']    
+    env = {}
+    for key in ['codegen-units', 'lto', 'opt-level', 'panic']:
+        value = opts.get(key, registry.DEFAULT_OPTIONS.get(key))
+        if isinstance(value, bool):
+            value = str(value).lower()
+        env['CARGO_PROFILE_PRODUCTION_' + key.upper().replace('-', '_')] = str(value)
+    return env
+
+def rustflags(opts):
     RUSTFLAGS = ""
     # TODO test if arch can be set in profile
-    if not opts['arch'] == None:
+    if not opts['arch'] in [None, 'none']:
         RUSTFLAGS = RUSTFLAGS + " -C target-cpu={}".format(opts['arch'])
+    # lld or mold (through clang, as the gcc driver only knows mold since gcc 12)
+    if opts.get('linker', 'default') != 'default':
+        RUSTFLAGS = RUSTFLAGS + " -C linker=clang -C link-arg=-fuse-ld={}".format(opts['linker'])
+    # e.g. +avx2,+bmi2
+    if opts.get('target-feature', 'none') != 'none':
+        RUSTFLAGS = RUSTFLAGS + " -C target-feature={}".format(opts['target-feature'])
+    if opts.get('relocation-model', 'default') != 'default':
+        RUSTFLAGS = RUSTFLAGS + " -C relocation-model={}".format(opts['relocation-model'])
+    return RUSTFLAGS
+
+def cargo_features(opts):
+    "Cargo features of the build, the allocator is a feature of polkadot (e.g. jemalloc-allocator)"
+    if opts.get('allocator', 'default') != 'default':
+        return ' --features ' + opts['allocator']
+    return ''
+
+def dependency_key(opts):
+    "Builds with the same key compile the dependencies identically (only lto of the leaf crate differs)"
+    opts = registry.normalize_options(opts)
+    key = "_".join("{}-{}".format(k, opts[k]) for k in sorted(opts) if k != 'lto')
+    return re.sub(r'[^\w.+=-]', '', key)
+
+def llvm_tool(toolchain, tool, log_file):
+    "Path of an LLVM tool (like llvm-profdata) that matches the LLVM of the toolchain"
+    env = os.environ.copy()
+    env["RUSTUP_TOOLCHAIN"] = toolchain
+    run("rustup component add llvm-tools-preview", BASE_DIR, log_file, env=env)
+    sysroot = subprocess.run(['rustc', '--print', 'sysroot'], env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return sysroot.stdout.strip() + '/lib/rustlib/' + TARGET + '/bin/' + tool
+
+def collect_profile(binary, work_dir, log_file):
+    """
+    Run the benchmark workloads of run_benchmarks.py with an instrumented binary.
+    The exit status is ignored: the slower instrumented binary can fail the
+    hardware requirements of the machine benchmark, the profile is written anyway
+    (a missing profile makes the merge fail).
+    """
+    workloads = [run_benchmarks.MACHINE_BENCHMARK]
+    workloads = workloads + [run_benchmarks.extrinsic_command(w) for w in run_benchmarks.EXTRINSIC_WORKLOADS]
+    for workload in workloads:
+        try:
+            run(shlex.join([binary] + workload) + " > /dev/null", work_dir, log_file)
+        except subprocess.CalledProcessError as e:
+            print("Profile run {} exited with status {}".format(shlex.join(workload), e.returncode))
+
+def pgo_profile(opts, RUSTFLAGS, cargo_cmd, env, work_dir, target_dir, log_file, phases):
+    """
+    Profile-guided optimization: build an instrumented binary, run the benchmark
+    workloads with it and merge the profiles. Returns the merged profile.
+    """
+    profile_dir = target_dir + '/pgo-profiles'
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    # own target directory, the flags differ from the final build
+    env = dict(env)
+    env["RUSTFLAGS"] = RUSTFLAGS + " -Cprofile-generate=" + profile_dir
+    env["CARGO_TARGET_DIR"] = target_dir + '/pgo-generate'
+    phases['pgo_generate'] = run(cargo_cmd, work_dir, log_file, env=env)['seconds']
+
+    t0 = time.monotonic()
+    collect_profile(env["CARGO_TARGET_DIR"] + '/' + TARGET + '/production/polkadot', work_dir, log_file)
+    phases['pgo_workload'] = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    merged = profile_dir + '/merged.profdata'
+    llvm_profdata = llvm_tool(opts['toolchain'], 'llvm-profdata', log_file)
+    run("{} merge -o {} {}/*.profraw".format(llvm_profdata, merged, profile_dir), work_dir, log_file)
+    phases['pgo_merge'] = time.monotonic() - t0
+    return merged
+
+def bolt(binary, work_dir, log_file, phases):
+    "Optimize the code layout of binary (in place) with BOLT, profiled with the benchmark workloads"
+    fdata_dir = binary + '.fdata'
+    shutil.rmtree(fdata_dir, ignore_errors=True)
+    os.makedirs(fdata_dir)
+    t0 = time.monotonic()
+    run("{} {} -instrument --instrumentation-file={}/prof --instrumentation-file-append-pid -o {}.inst".format(
+        LLVM_BOLT, binary, fdata_dir, binary), work_dir, log_file)
+    collect_profile(binary + '.inst', work_dir, log_file)
+    run("{} {}/prof* > {}/merged.fdata".format(MERGE_FDATA, fdata_dir, fdata_dir), work_dir, log_file)
+    run("{} {} -o {}.bolt -data={}/merged.fdata -reorder-blocks=ext-tsp -reorder-functions=hfsort "
+        "-split-functions -split-all-cold -dyno-stats".format(LLVM_BOLT, binary, binary, fdata_dir), work_dir, log_file)
+    os.replace(binary + '.bolt', binary)
+    os.remove(binary + '.inst')
+    shutil.rmtree(fdata_dir)
+    phases['bolt'] = time.monotonic() - t0
+
+def build(version, opts, nb, work_dir, target_dir, jobs=None, prepare_phases=None):
+    """
+    Build opts in the checkout work_dir as polkadot_nb, using its own cargo target_dir.
+    prepare_phases are the timings of the checkout, stored with the build.
+    """
+    bin_dir = BASE_DIR + '/bin/' + version
+    new_filename_root = bin_dir + '/polkadot_{}'.format(nb)
+    log_file = new_filename_root + ".log"
+    phases = {}
+
+    RUSTFLAGS = rustflags(opts)
+    t0 = time.monotonic()
+    tc_version = toolchain_version(opts['toolchain'])
+    phases['toolchain'] = time.monotonic() - t0
 
     # Start building
-    cargo_build_opts = ' --profile=production --locked --target=x86_64-unknown-linux-gnu'    
+    cargo_build_opts = ' --profile=production --locked --timings --target=' + TARGET
+    if jobs is not None:
+        cargo_build_opts = cargo_build_opts + ' --jobs {}'.format(jobs)
+        
+    cargo_build_opts = cargo_build_opts + cargo_features(opts)
         
     if opts['toolchain'] == 'nightly':
         cargo_build_opts = cargo_build_opts + ' -Z unstable-options'    
@@ -137,27 +339,174 @@ def compile(version, opts):
     cargo_cmd = 'cargo build ' + cargo_build_opts
     env = os.environ.copy()
     env["RUSTFLAGS"] =  RUSTFLAGS
+    # Instead of rustup override (shared by all builds in the checkout)
+    env["RUSTUP_TOOLCHAIN"] = opts['toolchain']
+    env["CARGO_TARGET_DIR"] = target_dir
+    env.update(profile_env(opts))
 
     dt1 = datetime.datetime.now()
-    run(cargo_cmd, work_dir, log_file, env=env)
-    dt2 = datetime.datetime.now()
+    if opts.get('pgo'):
+        print("Build {}: collecting profile for PGO".format(nb))
+        merged = pgo_profile(opts, RUSTFLAGS, cargo_cmd, env, work_dir, target_dir, log_file, phases)
+        env["RUSTFLAGS"] = RUSTFLAGS + " -Cprofile-use={} -Cllvm-args=-pgo-warn-missing-function".format(merged)
+    if opts.get('bolt'):
+        # BOLT needs the relocations
+        env["RUSTFLAGS"] = env["RUSTFLAGS"] + " -C link-arg=-Wl,--emit-relocs"
+    usage = run(cargo_cmd, work_dir, log_file, env=env)
+    phases['cargo_build'] = usage['seconds']
 
     ## Copy new polkadot file
-    os.chdir(os.path.expanduser('~/polkadot-optimized'))
-
-    orig_filename = 'polkadot/target/x86_64-unknown-linux-gnu/production/polkadot'
+    t0 = time.monotonic()
+    orig_filename = target_dir + '/' + TARGET + '/production/polkadot'
     shutil.copy2(orig_filename, new_filename_root + ".bin")
+    phases['copy'] = time.monotonic() - t0
+    if opts.get('bolt'):
+        print("Build {}: optimizing with BOLT".format(nb))
+        bolt(new_filename_root + ".bin", work_dir, log_file, phases)
+    dt2 = datetime.datetime.now()
 
     json_dict = {}
     json_dict['build_options'] = opts
     json_dict['build_time'] = hours_minutes(dt1, dt2)
+    json_dict['build_seconds'] = (dt2 - dt1).total_seconds()
+    json_dict['build_cpu_seconds'] = usage['cpu_seconds']
+    json_dict['build_peak_rss'] = usage['peak_rss']
     json_dict['RUSTFLAGS'] = RUSTFLAGS
+    # with PGO/BOLT flags
+    json_dict['final_RUSTFLAGS'] = env["RUSTFLAGS"]
     json_dict['build_command'] = cargo_cmd
+    json_dict['profile_env'] = profile_env(opts)
+    json_dict['toolchain_version'] = tc_version
+    json_dict['slowest_crates'] = cargo_timings(target_dir)
+    # checkout is shared by all builds of one compile run
+    json_dict['prepare_phases'] = prepare_phases or {}
+    json_dict['phases'] = phases
+    json_dict['sha256'] = registry.register(version, nb, opts, tc_version, RUSTFLAGS, meta=json_dict)
 
     json_object = json.dumps(json_dict, indent=4)
     with open(new_filename_root + ".json", "w") as outfile:
         outfile.write(json_object)
 
+def find_build(version, opts):
+    "Build number if opts was compiled before (with the current toolchain), else None"
+    build = registry.lookup(version, opts, toolchain_version(opts['toolchain']), rustflags(opts))
+    if build is None or build['evicted']:
+        return None
+    return build['nb']
+
+def evicted_build(version, opts):
+    "Build number if opts was compiled before but its binary was evicted, else None"
+    build = registry.lookup(version, opts, toolchain_version(opts['toolchain']), rustflags(opts))
+    if build is None or not build['evicted']:
+        return None
+    return build['nb']
+
+def number_builds(version, opts):
+    """
+    Split the option sets opts of version into the numbers of the builds that
+    were compiled before and the (nb, opts) still to build. The new builds are
+    numbered up front, so parallel builds cannot clash; a rebuild of an
+    evicted build keeps its number.
+    """
+    ready = []
+    todo = []
+    for o in opts:
+        nb = find_build(version, o)
+        if nb is not None:
+            if nb not in ready:
+                ready.append(nb)
+        elif registry.normalize_options(o) not in map(registry.normalize_options, todo):
+            todo.append(o)
+    nb = registry.next_number(version)
+    numbered = []
+    for o in todo:
+        number = evicted_build(version, o)
+        if number is None:
+            number, nb = nb, nb + 1
+        numbered.append((number, o))
+    return ready, numbered
+
+def compile(version, opts):
+    print(" === STARTING COMPILATION === ")
+    print(opts)
+    print(version)  
+
+    # Prepare build directory
+    bin_dir = BASE_DIR + '/bin/' + version
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+
+    registry.import_legacy(version)
+    if find_build(version, opts) is not None:
+        return
+    
+    # Get number of new polkadot build (a rebuild keeps its number), set filenames
+    nb = evicted_build(version, opts)
+    if nb is None:
+        nb = registry.next_number(version)
+    log_file = bin_dir + '/polkadot_{}.log'.format(nb)
+
+    phases = {}
+    work_dir = checkout(version, log_file, phases)
+    build(version, opts, nb, work_dir, work_dir + '/target/' + dependency_key(opts), prepare_phases=phases)
+
+def build_group(version, group, work_dir, jobs, prepare_phases=None):
+    "Build one group of (nb, opts) after each other in the same target directory"
+    failed = []
+    target_dir = work_dir + '/target/' + dependency_key(group[0][1])
+    for nb, opts in group:
+        print("Start build {} with {} jobs: {}".format(nb, jobs, opts))
+        try:
+            build(version, opts, nb, work_dir, target_dir, jobs=jobs, prepare_phases=prepare_phases)
+            print("Finished build {}".format(nb))
+        except subprocess.CalledProcessError as e:
+            print("Build {} failed: {}".format(nb, e))
+            failed.append(nb)
+    return failed
+
+def compile_all(version, opts, nb_parallel=1, jobs=None, disk_quota=None):
+    """
+    Scheduler for many option sets: one checkout and fetch for all builds and
+    nb_parallel builds at the same time, sharing the jobs (default: all cores).
+    Option sets with the same dependency_key are built after each other
+    in the same target directory so the dependencies are reused.
+    With disk_quota (bytes), binaries of other versions are evicted afterwards.
+    """
+    print(" === STARTING COMPILATION OF {} OPTION SETS === ".format(len(opts)))
+    bin_dir = BASE_DIR + '/bin/' + version
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+
+    registry.import_legacy(version)
+    _, todo = number_builds(version, opts)
+    if not todo:
+        print("All option sets were compiled before.")
+        return []
+    groups = {}
+    for nb, o in todo:
+        groups.setdefault(dependency_key(o), []).append((nb, o))
+
+    phases = {}
+    work_dir = checkout(version, bin_dir + '/checkout.log', phases)
+
+    if jobs is None:
+        jobs = os.cpu_count()
+    nb_parallel = max(1, min(nb_parallel, len(groups)))
+    jobs_per_build = max(1, jobs // nb_parallel)
+    print("{} builds in {} groups, {} at the same time with {} jobs each".format(
+        len(todo), len(groups), nb_parallel, jobs_per_build))
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nb_parallel) as pool:
+        futures = [pool.submit(build_group, version, g, work_dir, jobs_per_build, phases) for g in groups.values()]
+        for f in futures:
+            failed = failed + f.result()
+    if failed:
+        print("Failed builds: {}".format(failed))
+    if disk_quota is not None:
+        registry.evict(disk_quota, keep_version=version)
+    return failed
+
 # https://stackoverflow.com/questions/5228158/cartesian-product-of-a-dictionary-of-lists
 def product_dict(**kwargs):
     keys = kwargs.keys()
@@ -184,7 +533,21 @@ if __name__ == "__main__":
     opts.append({'toolchain': 'nightly', 'arch': 'native', 'codegen-units': 1,  'lto': 'fat',  'opt-level': 2}) # build 38
     opts.append({'toolchain': 'nightly', 'arch': 'native', 'codegen-units': 1,  'lto': 'thin', 'opt-level': 2}) # build 40
     opts.append({'toolchain': 'nightly', 'arch': 'native', 'codegen-units': 16, 'lto': 'fat',  'opt-level': 3}) # build 45
+
+    # Profile-guided optimization with the benchmark workloads (needs rustup component llvm-tools-preview),
+    # 'bolt': True additionally optimizes the code layout with llvm-bolt
+    # opts.append({'toolchain': 'stable',  'arch': 'native', 'codegen-units': 1,  'lto': 'fat',  'opt-level': 3, 'pgo': True})
+
+    # Further options (defaults in registry.DEFAULT_OPTIONS):
+    #   'linker': 'lld' or 'mold', 'allocator': cargo feature like 'jemalloc-allocator', 
+    #   'panic': 'abort', 'target-feature': like '+avx2,+bmi2', 'relocation-model': like 'static'
+    # opts.append({'toolchain': 'stable',  'arch': 'native', 'codegen-units': 1,  'lto': 'fat',  'opt-level': 3, 'linker': 'mold'})
                         
+    # Number of builds running at the same time; the jobs (cores) are split between them
+    NB_PARALLEL = 2
+    # Maximum disk space (bytes) for binaries, least recently used binaries 
+    # of older versions are removed (None: keep everything)
+    DISK_QUOTA = None
+
     print("Number of different builds: {}".format(len(opts)))
-    for opt in opts:
-        compile(version, opt)    
\ No newline at end of file
+    compile_all(version, opts, nb_parallel=NB_PARALLEL, disk_quota=DISK_QUOTA)    
\ No newline at end of file
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 https://www.math-crypto.com
+# GNU General Public License
+
+# Script to benchmark the builds of a version on several hosts at the same
+# time. The coordinator runs on the host with the binaries (compiled with
+# compile.py) and hands out the benchmark runs of every binary to the
+# agents over HTTP:
+#     python3 distribute.py coordinator [--port 8765] [--agents N]
+#     python3 distribute.py agent http://COORDINATOR:8765 [--name NAME]
+# Every agent runs all tasks (binary, benchmark kind, run) of the session
+# one by one. Binaries are sent once and cached by the agents by SHA-256 in
+#     ~/polkadot-optimized/agent/cache
+# The output of every run is sent back to the coordinator and stored in
+#     ~/polkadot-optimized/output/VERSION/AGENT_NAME/DATE_TIME
+# with a manifest.json as for run_benchmarks.py, so the results are parsed
+# with parse_benchmarks.py as usual. A restarted coordinator continues the
+# sessions of a date with --date DATE_TIME.
+#
+# Plain HTTP: only use it in a trusted network, optionally with a shared
+# token (--token or the environment variable BENCH_TOKEN).
+# Several agents can be tried on one host, e.g.
+#     python3 distribute.py coordinator --agents 2 &
+#     python3 distribute.py agent http://localhost:8765 --name a1 &
+#     python3 distribute.py agent http://localhost:8765 --name a2
+
+import os
+import re
+import json
+import time
+import base64
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+
+import registry
+import run_benchmarks
+
+PORT = 8765
+CACHE_DIR = os.path.expanduser('~/polkadot-optimized/agent/cache')
+# Seconds before a task of an agent that does not report back is handed out again
+LEASE_TIMEOUT = 2 * run_benchmarks.BENCHMARK_TIMEOUT
+# Seconds an agent waits when all its tasks are handed out but not all done
+POLL_INTERVAL = 10
+# Agent names are directory names of the output
+AGENT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+def plan_tasks(targets, settings, seed=None):
+    """
+    Tasks of one agent: NB_RUNS machine runs, NB_EXTRINSIC runs of every
+    workload, NB_STARTUP startup runs and the disk stage (see benchmark_all of
+    run_benchmarks.py) of every target (nb_build, [binary]) with every level
+    of concurrency. Round i has run i of every target and kind in random
+    order (as an interleaved session).
+    """
+    binaries = [nb_build for nb_build, prefix in targets]
+    disk_build = 'official' if 'official' in binaries else (binaries or [None])[0]
+    NB_DISK = settings.get('NB_DISK', 0)
+    disk = run_benchmarks.disk_workloads(settings.get('disk_targets') or [], settings.get('disk_durations') or [])
+    rounds = {}
+    for nb_build, prefix in targets:
+        kinds = [('machine', None, settings['NB_RUNS'])]
+        kinds = kinds + [('extrinsic', w['name'], settings['NB_EXTRINSIC']) for w in settings['workloads']]
+        kinds.append(('startup', None, settings.get('NB_STARTUP', 0)))
+        if nb_build == disk_build:
+            kinds = kinds + [('disk', w['name'], NB_DISK) for w in disk]
+        for kind, workload, nb_runs in kinds:
+            levels = settings['concurrency'] if kind in ['machine', 'extrinsic'] else [1]
+            for c in levels:
+                for i in range(nb_runs):
+                    rounds.setdefault(i, []).append({'nb_build': str(nb_build), 'kind': kind, 'workload': workload,
+                                                     'concurrency': c, 'run': i, 'status': 'todo'})
+    rng = random.Random(seed)
+    tasks = []
+    for i in sorted(rounds):
+        rng.shuffle(rounds[i])
+        tasks = tasks + rounds[i]
+    return tasks
+
+class Coordinator:
+    """
+    Tasks of every agent, kept in the manifest of its session directory.
+    A task that is handed out is leased to the agent until it reports back
+    (or LEASE_TIMEOUT).
+    """
+    def __init__(self, version, targets, settings, date):
+        self.version = version
+        self.settings = settings
+        self.date = date
+        # (nb_build, [binary], sha256)
+        self.targets = targets
+        self.binaries = {sha: prefix[0] for nb_build, prefix, sha in targets}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, name):
+        "Session of agent name, a new one or the one of an earlier coordinator with the same date"
+        if name not in self.sessions:
+            processed_dir = 'output/{}/{}/{}'.format(self.version, name, self.date)
+            manifest = run_benchmarks.load_manifest(processed_dir)
+            if manifest is None:
+                os.makedirs(processed_dir, exist_ok=True)
+                targets = [(nb_build, prefix) for nb_build, prefix, sha in self.targets]
+                manifest = {'version': self.version, 'settings': self.settings, 'targets': targets,
+                            'tasks': plan_tasks(targets, self.settings, self.settings.get('seed')),
+                            'agent': name}
+                run_benchmarks.save_manifest(processed_dir, manifest)
+            print("Session of agent {}: {}".format(name, processed_dir))
+            self.sessions[name] = {'dir': processed_dir, 'manifest': manifest, 'leases': {}}
+        return self.sessions[name]
+
+    def next_task(self, name):
+        """
+        Next task of agent name with everything the agent needs to run it, or
+        None with finished True if all tasks are done
+        """
+        with self.lock:
+            s = self.session(name)
+            now = time.time()
+            s['leases'] = {k: t for k, t in s['leases'].items() if now - t < LEASE_TIMEOUT}
+            todo = [k for k, t in enumerate(s['manifest']['tasks']) if t['status'] == 'todo']
+            free = [k for k in todo if k not in s['leases']]
+            if not free:
+                return {'task': None, 'finished': not todo}
+            k = free[0]
+            s['leases'][k] = now
+            task = dict(s['manifest']['tasks'][k], id=k)
+        sha = [sha for nb_build, prefix, sha in self.targets if str(nb_build) == task['nb_build']][0]
+        workloads = {w['name']: w for w in self.settings['workloads']}
+        if task['kind'] == 'disk':
+            workloads = {w['name']: w for w in run_benchmarks.disk_workloads(self.settings['disk_targets'],
+                                                                              self.settings['disk_durations'])}
+        task['workload'] = workloads.get(task['workload'])
+        task['sha256'] = sha
+        task['cpu_only'] = bool(self.settings.get('NB_DISK'))
+        task.update({'version': self.version, 'date': self.date})
+        print("Agent {}: {} run {} of build {}".format(name, (task['workload'] or {}).get('name', task['kind']),
+                                                         task['run'], task['nb_build']))
+        return {'task': task, 'finished': False}
+
+    def complete(self, name, k, files):
+        "Store the output files {relative path: bytes} of task k of agent name and mark it done"
+        with self.lock:
+            s = self.session(name)
+            processed_dir = Path(s['dir'])
+            for rel, content in files.items():
+                path = processed_dir / rel
+                # only files of the session directory
+                if Path(rel).is_absolute() or '..' in Path(rel).parts:
+                    raise ValueError("Invalid file name {}".format(rel))
+                os.makedirs(path.parent, exist_ok=True)
+                with open(str(path) + ".tmp", "wb") as f:
+                    f.write(content)
+                os.replace(str(path) + ".tmp", path)
+            s['manifest']['tasks'][k]['status'] = 'done'
+            s['leases'].pop(k, None)
+            run_benchmarks.save_manifest(s['dir'], s['manifest'])
+
+    def complete_sessions(self):
+        with self.lock:
+            return [name for name, s in self.sessions.items() if s['manifest']['complete']]
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    POST /task {'name': agent}: next task of the agent
+    GET /binary/SHA256: the binary
+    POST /result {'name': agent, 'id': task, 'files': {path: base64}}: output of a task
+    """
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        token = self.server.token
+        if token and self.headers.get('X-Token') != token:
+            self.send_json({'error': 'unauthorized'}, 403)
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        m = re.match(r"^/binary/([0-9a-f]{64})$", self.path)
+        if not m or m.group(1) not in self.server.coordinator.binaries:
+            self.send_json({'error': 'not found'}, 404)
+            return
+        binary = self.server.coordinator.binaries[m.group(1)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(binary)))
+        self.end_headers()
+        with open(binary, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        name = request.get('name', '')
+        if not AGENT_NAME.match(name):
+            self.send_json({'error': 'invalid agent name'}, 400)
+            return
+        coordinator = self.server.coordinator
+        if self.path == '/task':
+            self.send_json(coordinator.next_task(name))
+        elif self.path == '/result':
+            files = {rel: base64.b64decode(content) for rel, content in request['files'].items()}
+            try:
+                coordinator.complete(name, int(request['id']), files)
+            except ValueError as e:
+                self.send_json({'error': str(e)}, 400)
+                return
+            self.send_json({'ok': True})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def log_message(self, format, *args):
+        # the coordinator prints the tasks it hands out
+        pass
+
+def coordinator(version, settings, port=PORT, date=None, agents=None, token=None):
+    """
+    Serve the tasks of all builds of version and the official binary
+    (settings as in run() of run_benchmarks.py) to the agents. With agents,
+    it stops once that many agents have done all their tasks.
+    """
+    os.chdir(os.path.expanduser('~/polkadot-optimized'))
+    registry.import_legacy(version)
+    targets = [(b['nb'], [b['path']], b['sha256']) for b in registry.builds(version)]
+    binary = run_benchmarks.official_binary(version)
+    targets.append(("official", [binary], registry.sha256sum(binary)))
+    date = date or datetime.now().strftime("%Y-%b-%d_%Hh%M")
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.coordinator = Coordinator(version, targets, settings, date)
+    server.token = token
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print("Coordinator of version {} (session {}) on port {}".format(version, date, port))
+    try:
+        while agents is None or len(server.coordinator.complete_sessions()) < agents:
+            time.sleep(1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("All tasks of {} agents are done.".format(agents))
+
+def fetch_binary(url, sha, headers):
+    "Path of the binary with SHA-256 sha in the cache of the agent, downloaded if needed"
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    binary = os.path.join(CACHE_DIR, sha + '.bin')
+    if os.path.exists(binary):
+        return binary
+    print("Downloading binary {}".format(sha[:12]))
+    # own file name, agents on the same host share the cache
+    fd, part = tempfile.mkstemp(dir=CACHE_DIR, prefix=sha + '.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f, requests.get(url + '/binary/' + sha, headers=headers, stream=True) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(1 << 20):
+                f.write(chunk)
+        if registry.sha256sum(part) != sha:
+            raise RuntimeError("Binary {} damaged during the download".format(sha))
+    except BaseException:
+        os.remove(part)
+        raise
+    os.chmod(part, 0o755)
+    os.replace(part, binary)
+    return binary
+
+def agent(url, name=None, cores=None, max_load=None, counters=True, token=None):
+    "Run the tasks of the coordinator at url until all are done"
+    name = name or socket.gethostname()
+    headers = {'X-Token': token} if token else {}
+    def post(path, data):
+        resp = requests.post(url + path, json=dict(data, name=name), headers=headers)
+        resp.raise_for_status()
+        return resp.json()
+
+    while True:
+        answer = post('/task', {})
+        task = answer['task']
+        if task is None:
+            if answer['finished']:
+                break
+            time.sleep(POLL_INTERVAL)
+            continue
+        binary = fetch_binary(url, task['sha256'], headers)
+        work_dir = tempfile.mkdtemp(prefix="polkadot-agent-")
+        try:
+            # same layout as a session, benchmark_once takes version, host and date from it
+            processed_dir = os.path.join(work_dir, task['version'], name, task['date'])
+            os.makedirs(processed_dir)
+            run_benchmarks.benchmark_once([binary], task['kind'], task['nb_build'], task['run'], processed_dir,
+                                          cores=cores, max_load=max_load, workload=task['workload'],
+                                          concurrency=task['concurrency'], counters=counters,
+                                          cpu_only=task['cpu_only'])
+            files = {}
+            for f in Path(processed_dir).rglob('*'):
+                if f.is_file():
+                    files[str(f.relative_to(processed_dir))] = base64.b64encode(f.read_bytes()).decode()
+            post('/result', {'id': task['id'], 'files': files})
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print("All tasks of agent {} are done.".format(name))
+
+if __name__ == "__main__":
+    # Change version and the runs of every agent here (as in run_benchmarks.py)
+    version = "0.9.27"
+    SETTINGS = {'NB_RUNS': 10, 'NB_EXTRINSIC': 10, 'workloads': run_benchmarks.EXTRINSIC_WORKLOADS,
+                'concurrency': [1], 'NB_STARTUP': 10, 'NB_DISK': 3,
+                'disk_targets': run_benchmarks.DISK_TARGETS, 'disk_durations': [30], 'seed': None}
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='mode', required=True)
+    p = sub.add_parser('coordinator')
+    p.add_argument('--port', type=int, default=PORT)
+    p.add_argument('--date', help="continue the sessions of this DATE_TIME")
+    p.add_argument('--agents', type=int, help="stop when this many agents are done")
+    p = sub.add_parser('agent')
+    p.add_argument('url')
+    p.add_argument('--name', help="name of the host in the output (default: hostname)")
+    p.add_argument('--cores', type=int, nargs='*', help="pin the benchmarks to these cores")
+    p.add_argument('--max-load', type=float, help="wait for a quiet host (CPU usage in %%)")
+    for p in sub.choices.values():
+        p.add_argument('--token', default=os.environ.get('BENCH_TOKEN'))
+    args = parser.parse_args()
+    if args.mode == 'coordinator':
+        coordinator(version, SETTINGS, args.port, args.date, args.agents, args.token)
+    else:
+        agent(args.url.rstrip('/'), args.name, args.cores, args.max_load, token=args.token)
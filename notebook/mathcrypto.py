@@ -1,14 +1,22 @@
 # Copyright 2022 https://www.math-crypto.com
 # GNU General Public License
 
+import os
+import sys
 import math
 import random
+from statistics import NormalDist
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib 
 from paretoset import paretoset
 
+# column types of the dataset (parse_benchmarks.py) and build options (registry.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import parse_benchmarks
+import registry
+
 # Nice boxplot with x axis sorted according to median
 def boxplot_sorted(df, by, column, ax, ascending=True):
     boxprops = dict(linewidth=1.5,color='darkblue')
@@ -53,8 +61,13 @@ def labelled_scatter_plot(df, x_col, y_col, labels_to_plot):
     plt.show()
     return fig    
 
-def load_clean_benchmark(path, extrinsic=False):
-    "Load the output bench files. The extrinsic is only Remark (for now)."
+def load_clean_benchmark(path, extrinsic=False, startup=False):
+    """
+    Load the output bench files. The extrinsic file has one row per run and
+    workload; the median and std of workload W are in columns Extr-W and
+    Extr-W-Std (NaN in the rows of the other workloads). The startup file
+    has the startup latencies, peak RSS and sizes as they are.
+    """
     df = pd.read_feather(path)
     df['arch'] = df['arch'].fillna('none')
     df['host'] = df['host'].astype('category')
@@ -64,15 +77,37 @@ def load_clean_benchmark(path, extrinsic=False):
     df['codegen-units'] = df['codegen-units'].astype('int') # 1 or 16
     df['lto'] = df['lto'].astype('category') # off, False, thin, fat
     df['nb_run'] = df['nb_run'].astype('int')
+    # instances at the same time (scaling runs), older sessions only have single runs
+    if 'concurrency' not in df.columns:
+        df['concurrency'] = 1
+        df['instance'] = 0
+    df['concurrency'] = df['concurrency'].astype('int')
+    df['instance'] = df['instance'].astype('int')
     df['opt-level'] = df['opt-level'].astype('int')  # 2 or 3
+    # options of newer builds
+    for col in ['linker', 'allocator', 'panic', 'target-feature', 'relocation-model']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
     
-    if not extrinsic:
+    if startup:
+        pass
+    elif not extrinsic:
         df['SR25519-Verify'] = df['SR25519-Verify']*1000 # same as in benchmark palette
     else:
-        df = df.rename(columns={'med': 'Extr-Remark'})
-        df = df.rename(columns={'std': 'Extr-Remark-Std'})
+        if 'workload' not in df.columns:
+            # older sessions only have the Remark extrinsic
+            df['workload'] = 'Remark'
+        for w in df['workload'].unique():
+            sel = df['workload'] == w
+            df.loc[sel, 'Extr-' + w] = df.loc[sel, 'med']
+            df.loc[sel, 'Extr-' + w + '-Std'] = df.loc[sel, 'std']
+        df['workload'] = df['workload'].astype('category')
     return df
 
+def extrinsic_workloads(df_ex):
+    "Extrinsic columns of all workloads in df_ex, e.g. ['Extr-Remark', 'Extr-Transfer']"
+    return ['Extr-' + w for w in df_ex['workload'].cat.categories]
+
 def load_both_benchmarks(path):
     "Load .feather file with benchmark results and its intrinsic (Remark) counterpart"
     "Usage: (df, df_ex) = load_both_benchmarks('processed/todo/0.9.27_host-Aug-23_09h37.feather')"    
@@ -83,7 +118,224 @@ def load_both_benchmarks(path):
     print("Max CPU is {}%".format(max(df_ex.loc[:,"cpu"])))
     return (df,df_ex)
 
-def calc_stats(df, score, extrinsic=False):
+def load_startup_benchmark(path):
+    "Load the startup runs of the .feather file with benchmark results (None if the session has none)"
+    "Usage: df_st = load_startup_benchmark('processed/todo/0.9.27_host-Aug-23_09h37.feather')"
+    st_path = "/".join(path.split("/")[0:-1]) + "/startup_"+ path.split("/")[-1]
+    if not os.path.exists(st_path):
+        return None
+    return load_clean_benchmark(st_path, startup=True)
+
+def load_disk_benchmark(path):
+    "Load the disk stage of the .feather file with benchmark results (None if the session has none)"
+    "Usage: df_disk = load_disk_benchmark('processed/todo/0.9.27_host-Aug-23_09h37.feather')"
+    disk_path = "/".join(path.split("/")[0:-1]) + "/disk_"+ path.split("/")[-1]
+    if not os.path.exists(disk_path):
+        return None
+    df = pd.read_feather(disk_path)
+    for col in ['host', 'ver', 'date', 'target']:
+        df[col] = df[col].astype('category')
+    return df
+
+# Decoded tables of load_dataset, valid as long as the ingest manifest is unchanged
+_DATASET_CACHE = {}
+
+def _filter_key(filters):
+    return tuple(sorted((col, tuple(v) if isinstance(v, (list, tuple, set)) else (v,))
+                        for col, v in (filters or {}).items()))
+
+def load_dataset(table='machine', columns=None, filters=None, dataset='../processed/dataset'):
+    """
+    Load a table (machine, extrinsic, disk or startup) of the dataset of
+    parse_benchmarks.py, partitioned by ver, host and date. Only the given
+    columns (default all) and the rows with the filters, e.g.
+    {'ver': '0.9.27', 'host': ['work-pc', 'vm']}, are read; filters on ver,
+    host and date skip the other partitions. The files are memory mapped and
+    the result is cached until the next parse. Same columns as
+    load_clean_benchmark (Extr-W for the extrinsic table).
+    Usage: df = load_dataset('machine', filters={'ver': '0.9.27'})
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+
+    root = os.path.abspath(os.path.join(dataset, table))
+    manifest = os.path.join(os.path.dirname(os.path.abspath(dataset)), 'ingest', 'manifest.json')
+    token = None
+    if os.path.exists(manifest):
+        st = os.stat(manifest)
+        token = (st.st_mtime_ns, st.st_size)
+    key = (root, None if columns is None else tuple(columns), _filter_key(filters))
+    if key in _DATASET_CACHE and _DATASET_CACHE[key][0] == token:
+        return _DATASET_CACHE[key][1].copy(deep=False)
+
+    fs = pyarrow.fs.LocalFileSystem(use_mmap=True)
+    partitioning = ds.partitioning(flavor='hive', dictionaries='infer')
+    data = ds.dataset(root, filesystem=fs, format='parquet', partitioning=partitioning)
+    # older sessions have fewer (or other) columns
+    schema = pa.unify_schemas([f.physical_schema for f in data.get_fragments()] + [data.partitioning.schema],
+                              promote_options='permissive')
+    # same types in all sessions, also for the columns that are missing (all null) in some
+    schema = parse_benchmarks.dataset_schema(schema)
+    data = ds.dataset(root, schema=schema, filesystem=fs, format='parquet', partitioning=partitioning)
+
+    if columns is not None:
+        needed = {'extrinsic': ['workload', 'med', 'std']}.get(table, [])
+        columns = list(columns) + [c for c in needed if c not in columns]
+    condition = None
+    for col, values in _filter_key(filters):
+        expr = ds.field(col).isin(list(values))
+        condition = expr if condition is None else condition & expr
+    nullable = {pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}
+    df = data.to_table(columns=columns, filter=condition).to_pandas(types_mapper=nullable.get)
+    for col in ['ver', 'host', 'date']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    if table == 'machine' and 'SR25519-Verify' in df.columns:
+        df['SR25519-Verify'] = df['SR25519-Verify']*1000 # same as in benchmark palette
+    elif table == 'extrinsic':
+        df['workload'] = df['workload'].cat.remove_unused_categories()
+        for w in df['workload'].cat.categories:
+            sel = df['workload'] == w
+            df.loc[sel, 'Extr-' + w] = df.loc[sel, 'med']
+            df.loc[sel, 'Extr-' + w + '-Std'] = df.loc[sel, 'std']
+    for col in df.select_dtypes('category').columns:
+        df[col] = df[col].cat.remove_unused_categories()
+    _DATASET_CACHE[key] = (token, df)
+    return df.copy(deep=False)
+
+def load_both_datasets(filters=None, dataset='../processed/dataset'):
+    "Machine and extrinsic tables of the dataset, e.g. (df, df_ex) = load_both_datasets({'ver': '0.9.27'})"
+    return (load_dataset('machine', filters=filters, dataset=dataset),
+            load_dataset('extrinsic', filters=filters, dataset=dataset))
+
+def calc_disk_stats(df_disk, score):
+    "Median and Δ (as calc_stats) of a disk score per storage target and duration"
+    stats = df_disk.groupby(["target", "disk_duration"], observed=True)[score].agg(['median', 'sem'])
+    stats["Δ-" + score] = 1.25 * 1.96 * stats['sem']
+    return stats.rename(columns={"median": score})[[score, "Δ-" + score]]
+
+def _run_matrix(df, scores):
+    "Builds and an array builds x runs x scores of the values, NaN's (and padding) after the values of each build"
+    df = df[["nb_build"] + scores].dropna(how='all', subset=scores)
+    groups = df.groupby("nb_build", sort=True)
+    builds = list(groups.groups.keys())
+    nb_max = groups.size().max() if len(df) else 0
+    values = np.full((len(builds), nb_max, len(scores)), np.nan)
+    for b, (_, runs) in enumerate(groups):
+        values[b, :len(runs)] = runs[scores].to_numpy(dtype=float)
+    # sorting moves the NaN's to the end
+    return builds, np.sort(values, axis=1)
+
+def _medians(values, n):
+    "Medians along axis -2 of values with the first n (broadcast over the other axes) sorted values valid"
+    n = np.broadcast_to(n, values.shape[:-2] + values.shape[-1:])
+    lo = np.maximum((n - 1) // 2, 0)[..., None, :]
+    hi = np.maximum(n // 2, 0)[..., None, :]
+    med = (np.take_along_axis(values, lo, axis=-2) + np.take_along_axis(values, hi, axis=-2)) / 2
+    return np.where(n > 0, med[..., 0, :], np.nan)
+
+def _resample(values, n, rng, nb_boot):
+    "Bootstrap medians (builds x nb_boot x scores), drawn with one batch of random numbers"
+    builds, nb_max, _ = values.shape
+    u = rng.random((builds, nb_boot, nb_max))
+    idx = (u[..., None] * n[:, None, None, :]).astype(int)
+    samples = np.take_along_axis(values[:, None, :, :], np.minimum(idx, nb_max - 1), axis=2)
+    samples = np.where(np.arange(nb_max)[None, None, :, None] < n[:, None, None, :], samples, np.nan)
+    return _medians(np.sort(samples, axis=2), n[:, None, :])
+
+def _jackknife(values, n):
+    "Leave-one-out medians (builds x runs x scores), NaN for the padding"
+    nb_max = values.shape[1]
+    keep = ~np.eye(nb_max, dtype=bool)
+    loo = np.where(keep[None, :, :, None], values[:, None, :, :], np.nan)
+    loo = _medians(np.sort(loo, axis=2), np.maximum(n - 1, 0)[:, None, :])
+    return np.where(np.arange(nb_max)[None, :, None] < n[:, None, :], loo, np.nan)
+
+def _acceleration(*jacks):
+    "BCa acceleration from the leave-one-out estimates of one or more independent samples"
+    num = 0
+    den = 0
+    for jack in jacks:
+        u = np.nanmean(jack, axis=1, keepdims=True) - jack
+        num = num + np.nansum(u**3, axis=1)
+        den = den + np.nansum(u**2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / (6 * den**1.5), 0.0)
+
+def _interval(boot, estimate, method, acceleration=None, level=0.95):
+    "Percentile or BCa interval (low, high) of the bootstrap replicates boot (builds x nb_boot x scores)"
+    alpha = np.array([(1 - level) / 2, (1 + level) / 2])
+    if method == 'bca':
+        nb_boot = boot.shape[1]
+        cdf = np.vectorize(NormalDist().cdf)
+        inv = np.vectorize(NormalDist().inv_cdf)
+        p = (boot < estimate[:, None, :]).mean(axis=1) + 0.5 * (boot == estimate[:, None, :]).mean(axis=1)
+        z0 = inv(np.clip(p, 1 / (2*nb_boot), 1 - 1 / (2*nb_boot)))
+        z = inv(alpha)[:, None, None]
+        q = cdf(z0 + (z0 + z) / (1 - acceleration * (z0 + z)))
+    else:
+        q = np.broadcast_to(alpha[:, None, None], (2,) + estimate.shape)
+    # quantiles q (per build and score) of the sorted replicates, linear interpolation
+    boot = np.sort(boot, axis=1)
+    pos = q * (boot.shape[1] - 1)
+    below = np.floor(pos).astype(int)
+    above = np.minimum(below + 1, boot.shape[1] - 1)
+    low_high = []
+    for i in range(2):
+        b = np.take_along_axis(boot, below[i][:, None, :], axis=1)[:, 0, :]
+        a = np.take_along_axis(boot, above[i][:, None, :], axis=1)[:, 0, :]
+        low_high.append(b + (pos[i] - below[i]) * (a - b))
+    return low_high
+
+def bootstrap_stats(df, scores, method='percentile', nb_boot=2000, seed=1, reference='official'):
+    """
+    Bootstrap 95% CIs (method 'percentile' or 'bca') of the median of the
+    runs of every build, for all scores at once. Columns per score S: S
+    (median), Δ-S (half width of a box around the median that contains the
+    CI, as in calc_stats), S-Low and S-High, and, if the reference build is
+    in df, Ratio-S (median / median of reference) with Ratio-S-Low and
+    Ratio-S-High. Same seed, same result.
+    """
+    builds, values = _run_matrix(df, scores)
+    n = (~np.isnan(values)).sum(axis=1)
+    rng = np.random.default_rng(seed)
+    boot = _resample(values, n, rng, nb_boot)
+    estimate = _medians(values, n)
+    jack = _jackknife(values, n) if method == 'bca' else None
+    low, high = _interval(boot, estimate, method, None if jack is None else _acceleration(jack))
+    stats = pd.DataFrame(index=pd.Index(builds, name="nb_build"))
+    for k, score in enumerate(scores):
+        stats[score] = estimate[:, k]
+        stats["Δ-" + score] = np.maximum(estimate[:, k] - low[:, k], high[:, k] - estimate[:, k])
+        stats[score + "-Low"] = low[:, k]
+        stats[score + "-High"] = high[:, k]
+    if reference in builds:
+        r = builds.index(reference)
+        ratio = estimate / estimate[r]
+        boot_ratio = boot / boot[r][None, :, :]
+        acc = None
+        if method == 'bca':
+            # leave out a run of the build or of the reference
+            acc = _acceleration(jack / estimate[r], estimate[:, None, :] / jack[r][None, :, :])
+            acc[r] = 0.0
+        low, high = _interval(boot_ratio, ratio, method, acc)
+        for k, score in enumerate(scores):
+            stats["Ratio-" + score] = ratio[:, k]
+            stats["Ratio-" + score + "-Low"] = low[:, k]
+            stats["Ratio-" + score + "-High"] = high[:, k]
+    return stats
+
+def calc_stats(df, score, extrinsic=False, method='normal', **kwargs):
+    """
+    Median and its 95% CI half width Δ per build. method 'normal' assumes
+    normality (and for extrinsics uses the spread within the first run);
+    'percentile' and 'bca' bootstrap the runs (see bootstrap_stats, kwargs
+    are passed on).
+    """
+    if method != 'normal':
+        return bootstrap_stats(df, [score], method=method, **kwargs)
     if not extrinsic:
         # there is a lot variability on the cpu score 
         # so we take a median and calculate standard error assuming normality
@@ -95,30 +347,86 @@ def calc_stats(df, score, extrinsic=False):
     else: 
         # extrinsic benchmark already do their own repititions
         # we take over the median and std error of one run
-        stats = df[df["nb_run"]==0][["nb_build", "Extr-Remark", "Extr-Remark-Std"]]
-        # N=100 -- TODO extract from bench file
-        N = 100.0
-        stats['sem'] = stats["Extr-Remark-Std"]/np.sqrt(N)
+        stats = df[(df["nb_run"]==0) & df[score].notna()]
+        # number of repetitions from the bench file (older files: the default 100)
+        if 'nb_samples' in stats.columns:
+            N = stats['nb_samples'].fillna(100.0)
+        else:
+            N = 100.0
+        stats = stats[["nb_build", score, score + "-Std"]].copy()
+        stats['sem'] = stats[score + "-Std"]/np.sqrt(N)
         stats['± mean'] = 1.96 * stats['sem'] # 95% CI
         stats['± median'] = 1.25 * stats['± mean'] 
-        sum_stats = stats[["nb_build", "Extr-Remark", "± median"]]
+        sum_stats = stats[["nb_build", score, "± median"]]
         sum_stats = sum_stats.rename(columns={"± median": "Δ-" + score})
         sum_stats = sum_stats.set_index("nb_build")
     return sum_stats
 
-def calc_medians_df_df_ex(df, scores, df_ex, extr):
-    "Assemble one dataframe with scores (array) from df and extr (array) from df_ex"
+def calc_medians_df_df_ex(df, scores, df_ex, extr, concurrency=1, df_st=None, startup=[],
+                          method='normal', **kwargs):
+    """
+    Assemble one dataframe with scores (array) from df and extr (array) from df_ex
+    Any subset of the workloads can be used: extr=extrinsic_workloads(df_ex)
+    for all of them or e.g. extr=['Extr-Transfer'].
+    Only the runs with the given concurrency (per instance) are used.
+    startup (array, e.g. ['Start-Warm', 'RSS-Dev', 'Size-text']) are taken
+    from the startup runs df_st (see load_startup_benchmark).
+    method 'percentile' or 'bca' gives bootstrap CIs (see bootstrap_stats).
+    """
+    df = df[df['concurrency'] == concurrency]
+    df_ex = df_ex[df_ex['concurrency'] == concurrency]
+    if method != 'normal':
+        stats = [bootstrap_stats(df, scores, method=method, **kwargs)]
+        if extr:
+            stats.append(bootstrap_stats(df_ex, extr, method=method, **kwargs))
+        if startup:
+            stats.append(bootstrap_stats(df_st, startup, method=method, **kwargs))
+        return pd.concat(stats, axis=1)
     stats = []
     for s in scores:
         stats.append(calc_stats(df, s))
     for e in extr:
         stats.append(calc_stats(df_ex, e, extrinsic=True))
+    for st in startup:
+        stats.append(calc_stats(df_st, st))
     medians = pd.concat(stats, axis=1)
     return medians
 
-def find_exact_pareto(medians, scores, extrinsics):
-    sense = ["max"] * len(scores) + ["min"] * len(extrinsics)
-    mask = paretoset(medians[scores+extrinsics], sense=sense)
+def calc_scaling(df, score, extrinsic=False):
+    """
+    Scaling of score with the number of concurrent instances per build:
+    median per instance and median of the aggregate of a run (throughput
+    summed over the instances, mean latency for an extrinsic) for every
+    concurrency, with the efficiency relative to a single instance
+    """
+    df = df[df[score].notna()]
+    per_run = df.groupby(["nb_build", "concurrency", "nb_run"], observed=True)[score]
+    aggregate = per_run.mean() if extrinsic else per_run.sum()
+    stats = pd.DataFrame({"per instance": df.groupby(["nb_build", "concurrency"], observed=True)[score].median(),
+                          "aggregate": aggregate.groupby(["nb_build", "concurrency"], observed=True).median()})
+    single = stats["per instance"].xs(1, level="concurrency")
+    ratio = stats["per instance"] / single.reindex(stats.index.get_level_values("nb_build")).to_numpy()
+    # 1 is perfect scaling: no loss per instance when the other cores are busy
+    stats["efficiency"] = 1/ratio if extrinsic else ratio
+    return stats
+
+def plot_scaling(df, score, builds, extrinsic=False, column="aggregate"):
+    "Scaling curves of score (column of calc_scaling) against the number of instances for builds"
+    stats = calc_scaling(df, score, extrinsic)
+    fig, ax = plt.subplots(1, figsize=(7.5, 5))
+    for b in builds:
+        curve = stats.loc[b][column]
+        ax.plot(curve.index, curve.to_numpy(), marker='o', label=b)
+    ax.set_xlabel("concurrency")
+    ax.set_ylabel(score + " (" + column + ")")
+    ax.set_xscale('log', base=2)
+    ax.legend()
+    return fig
+
+def find_exact_pareto(medians, scores, extrinsics, startup=[]):
+    "Pareto builds: scores are maximized, extrinsics and startup metrics (e.g. Start-Warm, Size) minimized"
+    sense = ["max"] * len(scores) + ["min"] * len(extrinsics) + ["min"] * len(startup)
+    mask = paretoset(medians[scores+extrinsics+startup], sense=sense)
     pareto = medians.index[mask].to_numpy()
     return(pareto.tolist())
 
@@ -131,28 +439,44 @@ def boxes_distance(A_min, A_max, B_min, B_max):
     dist = np.linalg.norm(np.concatenate([u, v]))
     return dist
 
-def find_all_points_close(medians, pareto, x, dx, nudge=1.0):
-    pareto_ext = []
-    for bA in pareto:
-        A_min = medians.loc[bA][x].to_numpy() - nudge*medians.loc[bA][dx].to_numpy()
-        A_max = medians.loc[bA][x].to_numpy() + nudge*medians.loc[bA][dx].to_numpy()
-
-        dists_AB = {}
-        for bB in medians.index:
-            B_min = medians.loc[bB][x].to_numpy() - nudge*medians.loc[bB][dx].to_numpy()
-            B_max = medians.loc[bB][x].to_numpy() + nudge*medians.loc[bB][dx].to_numpy()
-            dAB = boxes_distance(A_min, A_max, B_min, B_max)
-            if dAB < 1e-1:
-                pareto_ext.append(bB) 
-    return np.unique(pareto_ext).tolist()
-
-def plot_boxplots_df_df_ex(df, scores, df_ex, extrinsics):
+def boxes_distances(A_min, A_max, B_min, B_max):
+    "Matrix of boxes_distance between every box of A (rows) and every box of B (columns)"
+    u = np.maximum(A_min[:, None, :] - B_max[None, :, :], 0)
+    v = np.maximum(B_min[None, :, :] - A_max[:, None, :], 0)
+    return np.linalg.norm(np.concatenate([u, v], axis=2), axis=2)
+
+def find_all_points_close(medians, pareto, x, dx, nudge=1.0, chunk=None):
+    """
+    Pareto builds and all builds whose box (x ± nudge*dx) is closer than 0.1
+    to the box of a Pareto build. With chunk, the distances are computed for
+    chunk builds at a time (less memory for very many builds).
+    """
+    values = medians[x].to_numpy(dtype=float)
+    deltas = medians[dx].to_numpy(dtype=float)
+    B_min = values - nudge*deltas
+    B_max = values + nudge*deltas
+    rows = medians.index.get_indexer_for(pareto)
+    if (rows < 0).any():
+        raise KeyError([b for b, r in zip(pareto, rows) if r < 0])
+    A_min = B_min[rows]
+    A_max = B_max[rows]
+
+    close = np.zeros(len(medians), dtype=bool)
+    step = chunk or max(len(medians), 1)
+    for start in range(0, len(medians), step):
+        dAB = boxes_distances(A_min, A_max, B_min[start:start+step], B_max[start:start+step])
+        close[start:start+step] = (dAB < 1e-1).any(axis=0)
+    return np.unique(medians.index[close]).tolist()
+
+def plot_boxplots_df_df_ex(df, scores, df_ex, extrinsics, concurrency=1):
     """    
-    Plot ordered boxplots of scores and extrinsiscs
+    Plot ordered boxplots of scores and extrinsiscs (of the runs with concurrency instances)
     NB: to filter builds  df_sel = df[df["nb_build"].isin(pareto)]
                           df_ex_sel = df_ex[df_ex["nb_build"].isin(pareto)]
     """
-    medians = calc_medians_df_df_ex(df, scores, df_ex, extrinsics)
+    df = df[df['concurrency'] == concurrency]
+    df_ex = df_ex[df_ex['concurrency'] == concurrency]
+    medians = calc_medians_df_df_ex(df, scores, df_ex, extrinsics, concurrency)
     nb = len(scores)+len(extrinsics)
     fig, ax = plt.subplots(1, nb, figsize=(nb*7.5, 5))
     i = 0
@@ -170,8 +494,145 @@ def plot_boxplots_df_df_ex(df, scores, df_ex, extrinsics):
             axi = ax
         else:
             axi = ax[i]
-        boxplot_sorted(df_ex, by="nb_build", column="Extr-Remark", ax=axi, ascending=False)
+        boxplot_sorted(df_ex[df_ex[e].notna()], by="nb_build", column=e, ax=axi, ascending=False)
         axi.axhline(medians.loc["official"][e],  c='grey', lw=3)
         axi.set_title(e)
         i = i+1
-    return fig
\ No newline at end of file
+    return fig
+
+
+# Build options that identify a build across versions (0.9.26 used codegen, lto_ldd and profile),
+# options of newer builds are left out when they have the default value (as in registry.py)
+OPTIONS = (['toolchain', 'arch', 'codegen-units', 'lto', 'opt-level', 'codegen', 'lto_ldd', 'profile']
+           + list(registry.DEFAULT_OPTIONS))
+OPTION_DEFAULTS = registry.DEFAULT_OPTIONS
+
+def option_sets(df):
+    "Label of the build options of every row, e.g. 'toolchain=nightly arch=native codegen-units=1 lto=fat opt-level=2'"
+    def text(col, v):
+        if col == 'arch' and pd.isna(v):
+            v = 'none'
+        if pd.isna(v) or v == OPTION_DEFAULTS.get(col):
+            return None
+        return col + '=' + (str(int(v)) if isinstance(v, float) else str(v))
+    cols = [c for c in OPTIONS if c in df.columns]
+    labels = [' '.join(t for t in (text(c, v) for c, v in zip(cols, row)) if t is not None)
+              for row in df[cols].astype(object).itertuples(index=False)]
+    label = pd.Series(labels, index=df.index)
+    # official and docker builds are not built with these options
+    named = ~df['nb_build'].astype(str).str.isdigit()
+    return label.where(~named, df['nb_build'].astype(str))
+
+def normalize_to_official(df, metrics, reference='official'):
+    "Metrics divided by the median of the reference build of the same session (ver, host and date)"
+    session = ['ver', 'host', 'date']
+    ref = df[df['nb_build'] == reference].groupby(session, observed=True)[metrics].median()
+    ref = df[session].join(ref, on=session)[metrics]
+    return df[metrics] / ref.to_numpy()
+
+def _padded(groups, values):
+    "Array groups x max size of values, NaN padded (groups are 0..G-1)"
+    order = np.argsort(groups, kind='stable')
+    groups = groups[order]
+    counts = np.bincount(groups)
+    pos = np.arange(len(groups)) - np.repeat(np.cumsum(counts) - counts, counts)
+    out = np.full((len(counts), counts.max() if len(counts) else 0), np.nan)
+    out[groups, pos] = values[order]
+    return out
+
+def mann_whitney(x, y):
+    """
+    Two-sided Mann-Whitney U test of every row of x against the same row of
+    y (NaN padded), with tie and continuity correction (normal
+    approximation). Returns U of x, the rank-biserial correlation
+    2U/(nx ny) - 1 (positive: x larger) and the p-values.
+    """
+    nx = (~np.isnan(x)).sum(axis=1)
+    ny = (~np.isnan(y)).sum(axis=1)
+    U = ((x[:, :, None] > y[:, None, :]).sum(axis=(1, 2))
+         + 0.5 * (x[:, :, None] == y[:, None, :]).sum(axis=(1, 2)))
+    # sum of t^3 - t over the groups of t equal values: every value adds t^2 - 1
+    both = np.concatenate([x, y], axis=1)
+    equal = (both[:, :, None] == both[:, None, :]).sum(axis=2)
+    tie_sum = np.where(np.isnan(both), 0, equal**2 - 1).sum(axis=1)
+    n = nx + ny
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(nx * ny / 12 * ((n + 1) - tie_sum / (n * (n - 1))))
+        z = np.maximum(np.abs(U - nx * ny / 2) - 0.5, 0) / sigma
+        p = np.where(sigma > 0, np.vectorize(math.erfc)(z / math.sqrt(2)), 1.0)
+        effect = 2 * U / (nx * ny) - 1
+    return U, effect, p
+
+def benjamini_hochberg(p):
+    "False discovery rate adjusted p-values (q-values)"
+    p = np.asarray(p, dtype=float)
+    order = np.argsort(p)
+    q = p[order] * len(p) / np.arange(1, len(p) + 1)
+    q = np.minimum.accumulate(q[::-1])[::-1]
+    out = np.empty_like(q)
+    out[order] = np.minimum(q, 1)
+    return out
+
+def _version_key(ver):
+    return tuple(int(v) if v.isdigit() else v for v in str(ver).split('.'))
+
+def find_regressions(df, metrics, lower=[], concurrency=1, alpha=0.05, min_runs=3, all_tests=False):
+    """
+    Compare every numbered build configuration against itself in consecutive
+    versions on the same host. Builds are matched by their options (see option_sets)
+    and every run is divided by the median of official in its session. For
+    every (option set, metric, host) a Mann-Whitney test of the new against
+    the previous version is done (all at once), the p-values are adjusted
+    for the number of tests (Benjamini-Hochberg). metrics in lower (e.g.
+    extrinsics, startup) are better when lower.
+    Returns the significant (q < alpha) speedups and regressions ranked by
+    effect size (|rank-biserial|), or all tests with all_tests.
+    Usage: report = find_regressions(load_dataset('machine'), ['BLAKE2-256', 'SR25519-Verify'])
+           report_ex = find_regressions(load_dataset('extrinsic'), ['Extr-Remark'], lower=['Extr-Remark'])
+    """
+    if 'concurrency' in df.columns:
+        df = df[df['concurrency'] == concurrency]
+    df = df.reset_index(drop=True)
+    long = pd.DataFrame({'option': option_sets(df), 'host': df['host'].astype(str), 'ver': df['ver'].astype(str)})
+    long = long.join(normalize_to_official(df, metrics))
+    # only the numbered builds, official and docker are the reference
+    long = long[df['nb_build'].astype(str).str.isdigit()]
+    long = long.melt(id_vars=['option', 'host', 'ver'], value_vars=metrics, var_name='metric').dropna()
+
+    # previous version of every version per host
+    pairs = []
+    for host, vers in long.groupby('host')['ver'].unique().items():
+        vers = sorted(vers, key=_version_key)
+        pairs += [(host, old, new) for old, new in zip(vers[:-1], vers[1:])]
+    if not pairs:
+        return pd.DataFrame()
+    pairs = pd.DataFrame(pairs, columns=['host', 'previous', 'ver'])
+    old = long.rename(columns={'ver': 'previous'}).merge(pairs, on=['host', 'previous'])
+    new = long.merge(pairs, on=['host', 'ver'])
+
+    key = ['option', 'metric', 'host', 'previous', 'ver']
+    tests = (new.groupby(key).size().rename('runs').to_frame()
+             .join(old.groupby(key).size().rename('runs previous'), how='inner').reset_index())
+    tests = tests[(tests['runs'] >= min_runs) & (tests['runs previous'] >= min_runs)].reset_index(drop=True)
+    if tests.empty:
+        return tests
+    ids = pd.MultiIndex.from_frame(tests[key])
+    new = new[new.set_index(key).index.isin(ids)]
+    old = old[old.set_index(key).index.isin(ids)]
+    x = _padded(ids.get_indexer(new.set_index(key).index), new['value'].to_numpy())
+    y = _padded(ids.get_indexer(old.set_index(key).index), old['value'].to_numpy())
+    U, effect, p = mann_whitney(x, y)
+
+    tests['vs official previous'] = np.nanmedian(y, axis=1)
+    tests['vs official'] = np.nanmedian(x, axis=1)
+    tests['change'] = tests['vs official'] / tests['vs official previous'] - 1
+    sign = np.where(tests['metric'].isin(lower), -1, 1)
+    tests['rank-biserial'] = effect * sign
+    tests['p'] = p
+    tests['q'] = benjamini_hochberg(p)
+    tests['result'] = np.where(tests['q'] >= alpha, 'no change',
+                               np.where(tests['rank-biserial'] > 0, 'speedup', 'regression'))
+    tests = tests.iloc[np.lexsort((-tests['change'].abs().to_numpy(), -tests['rank-biserial'].abs().to_numpy()))]
+    if not all_tests:
+        tests = tests[tests['result'] != 'no change']
+    return tests.reset_index(drop=True)
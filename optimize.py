@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 https://www.math-crypto.com
+# GNU General Public License
+
+# Script to search the optimization options adaptively instead of compiling
+# and benchmarking the full grid (see compile.py). It starts with a small
+# random sample of option sets and then repeatedly
+#   - drops the option sets that are clearly dominated: their confidence box
+#     (median ± Δ as in calc_stats of mathcrypto.py) is worse in every score
+#     than the box of another option set,
+#   - benchmarks the remaining option sets with more runs (successive halving),
+#   - builds the neighbours (one option changed) of the current Pareto set.
+# Compiling and benchmarking are functions passed to search(), so the
+# search can also be tried with a fake compiler and benchmark.
+#
+# Set the version and option space at the bottom of the script.
+# The benchmark output goes to the usual session directory
+#     ~/polkadot-optimized/output/VERSION/HOSTNAME/DATE_TIME
+# so it can be parsed with parse_benchmarks.py afterwards.
+
+import os
+import random
+import socket
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from paretoset import paretoset # pip install paretoset
+
+import compile
+import registry
+import run_benchmarks
+import parse_benchmarks
+
+def neighbours(opts, space):
+    "All option sets with one option of opts changed"
+    for key, values in space.items():
+        for value in values:
+            if value != opts[key]:
+                new_opts = dict(opts)
+                new_opts[key] = value
+                yield new_opts
+
+def summarize(results, objectives):
+    "Median and 95% CI half-width Δ of the median per candidate (as calc_stats)"
+    stats = results.groupby('candidate')[objectives].agg(['median', 'sem'])
+    med = stats.xs('median', axis=1, level=1)
+    delta = 1.25 * 1.96 * stats.xs('sem', axis=1, level=1)
+    # one run: no idea of the spread yet
+    delta = delta.fillna(np.inf)
+    return med, delta
+
+def clearly_dominated(med, delta, sense):
+    "Candidates whose box is dominated by the box of another candidate"
+    sign = np.array([1 if s == 'max' else -1 for s in sense])
+    m = med.to_numpy() * sign
+    d = delta.to_numpy()
+    worst = m - d
+    best = m + d
+    # j dominates i if worst of j is at least the best of i everywhere (strictly somewhere)
+    ge = (worst[None, :, :] >= best[:, None, :]).all(axis=2)
+    gt = (worst[None, :, :] > best[:, None, :]).any(axis=2)
+    return med.index[(ge & gt).any(axis=1)].tolist()
+
+def search(space, build, benchmark, scores, extrinsics, nb_initial=8, max_builds=20, runs=[3, 6, 12], seed=1):
+    """
+    Adaptive search over the option space (dict of lists as in compile.py).
+    build(opts) returns an id of the built binary (None if the build failed).
+    benchmark(id, nb_runs) returns a DataFrame with nb_runs rows and the
+    columns scores (higher is better) and extrinsics (lower is better), or
+    None if a run failed (the option set is then dropped).
+    At most max_builds option sets are built. The number of runs per option
+    set grows along runs as long as it is not clearly dominated.
+    Returns a DataFrame with the medians, Δ's, number of runs and status of
+    every option set that was built.
+    """
+    objectives = scores + extrinsics
+    sense = ["max"] * len(scores) + ["min"] * len(extrinsics)
+    rng = random.Random(seed)
+    grid = list(compile.product_dict(**space))
+    candidates = []
+    results = []
+
+    def add(list_opts):
+        for opts in list_opts:
+            if len(candidates) >= max_builds:
+                return
+            if any(c['opts'] == opts for c in candidates):
+                continue
+            print("Building candidate {}: {}".format(len(candidates), opts))
+            bid = build(opts)
+            candidates.append({'opts': opts, 'id': bid, 'level': 0, 'runs': 0,
+                               'alive': bid is not None, 'pareto': False})
+
+    add(rng.sample(grid, min(nb_initial, len(grid))))
+    while True:
+        alive = [i for i, c in enumerate(candidates) if c['alive']]
+        if not alive:
+            break
+        for i in alive:
+            c = candidates[i]
+            nb_runs = runs[c['level']] - c['runs']
+            if nb_runs > 0:
+                print("Benchmarking candidate {} with {} more runs".format(i, nb_runs))
+                df = benchmark(c['id'], nb_runs)
+                if df is None:
+                    print("Benchmark of candidate {} failed, dropping it".format(i))
+                    c['alive'] = False
+                    continue
+                df = df[objectives].copy()
+                df['candidate'] = i
+                results.append(df)
+                c['runs'] = runs[c['level']]
+        alive = [i for i in alive if candidates[i]['alive']]
+        if not alive:
+            continue
+
+        med, delta = summarize(pd.concat(results), objectives)
+        dominated = clearly_dominated(med.loc[alive], delta.loc[alive], sense)
+        for i in dominated:
+            print("Dropping candidate {} after {} runs".format(i, candidates[i]['runs']))
+            candidates[i]['alive'] = False
+        alive = [i for i in alive if i not in dominated]
+        for i in alive:
+            candidates[i]['level'] = min(candidates[i]['level'] + 1, len(runs) - 1)
+
+        mask = paretoset(med.loc[alive, objectives], sense=sense)
+        pareto = [i for i, m in zip(alive, mask) if m]
+        for i, c in enumerate(candidates):
+            c['pareto'] = i in pareto
+
+        tried = [c['opts'] for c in candidates]
+        new = []
+        for i in pareto:
+            for n in neighbours(candidates[i]['opts'], space):
+                if n not in tried and n not in new:
+                    new.append(n)
+        finished = all(candidates[i]['runs'] == runs[-1] for i in alive)
+        if finished and (not new or len(candidates) >= max_builds):
+            break
+        add(new)
+
+    if not results:
+        raise RuntimeError("None of the {} candidates could be built and benchmarked".format(len(candidates)))
+    med, delta = summarize(pd.concat(results), objectives)
+    summary = pd.DataFrame([c['opts'] for c in candidates])
+    summary['id'] = [c['id'] for c in candidates]
+    summary['runs'] = [c['runs'] for c in candidates]
+    summary['alive'] = [c['alive'] for c in candidates]
+    summary['pareto'] = [c['pareto'] for c in candidates]
+    summary = summary.join(med).join(delta.add_prefix("Δ-"))
+    print("Built {} of the {} option sets.".format(len(candidates), len(grid)))
+    return summary
+
+def compile_build(version):
+    "build() for search: compile.py build, the id is the build number"
+    def build(opts):
+        try:
+            compile.compile(version, opts)
+        except subprocess.CalledProcessError as e:
+            print("Build failed: {}".format(e))
+            return None
+        return compile.find_build(version, opts)
+    return build
+
+# Extrinsic benchmark of the objective Extr-Remark
+REMARK = run_benchmarks.EXTRINSIC_WORKLOADS[0]
+
+def machine_benchmark(version, processed_dir):
+    "benchmark() for search: machine and remark benchmark with run_benchmarks.py"
+    done = {}
+    def benchmark(nb, nb_runs):
+        first = done.get(nb, 0)
+        run_benchmarks.perform_benchmark(registry.binary_path(version, nb), nb_runs, nb, processed_dir,
+                                         first_run=first, NB_EXTRINSIC=nb_runs, workloads=[REMARK])
+        done[nb] = first + nb_runs
+        registry.touch(version, nb)
+        records = parse_benchmarks.read_records(processed_dir)
+        rows = []
+        for i in range(first, first + nb_runs):
+            scores = records.get(('machine', None, str(nb), i, 1, 0), {})
+            times = records.get(('extrinsic', REMARK['name'], str(nb), i, 1, 0), {})
+            if 'BLAKE2-256' not in scores or 'SR25519-Verify' not in scores or 'med' not in times:
+                # timed out or no result table (e.g. the machine requirements are not met)
+                print("Run {} of build {} has no scores".format(i, nb))
+                return None
+            rows.append({"BLAKE2-256": scores['BLAKE2-256'], "SR25519-Verify": scores['SR25519-Verify']*1000,
+                         "Extr-Remark": times['med']})
+        return pd.DataFrame(rows)
+    return benchmark
+
+if __name__ == "__main__":
+    version = '0.9.27'
+
+    # Same options as the full grid in compile.py
+    space = {'toolchain': ['stable', 'nightly'],
+             'arch':      [None, 'native'],
+             'codegen-units':   [1, 16],
+             'lto':       ['off', 'fat', 'thin'],
+             'opt-level': [2, 3]
+             }
+
+    os.chdir(os.path.expanduser('~/polkadot-optimized'))
+    host = socket.gethostname()
+    now = datetime.now().strftime("%Y-%b-%d_%Hh%M")
+    processed_dir = 'output/' + version + "/" + host + "/" + now
+    os.makedirs(processed_dir, exist_ok=True)
+
+    summary = search(space, compile_build(version), machine_benchmark(version, processed_dir),
+                     scores=["BLAKE2-256", "SR25519-Verify"], extrinsics=["Extr-Remark"])
+    summary.to_csv(processed_dir + "/search.csv", index=False)
+    print(summary[summary['pareto']])
@@ -7,12 +7,22 @@
 # by run_benchmarks.py. It will read all the files in
 #   ~/polkadot-optimized/output/VERSION/HOSTNAME/DATE_TIME/
 # For each combination of VERSION, HOSTNAME, DATE_TIME a 
-# pandas dataframe is constructed and stored in
+# pandas dataframe is constructed (one for the machine benchmark, one for
+# the extrinsics and, in newer sessions, one for the disk stage and one for
+# the startup runs) and stored in
 #   ~/polkadot-optimized/processed/todo/
 # as a feather object and 
 #   ~/polkadot-optimized/processed/csv/
 # as a csv file. Processed files are then moved to 
 #   ~/polkadot-optimized/processed/old/
+# The runs that are already parsed are kept in
+#   ~/polkadot-optimized/processed/ingest/
+# so only new or changed files are parsed again. All tables are also
+# written to one dataset, partitioned by version, host and date, in
+#   ~/polkadot-optimized/processed/dataset/
+# (see load_dataset of mathcrypto.py). The tables in processed/todo from
+# before the dataset are added to it with
+#   python3 parse_benchmarks.py --migrate
 
 
 import re
@@ -21,12 +31,19 @@ import os
 from glob import glob
 import shutil
 import json
-# pip install pyarrow
+import argparse
+import pyarrow as pa # pip install pyarrow
+import pyarrow.parquet as pq
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import registry
+
+NUMBER = re.compile(r"[+-]?\d+\.\d+")
 
 def convert_to_MiB(score_string):
-    raw_nb = float(re.findall("[+-]?\d+\.\d+", score_string)[0])
+    raw_nb = float(NUMBER.findall(score_string)[0])
     if 'KiB/s' in score_string:
         nb = raw_nb/1000
     if 'MiB/s' in score_string:
@@ -35,7 +52,156 @@ def convert_to_MiB(score_string):
         nb = raw_nb*1000            
     return nb
 
-def get_cpu_pct(bench):
+# Columns of the scores of the machine benchmark
+SCORES = ["BLAKE2-256", "SR25519-Verify", "Copy", "Seq_Write", "Rnd_Write"]
+# Scores of the disk part, measured per storage target in the disk stage of run_benchmarks.py
+DISK_SCORES = ["Seq_Write", "Rnd_Write"]
+
+# Results in the benchmark output: rows of the machine benchmark table,
+# statistics, percentiles and counts of the extrinsic benchmark. One regex,
+# so a whole output file is tokenized in one pass (see tokenize).
+TOKENS = re.compile(r"^\|(?P<category>[^|\n]*)\|(?P<function>[^|\n]*)\|(?P<score>[^|\n]*[+-]?\d+\.\d+ [KMG]iB/s[^|\n]*)\|"
+                    r"|(?P<stat>Total|Min|Max|Average|Median|Stddev): (?P<stat_value>\d+)"
+                    r"|Percentiles 99th, 95th, 75th: (?P<pct99>\d+), (?P<pct95>\d+), (?P<pct75>\d+)"
+                    r"|(?P<count>Running|Executing block) (?P<count_value>\d+) (?P<count_unit>warmups|times)",
+                    re.MULTILINE)
+EXTRINSIC_NAMES = {'Total': 'tot', 'Min': 'min', 'Max': 'max', 'Average': 'avg',
+                   'Median': 'med', 'Stddev': 'std'}
+# Output files bench_NB_run_I.txt, new_bench_NB_run_I_WORKLOAD.txt and
+# disk_bench_NB_run_I_TARGET.txt, with _xCONCURRENCY-INSTANCE after the run
+# for the instances of a scaling run
+FILE_NAME = re.compile(r"^(new_|disk_)?bench_([^_]+)_run_(\d+)(?:_x(\d+)-(\d+))?(?:_(.+))?$")
+# Startup runs startup_NB_run_I.json (see startup_once of run_benchmarks.py):
+# latencies in ms, peak RSS and sizes in MiB, all lower is better
+STARTUP_FILE = re.compile(r"^startup_([^_]+)_run_(\d+)$")
+STARTUP_SCORES = ["Start-Cold", "Start-Warm", "Start-Dev", "RSS-Dev", "Size"]
+# ELF sections in the startup table as columns Size-NAME (MiB)
+SECTIONS = ['.text', '.rodata', '.data.rel.ro', '.data', '.bss', '.eh_frame', '.gcc_except_table']
+# Extrinsic benchmark of the sessions from before the workloads of run_benchmarks.py
+LEGACY_WORKLOAD = {'name': 'Remark', 'chain': 'polkadot-dev', 'pallet': 'system', 'extrinsic': 'remark'}
+
+def tokenize(text):
+    """
+    Results in the output text of a benchmark as (category, name, value, unit)
+    with the same names and units as the columns of the parsed tables
+    """
+    for m in TOKENS.finditer(text):
+        if m.group('score') is not None:
+            yield (m.group('category').strip(), m.group('function').strip().replace(' ', '_'),
+                   convert_to_MiB(m.group('score')), 'MiB/s')
+        elif m.group('stat') is not None:
+            yield ('extrinsic', EXTRINSIC_NAMES[m.group('stat')], float(m.group('stat_value')), 'ns')
+        elif m.group('pct99') is not None:
+            for name in ['pct99', 'pct95', 'pct75']:
+                yield ('extrinsic', name, float(m.group(name)), 'ns')
+        else:
+            # number of warmups and of samples behind the statistics
+            name = 'nb_warmups' if m.group('count_unit') == 'warmups' else 'nb_samples'
+            yield ('extrinsic', name, float(m.group('count_value')), '')
+
+def parse_line(line):
+    "Results in one line of the output of a benchmark (see tokenize), parsed while the benchmark runs"
+    return list(tokenize(line))
+
+def parse_name(stem):
+    """
+    nb_build, nb_run, concurrency, instance and workload (None for the
+    machine benchmark, the storage target of the disk stage) of an output file
+    """
+    m = FILE_NAME.match(stem)
+    workload = None
+    if m.group(1) == 'new_':
+        # older sessions only had the Remark extrinsic
+        workload = m.group(6) or LEGACY_WORKLOAD['name']
+    elif m.group(1) == 'disk_':
+        workload = m.group(6)
+    return m.group(2), int(m.group(3)), int(m.group(4) or 1), int(m.group(5) or 0), workload
+
+def read_records(p):
+    """
+    Results of every run in session directory p that run_benchmarks.py
+    recorded while running, as
+        {(kind, workload, nb_build, nb_run, concurrency, instance): {name: value}}
+    with workload None for the machine benchmark (None for older sessions
+    without records)
+    """
+    files = sorted(Path(p).glob('records/*.arrow'))
+    if not files:
+        return None
+    table = pa.concat_tables([pa.ipc.open_file(f).read_all() for f in files], promote_options='default')
+    results = {}
+    for r in table.to_pylist():
+        workload = r.get('workload')
+        if r['kind'] == 'extrinsic' and workload is None:
+            workload = LEGACY_WORKLOAD['name']
+        key = (r['kind'], workload, r['nb_build'], r['nb_run'], r.get('concurrency') or 1, r.get('instance') or 0)
+        results.setdefault(key, {})[r['name']] = r['value']
+    return results
+
+def read_startup(p):
+    """
+    Startup runs in session directory p as {(nb_build, nb_run): {name: value}}
+    with the scores of STARTUP_SCORES and the sizes Size-NAME of SECTIONS
+    """
+    results = {}
+    for f in Path(p).glob('startup_*.json'):
+        m = STARTUP_FILE.match(f.stem)
+        if m:
+            results[(m.group(1), int(m.group(2)))] = get_startup(f)
+    return results
+
+def get_startup(f):
+    "Results of the startup run in file f, with the sizes Size-NAME of SECTIONS"
+    with open(f, "r") as text_file:
+        startup = json.load(text_file)
+    data = dict(startup['results'])
+    for name in SECTIONS:
+        if name in startup['sections']:
+            data['Size-' + name.lstrip('.')] = startup['sections'][name] / 2**20
+    return data
+
+def read_record_file(f):
+    "Results {name: value} in the record file f of one run (empty if it does not exist)"
+    if not f.exists():
+        return {}
+    table = pa.ipc.open_file(f).read_all()
+    return dict(zip(table.column('name').to_pylist(), table.column('value').to_pylist()))
+
+def get_load(f):
+    "Load statistics that run_benchmarks.py sampled during the benchmark in file f (None for older runs)"
+    load_file = f.parent / ("load_" + f.stem + ".json")
+    if not load_file.exists():
+        return None
+    with open(load_file, "r") as text_file:
+        load = json.load(text_file)
+    summary = dict(load['summary'])
+    summary['timed_out'] = load.get('timed_out', False)
+    # milliseconds of a docker exec before the run (docker only)
+    summary['docker_exec_ms'] = load.get('docker_exec_ms')
+    # machine benchmark without the disk part (the disk stage measures it)
+    summary['cpu_only'] = load.get('cpu_only', False)
+    return summary
+
+# Hardware counters of a run (perf stat or /proc, see run_benchmarks.py)
+COUNTERS = ['instructions', 'cycles', 'ipc', 'branch_misses', 'cache_misses', 'context_switches',
+            'run_delay_ns', 'page_faults']
+
+def get_counters(f):
+    "Hardware counters of the benchmark in file f, with their source (perf or proc) in counters"
+    load_file = f.parent / ("load_" + f.stem + ".json")
+    counters = {}
+    if load_file.exists():
+        with open(load_file, "r") as text_file:
+            counters = json.load(text_file).get('counters', {})
+    data = {name: counters.get(name) for name in COUNTERS}
+    data['counters'] = counters.get('source')
+    return data
+
+def get_cpu_pct(bench, load=None):
+    "Highest CPU usage (%) besides the benchmark itself"
+    if load is not None:
+        return load.get('background_max', -1)
+    # older runs: CPU utilization lines before and after the run
     cpu_start = -1
     cpu_end = -1
     for line in filter(None, bench.split('\n')):
@@ -48,152 +214,392 @@ def get_cpu_pct(bench):
             cpu_end = float(line.split(':')[-1])
     return max(cpu_start, cpu_end)
 
-# https://stackoverflow.com/questions/19127704/how-to-read-ascii-formatted-table-in-python
 def get_scores(ascii_table):
-    header = []
-    scores = []
-    for line in filter(None, ascii_table.split('\n')):
-        if not line.startswith('|'):
+    "Scores of the machine benchmark table by function {name: MiB/s}, e.g. {'Copy': 22300.0, 'Seq_Write': ...}"
+    return {name: value for category, name, value, unit in tokenize(ascii_table) if unit == 'MiB/s'}
+
+def get_extrinsic_times(output_text):
+    "All statistics of an extrinsic benchmark (empty if there are none)"
+    return {name: value for category, name, value, unit in tokenize(output_text) if category == 'extrinsic'}
+
+
+def done_tasks(p):
+    """
+    Manifest of session directory p (None for older sessions without one)
+    and the set of (kind, workload, nb_build, nb_run, concurrency) of its runs that are done
+    """
+    f = Path(p) / "manifest.json"
+    if not f.exists():
+        return None, None
+    with open(f, "r") as text_file:
+        manifest = json.load(text_file)
+    done = set((t['kind'], t.get('workload'), t['nb_build'], t['run'], t.get('concurrency', 1))
+               for t in manifest['tasks'] if t['status'] == 'done')
+    return manifest, done
+
+def build_options(version, p):
+    "Build options {nb_build: options} of the builds of version for session directory p"
+    # build options from the registry
+    build_info = {}
+    for b in registry.builds(version, include_evicted=True):
+        build_info[str(b['nb'])] = b['options']
+        # build cost, to compare with the scores
+        if 'build_seconds' in b['meta']:
+            build_info[str(b['nb'])]['build_s'] = b['meta']['build_seconds']
+            build_info[str(b['nb'])]['build_cpu_s'] = b['meta']['build_cpu_seconds']
+    # older sessions have a copy of the build json files
+    for f in p.glob('bench_*.json'):            
+        nb_build = f.stem.split("_")[1]            
+        with open(f, "r") as text_file:
+            build_info[nb_build] = json.load(text_file)['build_options']  
+    for nb_build in build_info:
+        # Booleans are not stored in pyarrow -- ugly translation to string
+        for key, value in build_info[nb_build].items():              
+            if key=='lto' and value==False:
+                build_info[nb_build]['lto'] = 'False'
+    # [profile.release]
+    # # Polkadot runtime requires unwinding.
+    # panic = "unwind"
+    # opt-level = 3   
+    # https://doc.rust-lang.org/rustc/codegen-options/index.html#codegen-units
+    # The default value, if not specified, is 16 for non-incremental builds.  
+    # https://doc.rust-lang.org/rustc/codegen-options/index.html#lto
+    # If -C lto is not specified, then the compiler will attempt to perform "thin local LTO" 
+    # which performs "thin" LTO on the local crate only across its codegen units.            
+    build_info['official'] = { "toolchain": "nightly", "arch": "none", "codegen-units": 16,
+                                "lto": "thin local", "opt-level": 3 }
+    build_info['docker'] = build_info['official']   
+    # options that were added later
+    for nb_build in build_info:
+        for key, value in registry.DEFAULT_OPTIONS.items():
+            build_info[nb_build].setdefault(key, value)
+    return build_info
+
+def session_units(p):
+    "Runs of session directory p as {stem: kind}, one output file per run (and instance)"
+    units = {}
+    for pattern, kind in [('bench_*.txt', 'machine'), ('new_bench_*.txt', 'extrinsic'), ('disk_bench_*.txt', 'disk')]:
+        for f in p.glob(pattern):
+            units[f.stem] = kind
+    for f in p.glob('startup_*.json'):
+        if STARTUP_FILE.match(f.stem):
+            units[f.stem] = 'startup'
+    return units
+
+def unit_files(p, stem, kind):
+    "Files (relative to session directory p) of the run stem that its row is parsed from"
+    if kind == 'startup':
+        names = [stem + '.json']
+    else:
+        names = [stem + '.txt', 'load_' + stem + '.json', 'records/' + stem + '.arrow']
+    return [name for name in names if (p / name).exists()]
+
+def parse_unit(p, stem, kind, manifest, has_records):
+    """
+    Row of the run stem of session directory p in the table of its kind
+    (None if it has no results) and the key of its task in the manifest
+    (see done_tasks). The build options are added later (see session_tables).
+    """
+    version, host, date = p.parts[-3:]
+    if kind == 'startup':
+        m = STARTUP_FILE.match(stem)
+        data = {"host": host, "date": date,
+            "ver": version,
+            "nb_run": int(m.group(2)), "nb_build": m.group(1)}
+        data.update(get_startup(p / (stem + '.json')))
+        return data, ('startup', None, m.group(1), int(m.group(2)), 1)
+
+    nb_build, nb_run, concurrency, instance, name = parse_name(stem)
+    key = (kind, name, nb_build, nb_run, concurrency)
+    f = p / (stem + '.txt')
+    load = get_load(f)
+    if load is not None and load.get('timed_out'):
+        # killed benchmark, incomplete results
+        return None, key
+    bench = ""
+    if load is None or not has_records:
+        with open(f, "r") as text_file:
+            bench = text_file.read()
+    # results recorded during the runs, the text files are only parsed for older sessions
+    if has_records:
+        results = read_record_file(p / 'records' / (stem + '.arrow'))
+    elif kind == 'extrinsic':
+        results = get_extrinsic_times(bench)
+    else:
+        results = get_scores(bench)
+    if not results:
+        # no benchmark table (arch not supported probably)
+        return None, key
+    settings = (manifest or {}).get('settings', {})
+
+    if kind == 'disk':
+        targets = {"{}-{}s".format(t['name'], d): dict(t, duration=d)
+                   for t in settings.get('disk_targets') or [] for d in settings.get('disk_durations') or []}
+        target = targets.get(name, {'name': name, 'path': None, 'duration': None})
+        data = {"host": host, "date": date,
+            "ver": version,
+            "nb_run": nb_run, "nb_build": nb_build,
+            "target": target['name'], "path": target['path'], "disk_duration": target['duration'],
+            "cpu": get_cpu_pct(bench, load),
+            "load_avg": load.get('load_max') if load else None}
+        data.update({n: results.get(n) for n in DISK_SCORES})
+        return data, key
+
+    data = {"host": host, "date": date,                   
+        "ver": version,
+        "nb_run": nb_run, "nb_build": nb_build,                      
+        "concurrency": concurrency, "instance": instance,
+        "cpu": get_cpu_pct(bench, load),
+        "cpu_freq": load.get('freq_mean') if load else None,
+        "load_avg": load.get('load_max') if load else None,
+        "docker_exec_ms": load.get('docker_exec_ms') if load else None,
+        "build_cpu": load.get('build_cpu_mean', float("nan")) if load else float("nan")}
+    if kind == 'machine':
+        if load is not None and load.get('cpu_only'):
+            # only the shortest disk part (--disk-duration 0), see the disk table
+            results = {n: v for n, v in results.items() if n not in DISK_SCORES}
+        data.update({n: results.get(n, float("nan")) for n in SCORES})
+    else:
+        # extrinsic benchmarks of the session (one workload in older sessions)
+        workloads = {LEGACY_WORKLOAD['name']: LEGACY_WORKLOAD}
+        workloads.update({w['name']: w for w in settings.get('workloads', [])})
+        workload = workloads.get(name, {'name': name, 'chain': None, 'pallet': None, 'extrinsic': None})
+        data.update({"workload": workload['name'], "chain": workload['chain'],
+                     "pallet": workload['pallet'], "extrinsic": workload['extrinsic']})
+        data.update(results)
+    data.update(get_counters(f))
+    return data, key
+
+def ingest_session(p, known):
+    """
+    Rows of the runs of session directory p, only the runs that are new or
+    have changed since the runs known ({stem: entry}) are parsed. A run is
+    unchanged if the size and mtime of its files (see unit_files) are the
+    same, or else their SHA-256. Returns the entries {stem: {'kind', 'key',
+    'row', 'files'}} of all runs and the number of parsed runs.
+    """
+    p = Path(p)
+    manifest, done = done_tasks(p)
+    has_records = (p / 'records').is_dir()
+    units = {}
+    parsed = 0
+    for stem, kind in sorted(session_units(p).items()):
+        files = {}
+        for name in unit_files(p, stem, kind):
+            st = os.stat(p / name)
+            files[name] = [st.st_size, st.st_mtime_ns]
+        old = known.get(stem)
+        if old is not None and {name: f[:2] for name, f in old['files'].items()} == files:
+            units[stem] = old
             continue
-        if '-+-' in line or '===' in line:
+        for name in files:
+            files[name].append(registry.sha256sum(p / name))
+        if old is not None and {name: f[2] for name, f in old['files'].items()} == {name: f[2] for name, f in files.items()}:
+            # touched, not changed
+            units[stem] = dict(old, files=files)
             continue
-        if not header:            
-            header = line.split('|')[1:-1]            
-            continue                
-        splitted_line = line.split('|')[1:-1]                
-        score_string = splitted_line[2]        
-        scores.append( convert_to_MiB(score_string) )
-    return scores
+        row, key = parse_unit(p, stem, kind, manifest, has_records)
+        units[stem] = {'kind': kind, 'key': key, 'row': row, 'files': files}
+        parsed = parsed + 1
+    return units, parsed
 
-def get_extrinsic_times(output_text):
-    times = {}
-    times['tot'] = float(re.search('(?<=Total: )(\d+)', output_text).group(0))
-    times['min'] = float(re.search('(?<=Min: )(\d+)', output_text).group(0))
-    times['max'] = float(re.search('(?<=Max: )(\d+)', output_text).group(0))
-    times['avg'] = float(re.search('(?<=Average: )(\d+)', output_text).group(0))
-    times['med'] = float(re.search('(?<=Median: )(\d+)', output_text).group(0))
-    times['std'] = float(re.search('(?<=Stddev: )(\d+)', output_text).group(0))
-    pct_99_95_75 = re.search('(?<=Percentiles 99th, 95th, 75th: )(\d+), (\d+), (\d+)', output_text).group(0).split(",")
-    times['pct99'] = float(pct_99_95_75[0])
-    times['pct95'] = float(pct_99_95_75[1])
-    times['pct75'] = float(pct_99_95_75[2])
-    return times
-
-
-def parse():
+def session_tables(units, done, build_info):
+    "Tables {kind: DataFrame} of a session from the rows of its runs that are done (all for older sessions)"
+    rows = {'machine': [], 'extrinsic': [], 'disk': [], 'startup': []}
+    for stem in sorted(units):
+        unit = units[stem]
+        if unit['row'] is None:
+            continue
+        if done is not None and tuple(unit['key']) not in done:
+            # interrupted run
+            continue
+        row = unit['row']
+        if unit['kind'] != 'disk':
+            row = {**row, **build_info.get(row['nb_build'], {})}
+        rows[unit['kind']].append(row)
+    return {kind: pd.DataFrame.from_records(r).reset_index() for kind, r in rows.items()}
+
+def replace_atomic(f, write):
+    "Write file f with write(path) to a temporary file first, a crash leaves either the old or the new file"
+    tmp = f.with_name(f.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, f)
+
+def save_json(f, obj):
+    def write(tmp):
+        with open(tmp, "w") as text_file:
+            json.dump(obj, text_file)
+    replace_atomic(f, write)
+
+# Ingested runs of every session, so a parse only reads new or changed files:
+#   processed/ingest/manifest.json            sessions with their tables
+#   processed/ingest/VERSION_HOST_DATE.json   files and rows of the runs of a session
+INGEST_DIR = Path("processed") / "ingest"
+
+def load_ingest_manifest():
+    if not (INGEST_DIR / "manifest.json").exists():
+        return {}
+    with open(INGEST_DIR / "manifest.json", "r") as text_file:
+        return json.load(text_file)
+
+# Dataset of all sessions, one per table (machine, extrinsic, disk, startup):
+#   processed/dataset/TABLE/ver=VERSION/host=HOST/date=DATE/part-0.parquet
+# with the column types of SCHEMA (other columns are numbers or text)
+DATASET_DIR = Path("processed") / "dataset"
+PARTITIONING = ['ver', 'host', 'date']
+# profile, codegen and lto_ldd are the build options of 0.9.26
+CATEGORIES = ['toolchain', 'arch', 'lto', 'linker', 'allocator', 'panic', 'target-feature', 'relocation-model',
+              'profile', 'counters', 'workload', 'chain', 'pallet', 'extrinsic', 'target', 'path']
+INTEGERS = ['nb_run', 'concurrency', 'instance', 'codegen-units', 'opt-level', 'disk_duration']
+BOOLEANS = ['pgo', 'bolt', 'codegen', 'lto_ldd']
+SCHEMA = pa.schema([('nb_build', pa.string())]
+                   + [(col, pa.dictionary(pa.int32(), pa.string())) for col in CATEGORIES]
+                   + [(col, pa.int64()) for col in INTEGERS]
+                   + [(col, pa.bool_()) for col in BOOLEANS])
+
+def dataset_schema(schema, fixed=SCHEMA):
+    "schema with the types of fixed for its columns in fixed, e.g. the same column types in all partitions"
+    return pa.schema([fixed.field(f.name) if f.name in fixed.names else f for f in schema])
+
+def dataset_frame(df, kind):
+    "Parsed table df of kind with the column types of the dataset, with the defaults of older sessions"
+    df = df.drop(columns=['index'], errors='ignore').copy()
+    if kind in ['machine', 'extrinsic'] and 'concurrency' not in df.columns:
+        # only single runs
+        df['concurrency'] = 1
+        df['instance'] = 0
+    if kind == 'extrinsic' and 'workload' not in df.columns:
+        # only the Remark extrinsic
+        df['workload'] = LEGACY_WORKLOAD['name']
+        for key in ['chain', 'pallet', 'extrinsic']:
+            df[key] = LEGACY_WORKLOAD[key]
+    if 'arch' in df.columns:
+        df['arch'] = df['arch'].fillna('none')
+    for col in df.columns:
+        if col in PARTITIONING or col == 'nb_build':
+            df[col] = df[col].astype('string')
+        elif col in CATEGORIES:
+            df[col] = df[col].astype('string').astype('category')
+        elif col in INTEGERS:
+            df[col] = pd.to_numeric(df[col]).astype('Int64')
+        elif col in BOOLEANS:
+            df[col] = df[col].astype('boolean')
+        elif df[col].dtype == object:
+            try:
+                df[col] = pd.to_numeric(df[col]).astype('float64')
+            except (ValueError, TypeError):
+                df[col] = df[col].astype('string')
+    return df
+
+def write_partitions(kind, df, schema=SCHEMA):
+    """
+    Replace the partitions of the sessions in the parsed table df of kind
+    in the dataset, with the column types of schema
+    """
+    if df.empty:
+        # no runs of this kind (yet), nothing to partition
+        return
+    frame = dataset_frame(df, kind)
+    for (version, host, date), part in frame.groupby(PARTITIONING):
+        d = DATASET_DIR / kind / "ver={}".format(version) / "host={}".format(host) / "date={}".format(date)
+        os.makedirs(d, exist_ok=True)
+        table = pa.Table.from_pandas(part.drop(columns=PARTITIONING), preserve_index=False)
+        table = table.cast(dataset_schema(table.schema, schema))
+        replace_atomic(d / "part-0.parquet", lambda f: pq.write_table(table, f))
+
+def migrate(todo_dir=Path("processed") / "todo"):
+    "Add the tables in todo_dir (e.g. from before the dataset) to the dataset"
+    ingest_manifest = load_ingest_manifest()
+    for f in sorted(todo_dir.glob('*.feather')):
+        kind = next((k for k in ['extrinsic', 'disk', 'startup'] if f.name.startswith(k + '_')), 'machine')
+        df = pd.read_feather(f)
+        if df.empty:
+            continue
+        write_partitions(kind, df)
+        name = f.stem if kind == 'machine' else f.stem[len(kind) + 1:]
+        entry = ingest_manifest.setdefault(name, {'session': str(f), 'complete': True, 'runs': None, 'tables': []})
+        entry['tables'] = sorted(set(entry['tables']) | {f.stem})
+        entry['updated'] = datetime.now().isoformat()
+        print("Migrated {} ({} rows)".format(f, len(df)))
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    save_json(INGEST_DIR / "manifest.json", ingest_manifest)
+
+def parse(partial=False, workers=None):
+    """
+    Parse all complete sessions. Unfinished sessions (still running or to be
+    resumed) are left alone, unless partial: then their runs that are done
+    are parsed and the session stays in output.
+    Only new or changed runs are parsed (see ingest_session), the sessions
+    in a pool of workers processes (default: one per CPU). Every output file
+    is replaced atomically, so parse can always be run again after a crash.
+    The tables go to processed/todo and csv and to the dataset.
+    """
     output_dir = Path("output")
     processed_dir = Path("processed")
-    os.makedirs(processed_dir, exist_ok=True)
-    os.makedirs(processed_dir / "csv", exist_ok=True)   
-    os.makedirs(processed_dir / "todo", exist_ok=True)
-    os.makedirs(processed_dir / "old", exist_ok=True)   
-    
-    path_version_date_host = output_dir.glob("*/*/*")  
-    for p in path_version_date_host:        
-        version = p.parts[1]
-        host = p.parts[2]        
-        date = p.parts[3]            
-
-        # read all build json files
-        build_info = {}
-        for f in p.glob('bench_*.json'):            
-            nb_build = f.stem.split("_")[1]            
-            with open(f, "r") as text_file:
-                build_info[nb_build] = json.load(text_file)['build_options']  
-                # Booleans are not stored in pyarrow -- ugly translation to string
-                for key, value in build_info[nb_build].items():              
-                    if key=='lto' and value==False:
-                        build_info[nb_build]['lto'] = 'False'
-        # [profile.release]
-        # # Polkadot runtime requires unwinding.
-        # panic = "unwind"
-        # opt-level = 3   
-        # https://doc.rust-lang.org/rustc/codegen-options/index.html#codegen-units
-        # The default value, if not specified, is 16 for non-incremental builds.  
-        # https://doc.rust-lang.org/rustc/codegen-options/index.html#lto
-        # If -C lto is not specified, then the compiler will attempt to perform "thin local LTO" 
-        # which performs "thin" LTO on the local crate only across its codegen units.            
-        build_info['official'] = { "toolchain": "nightly", "arch": "none", "codegen-units": 16,
-                                    "lto": "thin local", "opt-level": 3 }
-        build_info['docker'] = build_info['official']   
-                
-        # read the benchmarks
-        all_data = []        
-        for f in p.glob('bench_*.txt'):               
-            nb_build = f.stem.split("_")[1]            
-            nb_run = int(f.stem.split("_")[3])            
-            ts = int(os.path.getmtime(f))            
-            # date = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d_%Hh%Mm')
-                                    
-            with open(f, "r") as text_file:
-                bench = text_file.read()
-                scores = get_scores(bench) 
-
-                if not scores: 
-                    # no benchmark table (arch not supported probably)
-                    continue
-                 
-                data = {"host": host, "date": date,                   
-                    "ver": version,
-                    "nb_run": nb_run, "nb_build": nb_build,                      
-                    "cpu": get_cpu_pct(bench),
-                    "BLAKE2-256": scores[0], "SR25519-Verify": scores[1],
-                    "Copy": scores[2],
-                    "Seq_Write": scores[3], "Rnd_Write": scores[4]}
-                data.update(build_info[nb_build])    
-                
-                if not all_data:
-                    all_data = [data]
-                else:
-                    all_data.append(data)
-
-        # save as dataframe
-        df = pd.DataFrame(all_data).reset_index()            
-        df.to_csv(processed_dir / "csv" / "{}_{}_{}.csv".format(version, host, date), index=False)
-        df.to_feather(processed_dir / "todo" / "{}_{}_{}.feather".format(version, host, date))        
-        print(df)        
-
-        # read the signing extrinsic
-        all_data = []        
-        for f in p.glob('new_bench_*.txt'):               
-            nb_build = f.stem.split("_")[2]            
-            nb_run = int(f.stem.split("_")[4])            
-            ts = int(os.path.getmtime(f))            
-            # date = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d_%Hh%Mm')
-                                    
-            with open(f, "r") as text_file:
-                bench = text_file.read()
-                times = get_extrinsic_times(bench) 
-
-                if not times: 
-                    # no benchmark table (arch not supported probably)
-                    continue
-                 
-                data = {"host": host, "date": date,                   
-                    "ver": version,
-                    "nb_run": nb_run, "nb_build": nb_build,                      
-                    "cpu": get_cpu_pct(bench)}
-                data.update(times)                            
-                data.update(build_info[nb_build])    
-                
-                if not all_data:
-                    all_data = [data]
-                else:
-                    all_data.append(data)
-
-        # save as dataframe
-        df = pd.DataFrame(all_data).reset_index()                  
-        df.to_csv(processed_dir / "csv" / "extrinsic_{}_{}_{}.csv".format(version, host, date), index=False)
-        df.to_feather(processed_dir / "todo" / "extrinsic_{}_{}_{}.feather".format(version, host, date))        
-        print(df)
-
-        shutil.move(p, processed_dir / "old" / version / host / date) 
-        
-        # TODO remove dir if empty with bench
-
-        
+    for d in ["csv", "todo", "old", "ingest"]:
+        os.makedirs(processed_dir / d, exist_ok=True)
+    ingest_manifest = load_ingest_manifest()
 
-if __name__=="__main__":
-    parse()
+    sessions = []
+    for p in sorted(output_dir.glob("*/*/*")):
+        if not p.is_dir():
+            continue
+        manifest, done = done_tasks(p)
+        if manifest is not None and not manifest['complete'] and not partial:
+            print("Skipping unfinished session {}".format(p))
+            continue
+        sessions.append(p)
+
+    def known(p):
+        f = INGEST_DIR / "{}_{}_{}.json".format(*p.parts[-3:])
+        if not f.exists():
+            return {}
+        with open(f, "r") as text_file:
+            return json.load(text_file)['units']
+
+    args = [(str(p), known(p)) for p in sessions]
+    if len(sessions) > 1 and workers != 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        ingested = pool.map(ingest_session, *zip(*args))
+    else:
+        pool = None
+        ingested = (ingest_session(*a) for a in args)
+    try:
+        for p, (units, parsed) in zip(sessions, ingested):
+            version, host, date = p.parts[-3:]
+            name = "{}_{}_{}".format(version, host, date)
+            manifest, done = done_tasks(p)
+            complete = manifest is None or manifest['complete']
+            destination = processed_dir / "old" / version / host / date
+            save_json(INGEST_DIR / (name + ".json"), {'session': str(destination if complete else p), 'units': units})
 
+            tables = session_tables(units, done, build_options(version, p))
+            written = []
+            for kind, df in tables.items():
+                # disk stage and startup runs only in newer sessions
+                if df.empty and kind in ['disk', 'startup']:
+                    continue
+                prefix = "" if kind == 'machine' else kind + "_"
+                replace_atomic(processed_dir / "csv" / (prefix + name + ".csv"), lambda f: df.to_csv(f, index=False))
+                replace_atomic(processed_dir / "todo" / (prefix + name + ".feather"), df.to_feather)
+                write_partitions(kind, df)
+                written.append(prefix + name)
+            print("Session {}: {} new or changed runs, {} rows".format(p, parsed, sum(len(df) for df in tables.values())))
+
+            ingest_manifest[name] = {'session': str(destination if complete else p), 'complete': complete,
+                                     'runs': len(units), 'tables': written, 'updated': datetime.now().isoformat()}
+            save_json(INGEST_DIR / "manifest.json", ingest_manifest)
+            if complete:
+                shutil.move(p, destination)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--migrate', action='store_true', help="add the tables of processed/todo to the dataset")
+    args = parser.parse_args()
+    if args.migrate:
+        migrate()
+    else:
+        parse()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 https://www.math-crypto.com
+# GNU General Public License
+
+# Script to compile and benchmark the builds of a version at the same time,
+# instead of compile.py followed by run_benchmarks.py. The cores of the
+# host are split: the benchmarks run pinned to BENCH_CORES (their
+# hyperthreads stay idle) and the builds run one after the other on all
+# other cores. Every finished binary is queued and benchmarked while the
+# next option set compiles, so both stages together take about as long as
+# the longer of the two.
+# The CPU usage of the builds is recorded with every benchmark run (column
+# build_cpu of the parsed tables). With --pause the builds are suspended
+# during every benchmark run: cleaner results, but slower builds.
+#
+# Set the version, option sets and settings at the bottom of the script.
+# The output goes to the usual session directory
+#     ~/polkadot-optimized/output/VERSION/HOSTNAME/DATE_TIME
+# with pipeline.json (cores and timeline of the builds and benchmarks), so
+# it is parsed with parse_benchmarks.py as usual. An interrupted session
+# can be finished with run_benchmarks.py --resume (for the binaries that
+# were built).
+
+import os
+import json
+import time
+import queue
+import socket
+import argparse
+import contextlib
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+import psutil # pip install psutil
+
+import compile
+import registry
+import run_benchmarks
+
+def sibling_cpus(cpu):
+    "Logical CPUs of the physical core of cpu (its hyperthreads)"
+    try:
+        with open("/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list".format(cpu)) as f:
+            text = f.read().strip()
+    except OSError:
+        return [cpu]
+    cpus = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        cpus = cpus + list(range(int(first), int(last or first) + 1))
+    return cpus
+
+def build_cores(bench_cores):
+    "Cores for the builds: all cores except bench_cores and their hyperthreads"
+    reserved = set(c for core in bench_cores for c in sibling_cpus(core))
+    return [c for c in sorted(psutil.Process().cpu_affinity()) if c not in reserved]
+
+class Builds:
+    """
+    The build process of the pipeline as seen by the benchmarks (see
+    run_benchmarks.benchmark_all): pids() for the recorded CPU usage and
+    paused(), which suspends the build with all its compiler processes
+    during a benchmark run if pause is set.
+    """
+    def __init__(self, pause=False):
+        self.pause = pause
+        self.process = None
+
+    def pids(self):
+        if self.process is None or not self.process.is_alive():
+            return []
+        return [self.process.pid]
+
+    def tree(self):
+        "The build process and all its children"
+        processes = []
+        for pid in self.pids():
+            try:
+                parent = psutil.Process(pid)
+                processes = processes + [parent] + parent.children(recursive=True)
+            except psutil.Error:
+                pass
+        return processes
+
+    @contextlib.contextmanager
+    def paused(self):
+        suspended = {}
+        if self.pause:
+            # twice: processes started while suspending the others
+            for attempt in range(2):
+                for p in self.tree():
+                    if p.pid in suspended:
+                        continue
+                    try:
+                        p.suspend()
+                        suspended[p.pid] = p
+                    except psutil.Error:
+                        pass
+        try:
+            yield
+        finally:
+            for p in suspended.values():
+                try:
+                    p.resume()
+                except psutil.Error:
+                    pass
+
+    def kill(self):
+        for p in self.tree():
+            try:
+                p.kill()
+            except psutil.Error:
+                pass
+
+def build_worker(version, todo, cores, finished):
+    """
+    Build the option sets todo [(nb, opts)] one after the other on cores
+    (all jobs), as compile.compile_all. After every build its result
+    {'nb', 'ok', 'seconds'} is put in the queue finished, None at the end.
+    """
+    os.sched_setaffinity(0, cores)
+    bin_dir = compile.BASE_DIR + '/bin/' + version
+    phases = {}
+    work_dir = compile.checkout(version, bin_dir + '/checkout.log', phases)
+    for nb, opts in todo:
+        print("Start build {} on {} cores: {}".format(nb, len(cores), opts))
+        t0 = time.monotonic()
+        target_dir = work_dir + '/target/' + compile.dependency_key(opts)
+        try:
+            compile.build(version, opts, nb, work_dir, target_dir, jobs=len(cores), prepare_phases=phases)
+            ok = True
+            print("Finished build {}".format(nb))
+        except subprocess.CalledProcessError as e:
+            print("Build {} failed: {}".format(nb, e))
+            ok = False
+        finished.put({'nb': nb, 'ok': ok, 'seconds': time.monotonic() - t0})
+    finished.put(None)
+
+def save_timeline(processed_dir, timeline):
+    with open(processed_dir + "/pipeline.json.tmp", "w") as f:
+        json.dump(timeline, f, indent=1)
+    os.replace(processed_dir + "/pipeline.json.tmp", processed_dir + "/pipeline.json")
+
+def pipeline(version, opts, bench_cores, pause=False, NB_RUNS=5, NB_EXTRINSIC=4, precision=None,
+             min_runs=run_benchmarks.MIN_RUNS, max_load=None, workloads=run_benchmarks.EXTRINSIC_WORKLOADS,
+             counters=True, NB_STARTUP=0, NB_DISK=0, disk_targets=run_benchmarks.DISK_TARGETS, disk_durations=[30],
+             docker=True):
+    """
+    Build the option sets opts (list of dicts as in compile.py) of version
+    and benchmark every binary as soon as it is built, pinned to the list
+    of cores bench_cores; the builds use the other cores. The official
+    binary (and docker) are benchmarked first, option sets that were built
+    before right after. pause: suspend the builds during every benchmark
+    run. max_load (see run_benchmarks.run) only makes sense with pause,
+    the builds keep the host busy otherwise. The other settings are those
+    of run_benchmarks.run (single instances, runs not interleaved).
+    Returns the session directory.
+    """
+    os.chdir(compile.BASE_DIR)
+    bin_dir = compile.BASE_DIR + '/bin/' + version
+    os.makedirs(bin_dir, exist_ok=True)
+    registry.import_legacy(version)
+    cores = build_cores(bench_cores)
+    if not cores:
+        raise ValueError("No cores left for the builds next to the benchmark cores {}".format(bench_cores))
+
+    # Number the new builds up front as compile_all, builds sharing the dependencies after each other
+    ready, todo = compile.number_builds(version, opts)
+    todo = sorted(todo, key=lambda b: compile.dependency_key(b[1]))
+    print("{} builds to compile on cores {}, {} built before, benchmarks on cores {}".format(
+        len(todo), cores, len(ready), bench_cores))
+
+    host = socket.gethostname()
+    now = datetime.now().strftime("%Y-%b-%d_%Hh%M")
+    processed_dir = 'output/' + version + "/" + host + "/" + now
+    os.makedirs(processed_dir, exist_ok=True)
+    targets = [("official", [run_benchmarks.official_binary(version)])]
+    if docker:
+        targets.append(("docker", ['docker', 'exec', run_benchmarks.docker_container(processed_dir)]))
+    settings = {'NB_RUNS': NB_RUNS, 'NB_EXTRINSIC': NB_EXTRINSIC, 'interleave': False, 'seed': None,
+                'precision': precision, 'min_runs': min_runs, 'cores': bench_cores, 'max_load': max_load,
+                'workloads': workloads, 'concurrency': [1], 'counters': counters,
+                'NB_STARTUP': NB_STARTUP, 'NB_DISK': NB_DISK, 'disk_targets': disk_targets,
+                'disk_durations': disk_durations}
+    manifest = {'version': version, 'settings': settings, 'targets': [], 'tasks': []}
+    run_benchmarks.save_manifest(processed_dir, manifest)
+
+    builds = Builds(pause)
+    finished = multiprocessing.Queue()
+    timeline = {'bench_cores': bench_cores, 'build_cores': cores, 'pause': pause, 'builds': [], 'benchmarks': []}
+    t0 = time.monotonic()
+    building = bool(todo)
+    if building:
+        builds.process = multiprocessing.Process(target=build_worker, args=(version, todo, cores, finished))
+        builds.process.start()
+
+    container = None
+    pending = list(targets) + [(nb, [registry.binary_path(version, nb)]) for nb in ready]
+    try:
+        while pending or building:
+            if building:
+                try:
+                    # only wait for a build when there is nothing to benchmark
+                    item = finished.get(timeout=5) if not pending else finished.get_nowait()
+                except queue.Empty:
+                    item = False
+                    if not pending and not builds.process.is_alive():
+                        print("Build process stopped (exit code {})".format(builds.process.exitcode))
+                        building = False
+                if item is None:
+                    building = False
+                elif item:
+                    item['finished'] = time.monotonic() - t0
+                    timeline['builds'].append(item)
+                    if item['ok']:
+                        pending.append((item['nb'], [registry.binary_path(version, item['nb'])]))
+                    continue
+            if not pending:
+                continue
+
+            nb_build, prefix = pending.pop(0)
+            if prefix[0] == 'docker':
+                container = prefix[2]
+                print("Starting docker container {}".format(container))
+                prefix, info = run_benchmarks.docker_start(version, container, bench_cores)
+                manifest = run_benchmarks.load_manifest(processed_dir)
+                manifest['docker'] = info
+                run_benchmarks.save_manifest(processed_dir, manifest)
+            manifest = run_benchmarks.load_manifest(processed_dir)
+            manifest['targets'].append((nb_build, prefix))
+            run_benchmarks.save_manifest(processed_dir, manifest)
+            start = time.monotonic() - t0
+            print("Benchmarking build {} ({} builds queued)".format(nb_build, len(pending)))
+            # disk stage only with the official binary (as run_benchmarks.run), not with every build
+            run_benchmarks.benchmark_all([(nb_build, prefix)], processed_dir, builds=builds, disk_build='official',
+                                         **settings)
+            if isinstance(nb_build, int):
+                registry.touch(version, nb_build)
+            if container is not None:
+                run_benchmarks.docker_stop(container)
+                container = None
+            timeline['benchmarks'].append({'nb_build': nb_build, 'start': start, 'seconds': time.monotonic() - t0 - start})
+            save_timeline(processed_dir, timeline)
+    finally:
+        if container is not None:
+            run_benchmarks.docker_stop(container)
+        if builds.process is not None and builds.process.is_alive():
+            # interrupted
+            builds.kill()
+
+    timeline['seconds'] = time.monotonic() - t0
+    save_timeline(processed_dir, timeline)
+    build_seconds = sum(b['seconds'] for b in timeline['builds'])
+    bench_seconds = sum(b['seconds'] for b in timeline['benchmarks'])
+    print("Builds {:.1f} h, benchmarks {:.1f} h, together {:.1f} h (instead of {:.1f} h)".format(
+        build_seconds / 3600, bench_seconds / 3600, timeline['seconds'] / 3600, (build_seconds + bench_seconds) / 3600))
+    failed = [b['nb'] for b in timeline['builds'] if not b['ok']]
+    if failed:
+        print("Failed builds: {}".format(failed))
+    return processed_dir
+
+if __name__ == "__main__":
+    version = '0.9.27'
+
+    # The good builds of compile.py
+    opts = []
+    opts.append({'toolchain': 'stable',  'arch': 'native', 'codegen-units': 1,  'lto': 'fat',  'opt-level': 3})
+    opts.append({'toolchain': 'stable',  'arch': 'native', 'codegen-units': 16, 'lto': 'fat',  'opt-level': 3})
+    opts.append({'toolchain': 'nightly', 'arch': 'native', 'codegen-units': 1,  'lto': 'fat',  'opt-level': 2})
+    opts.append({'toolchain': 'nightly', 'arch': 'native', 'codegen-units': 1,  'lto': 'thin', 'opt-level': 2})
+    opts.append({'toolchain': 'nightly', 'arch': 'native', 'codegen-units': 16, 'lto': 'fat',  'opt-level': 3})
+
+    # Benchmarks on the last physical core (as run_benchmarks.py), the builds on the others
+    BENCH_CORES = run_benchmarks.physical_cores()[-1:]
+    # as in run_benchmarks.py
+    PRECISION = 0.01
+    MAX_RUNS = 20
+    STARTUP_RUNS = 10
+
+    # --pause suspends the builds during every benchmark run (and waits for a quiet host)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pause', action='store_true')
+    args = parser.parse_args()
+    MAX_LOAD = 20 if args.pause else None
+    pipeline(version, opts, BENCH_CORES, pause=args.pause, NB_RUNS=MAX_RUNS, NB_EXTRINSIC=MAX_RUNS,
+             precision=PRECISION, max_load=MAX_LOAD, NB_STARTUP=STARTUP_RUNS)
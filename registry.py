@@ -0,0 +1,211 @@
+# Copyright 2022 https://www.math-crypto.com
+# GNU General Public License
+
+# Registry of all polkadot builds, stored in
+#     ~/polkadot-optimized/bin/registry.sqlite
+# A build is identified by a hash of the version, the build options,
+# the toolchain version and RUSTFLAGS. Every binary is stored once per
+# SHA-256 in
+#     ~/polkadot-optimized/bin/store/
+# and bin/VERSION/polkadot_NB.bin is a hard link to it.
+# Used by compile.py, run_benchmarks.py and parse_benchmarks.py.
+
+import os
+import json
+import glob
+import time
+import tempfile
+import hashlib
+import sqlite3
+import shutil
+import contextlib
+
+BIN_DIR = os.path.expanduser('~/polkadot-optimized/bin')
+REGISTRY = BIN_DIR + '/registry.sqlite'
+STORE_DIR = BIN_DIR + '/store'
+
+@contextlib.contextmanager
+def connect():
+    "Connection in one transaction (committed, or rolled back on an error), closed afterwards"
+    os.makedirs(BIN_DIR, exist_ok=True)
+    con = sqlite3.connect(REGISTRY, timeout=60)
+    con.row_factory = sqlite3.Row
+    try:
+        with con:
+            create_table(con)
+            yield con
+    finally:
+        con.close()
+
+def create_table(con):
+    "The builds table, if not there yet"
+    con.execute("""CREATE TABLE IF NOT EXISTS builds (
+                    key TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    nb INTEGER NOT NULL,
+                    options TEXT NOT NULL,
+                    toolchain_version TEXT,
+                    rustflags TEXT,
+                    sha256 TEXT,
+                    size INTEGER,
+                    meta TEXT,
+                    created REAL,
+                    last_used REAL,
+                    evicted INTEGER DEFAULT 0,
+                    UNIQUE(version, nb))""")
+    con.execute("CREATE INDEX IF NOT EXISTS builds_sha256 ON builds(sha256)")
+
+# Options added later, with the value of the builds from before
+DEFAULT_OPTIONS = {'pgo': False, 'bolt': False, 
+                   'linker': 'default', 'allocator': 'default', 'panic': 'unwind',
+                   'target-feature': 'none', 'relocation-model': 'default'}
+
+def normalize_options(opts):
+    """
+    Same options give the same dict: no arch is 'none' (not None) and
+    options with their default value are left out (as in older builds)
+    """
+    opts = dict(opts)
+    if opts.get('arch') is None:
+        opts['arch'] = 'none'
+    for key, value in DEFAULT_OPTIONS.items():
+        if opts.get(key, value) == value:
+            opts.pop(key, None)
+    return opts
+
+def build_key(version, opts, toolchain_version, rustflags):
+    "Canonical hash of a build; toolchain_version is None for builds from before the registry"
+    canonical = json.dumps({'version': version,
+                            'build_options': normalize_options(opts),
+                            'toolchain_version': toolchain_version,
+                            'RUSTFLAGS': (rustflags or '').strip()}, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def sha256sum(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def binary_path(version, nb):
+    return BIN_DIR + '/{}/polkadot_{}.bin'.format(version, nb)
+
+def to_dict(row):
+    build = dict(row)
+    build['options'] = json.loads(build['options'])
+    build['meta'] = json.loads(build['meta']) if build['meta'] else {}
+    build['path'] = binary_path(build['version'], build['nb'])
+    return build
+
+def lookup(version, opts, toolchain_version, rustflags):
+    "The registered build for these options (or a build from before the registry) or None"
+    with connect() as con:
+        for tc in [toolchain_version, None]:
+            row = con.execute("SELECT * FROM builds WHERE key=?",
+                              (build_key(version, opts, tc, rustflags),)).fetchone()
+            if row is not None:
+                return to_dict(row)
+    return None
+
+def next_number(version):
+    with connect() as con:
+        nb = con.execute("SELECT MAX(nb) FROM builds WHERE version=?", (version,)).fetchone()[0]
+    return 0 if nb is None else nb + 1
+
+def store(binary):
+    "Replace binary by a hard link into the store, identical binaries share one file"
+    sha = sha256sum(binary)
+    blob = STORE_DIR + '/' + sha + '.bin'
+    os.makedirs(STORE_DIR, exist_ok=True)
+    if not os.path.exists(blob):
+        # unique temporary file, parallel builds can store the same binary
+        fd, tmp = tempfile.mkstemp(dir=STORE_DIR, suffix='.tmp')
+        os.close(fd)
+        shutil.copy2(binary, tmp)
+        os.replace(tmp, blob)
+    os.remove(binary)
+    try:
+        os.link(blob, binary)
+    except OSError:
+        # store on another file system
+        shutil.copy2(blob, binary)
+    return sha
+
+def register(version, nb, opts, toolchain_version, rustflags, binary=None, meta=None):
+    "Register build nb of version, binary (default bin/VERSION/polkadot_NB.bin) is moved into the store"
+    if binary is None:
+        binary = binary_path(version, nb)
+    sha = store(binary)
+    now = time.time()
+    with connect() as con:
+        # a rebuild of an evicted build keeps its number (see compile.evicted_build)
+        con.execute("DELETE FROM builds WHERE version=? AND nb=?", (version, nb))
+        con.execute("INSERT OR REPLACE INTO builds VALUES (?,?,?,?,?,?,?,?,?,?,?,0)",
+                    (build_key(version, opts, toolchain_version, rustflags), version, nb,
+                     json.dumps(normalize_options(opts), sort_keys=True), toolchain_version, rustflags,
+                     sha, os.path.getsize(binary), json.dumps(meta or {}), now, now))
+    return sha
+
+def builds(version, include_evicted=False):
+    "All builds of version ordered by number"
+    with connect() as con:
+        rows = con.execute("SELECT * FROM builds WHERE version=? AND (evicted=0 OR ?) ORDER BY nb",
+                           (version, include_evicted)).fetchall()
+    return [to_dict(r) for r in rows]
+
+def build_options(version, nb):
+    "Build options of build nb of version or None if unknown"
+    with connect() as con:
+        row = con.execute("SELECT options FROM builds WHERE version=? AND nb=?", (version, int(nb))).fetchone()
+    return None if row is None else json.loads(row['options'])
+
+def touch(version, nb):
+    "Mark build as used (for the LRU eviction)"
+    with connect() as con:
+        con.execute("UPDATE builds SET last_used=? WHERE version=? AND nb=?", (time.time(), version, int(nb)))
+
+def import_legacy(version):
+    "Register the bin/VERSION/polkadot_NB.json files from before the registry"
+    known = set(b['nb'] for b in builds(version, include_evicted=True))
+    for f in glob.glob(BIN_DIR + '/{}/polkadot_*.json'.format(version)):
+        nb = int(os.path.basename(f)[len('polkadot_'):-len('.json')])
+        binary = f[:-len('.json')] + '.bin'
+        if nb in known or not os.path.isfile(binary):
+            continue
+        with open(f, "r") as file:
+            json_dict = json.load(file)
+        register(version, nb, json_dict['build_options'], json_dict.get('toolchain_version'),
+                 json_dict.get('RUSTFLAGS', ''), binary=binary, meta=json_dict)
+
+def disk_usage():
+    "Bytes of all stored (not evicted) binaries"
+    with connect() as con:
+        rows = con.execute("SELECT DISTINCT sha256, size FROM builds WHERE evicted=0").fetchall()
+    return sum(r['size'] for r in rows)
+
+def evict(max_bytes, keep_version=None):
+    """
+    Remove binaries of the least recently used builds of other versions than
+    keep_version until the store uses at most max_bytes. The builds stay in the
+    registry (marked evicted) so their benchmarks can still be parsed.
+    """
+    total = disk_usage()
+    with connect() as con:
+        candidates = con.execute("SELECT * FROM builds WHERE evicted=0 AND version IS NOT ? ORDER BY last_used",
+                                 (keep_version,)).fetchall()
+        for row in candidates:
+            if total <= max_bytes:
+                break
+            build = to_dict(row)
+            print("Evicting build {} of version {}".format(build['nb'], build['version']))
+            if os.path.exists(build['path']):
+                os.remove(build['path'])
+            con.execute("UPDATE builds SET evicted=1 WHERE key=?", (build['key'],))
+            in_use = con.execute("SELECT COUNT(*) FROM builds WHERE sha256=? AND evicted=0", (build['sha256'],)).fetchone()[0]
+            if in_use == 0:
+                blob = STORE_DIR + '/' + build['sha256'] + '.bin'
+                if os.path.exists(blob):
+                    os.remove(blob)
+                total = total - build['size']
+    return total
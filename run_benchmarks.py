@@ -19,6 +19,7 @@
 
 import subprocess
 import sys
+import argparse
 import os, stat
 import socket
 from datetime import datetime
@@ -26,76 +27,892 @@ import psutil # pip install psutil
 import glob
 import re
 import shutil
+import json
+import time
+import math
+import random
+import itertools
+import functools
+import contextlib
+import signal
+import statistics
+import threading
+import struct
+import tempfile
 from pathlib import Path
 import requests
+import pyarrow as pa # pip install pyarrow
 
+import registry
+import parse_benchmarks
 
-def perform_benchmark(binary, NB_RUNS, nb_build, processed_dir, docker=False):
-    for i in range(NB_RUNS):        
-        print("Performing benchmark run {} for polkadot build {}".format(i, nb_build))
+# Workloads of a benchmark run (also used to collect the profiles of PGO builds)
+MACHINE_BENCHMARK = ["benchmark", "machine", "--disk-duration", "30"]
+# Extrinsic benchmarks of a session, the name is used in the file names and
+# as column Extr-NAME in the notebooks. repeat and warmup None: defaults of
+# polkadot (100 and 10).
+EXTRINSIC_WORKLOADS = [
+    {'name': 'Remark', 'chain': 'polkadot-dev', 'pallet': 'system', 'extrinsic': 'remark', 'repeat': None, 'warmup': None},
+    {'name': 'Transfer', 'chain': 'polkadot-dev', 'pallet': 'balances', 'extrinsic': 'transfer_keep_alive', 'repeat': None, 'warmup': None},
+    # {'name': 'Transfer-Kusama', 'chain': 'kusama-dev', 'pallet': 'balances', 'extrinsic': 'transfer_keep_alive', 'repeat': None, 'warmup': None},
+]
+# Storage targets of the disk stage: the disk part of the machine benchmark
+# runs once per target and duration (with the official binary, the disk
+# speed does not depend on the build), the machine benchmark of every
+# build then skips it. path is the --base-path of the benchmark, None the
+# default base path of polkadot.
+DISK_TARGETS = [
+    {'name': 'default', 'path': None},
+    # {'name': 'nvme', 'path': '/mnt/nvme/polkadot-bench'},
+    # {'name': 'tmpfs', 'path': '/dev/shm/polkadot-bench'},
+]
+DISK_SCORES = parse_benchmarks.DISK_SCORES
+# Seconds between the samples of the CPU/system load during a benchmark
+SAMPLE_INTERVAL = 1.0
+# Busy host: seconds to wait at most before a run and number of attempts of a run
+QUIET_TIMEOUT = 600
+MAX_ATTEMPTS = 3
+# Seconds after which a hanging benchmark is killed
+BENCHMARK_TIMEOUT = 1800
+# Hardware counters of every run with perf stat (PERF=/path/to/perf for
+# another perf), the counters of /proc are used when perf cannot count
+PERF = os.environ.get('PERF', 'perf')
+PERF_EVENTS = ['instructions', 'cycles', 'branch-misses', 'cache-misses', 'context-switches']
+# Stopping rule: at least MIN_RUNS runs, scores of the machine benchmark
+# (names of parse_benchmarks.py) that need to reach the precision
+MIN_RUNS = 3
+MACHINE_SCORES = parse_benchmarks.SCORES
 
-        pct_before = psutil.cpu_percent(interval=2)
-        if not docker:
-            bench = subprocess.run([binary, "benchmark", "machine", "--disk-duration", "30"], 
-                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)                    
-        else:
-            #shlex.split("docker run --rm -it parity/polkadot:v0.9.26 benchmark machine --disk-duration 30")
-            bench = subprocess.run(['docker', 'run', '--rm', '-it', 'parity/polkadot:v{}'.format(version), 
-                                    'benchmark', 'machine', '--disk-duration', '30'], 
-                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)                    
-        out = bench.stdout.decode("utf-8")
-        pct_after = psutil.cpu_percent(interval=2)
+# Startup benchmark (see startup_once): the --version start is repeated
+# WARM_STARTS times, the --dev node runs DEV_SECONDS for its peak RSS
+WARM_STARTS = 5
+DEV_SECONDS = 10
+STARTUP_TIMEOUT = 120
+STARTUP_SCORES = parse_benchmarks.STARTUP_SCORES
 
-        with open(processed_dir + "/bench_{}_run_{}.txt".format(nb_build, i), "w") as text_file:
-            text_file.write("CPU utilization at start: {}\n".format(pct_before))
-            text_file.write(out)
-            text_file.write("CPU utilization at end: {}\n".format(pct_after))
+# Docker image of a version, its benchmarks run with docker exec in one
+# container per session; the exec overhead is measured before every run
+DOCKER_IMAGE = 'parity/polkadot:v{}'
+DOCKER_OVERHEAD_RUNS = 3
 
+def tree_cpu_times(pids):
+    "CPU time (user+system) of the processes pids and all their children {pid: seconds}"
+    times = {}
+    for pid in pids:
+        try:
+            parent = psutil.Process(pid)
+            processes = [parent] + parent.children(recursive=True)
+        except psutil.Error:
+            continue
+        for p in processes:
+            try:
+                times[p.pid] = sum(p.cpu_times()[:2])
+            except psutil.Error:
+                continue
+    return times
+
+class Sampler(threading.Thread):
+    """
+    Samples the load of the system and of the benchmark processes pids (with
+    their children) every interval seconds while the benchmark runs.
+    With thread_counters, the counters of /proc of every thread of the
+    benchmarks are kept as well (see proc_counters). builds is a function
+    that returns the pids of builds running next to the benchmark (see
+    pipeline.py), their CPU usage is sampled as build_cpu.
+    """
+    def __init__(self, pids, interval=SAMPLE_INTERVAL, thread_counters=False, builds=None):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.builds = builds
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread_counters = thread_counters
+        # last counters of every thread, per benchmark process
+        self.threads = [{} for pid in pids]
+
+    def run(self):
+        # CPU time (user+system) of every process of the benchmark (and the builds) at the last sample
+        cpu_times = {}
+        build_times = tree_cpu_times(self.builds()) if self.builds is not None else {}
+        # first calls only set the reference point of the percentages
+        psutil.cpu_percent()
+        psutil.cpu_percent(percpu=True)
+        ctx_start = psutil.cpu_stats().ctx_switches
+        t0 = time.monotonic()
+        t_last = t0
+        while not self.stopped.wait(self.interval):
+            proc_time = 0.0
+            proc_rss = 0
+            tree = []
+            for k, pid in enumerate(self.pids):
+                try:
+                    parent = psutil.Process(pid)
+                    processes = [parent] + parent.children(recursive=True)
+                except psutil.Error:
+                    continue
+                tree = tree + processes
+                if self.thread_counters:
+                    for p in processes:
+                        self.threads[k].update(proc_counters(p.pid))
+            for p in tree:
+                try:
+                    t = sum(p.cpu_times()[:2])
+                    proc_rss = proc_rss + p.memory_info().rss
+                except psutil.Error:
+                    continue
+                # new processes started after the last sample
+                proc_time = proc_time + t - cpu_times.get(p.pid, 0.0)
+                cpu_times[p.pid] = t
+            build_time = 0.0
+            if self.builds is not None:
+                times = tree_cpu_times(self.builds())
+                build_time = sum(t - build_times.get(pid, 0.0) for pid, t in times.items())
+                build_times = times
+            now = time.monotonic()
+            proc_cpu = 100.0 * proc_time / (now - t_last)
+            sample_time = now - t_last
+            t_last = now
+            freq = psutil.cpu_freq()
+            sample = {'t': now - t0,
+                      'cpu': psutil.cpu_percent(),
+                      'per_cpu': psutil.cpu_percent(percpu=True),
+                      'freq': freq.current if freq else None,
+                      'load': os.getloadavg()[0],
+                      'ctx_switches': psutil.cpu_stats().ctx_switches - ctx_start,
+                      'proc_cpu': proc_cpu,
+                      'proc_rss': proc_rss}
+            if self.builds is not None:
+                sample['build_cpu'] = 100.0 * build_time / sample_time
+            self.samples.append(sample)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def counters(self, k):
+        "Scheduler counters of /proc of benchmark process k, summed over its threads"
+        if not self.threads[k]:
+            return {}
+        threads = self.threads[k].values()
+        return {name: sum(t[name] for t in threads) for name in ['run_ns', 'run_delay_ns']}
+
+    def summary(self):
+        "Summary statistics of the samples"
+        if not self.samples:
+            return {'nb_samples': 0}
+        ncpu = psutil.cpu_count()
+        col = lambda key: [s[key] for s in self.samples if s[key] is not None]
+        # system load that is not caused by the benchmark itself
+        background = [max(0.0, s['cpu'] - s['proc_cpu']/ncpu) for s in self.samples]
+        freq = col('freq')
+        builds = {}
+        if self.builds is not None:
+            builds = {'build_cpu_mean': statistics.mean(col('build_cpu')), 'build_cpu_max': max(col('build_cpu'))}
+        return {**builds, 'nb_samples': len(self.samples),
+                'cpu_mean': statistics.mean(col('cpu')), 'cpu_max': max(col('cpu')),
+                'background_mean': statistics.mean(background), 'background_max': max(background),
+                'freq_mean': statistics.mean(freq) if freq else None, 'freq_min': min(freq) if freq else None,
+                'load_max': max(col('load')),
+                'ctx_switches': self.samples[-1]['ctx_switches'],
+                'proc_cpu_mean': statistics.mean(col('proc_cpu')), 'proc_rss_max': max(col('proc_rss'))}
+
+def proc_counters(pid):
+    """
+    Time on the CPU and waiting for a CPU of every thread of process pid
+    from /proc/PID/task/TID/schedstat: {tid: counters}. A thread that ends
+    between two samples misses its last interval.
+    """
+    threads = {}
+    for task in glob.glob('/proc/{}/task/*'.format(pid)):
+        try:
+            with open(task + '/schedstat') as f:
+                run_ns, run_delay_ns = f.read().split()[:2]
+        except OSError:
+            # thread ended
+            continue
+        threads[(pid, os.path.basename(task))] = {'run_ns': int(run_ns), 'run_delay_ns': int(run_delay_ns)}
+    return threads
+
+@functools.lru_cache()
+def perf_available():
+    "True if perf stat can count instructions on this host"
+    try:
+        out = subprocess.run([PERF, 'stat', '-x', ',', '-e', 'instructions', '--', 'true'],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return out.returncode == 0 and 'instructions' in out.stderr and '<not' not in out.stderr
+
+def perf_command(cmd, perf_file):
+    "cmd run under perf stat, the counters go to perf_file"
+    return [PERF, 'stat', '-x', ',', '-o', perf_file, '-e', ','.join(PERF_EVENTS), '--'] + cmd
+
+def read_perf(perf_file):
+    "Counters of perf stat -x , output, None for the events perf could not count"
+    counters = {}
+    if not os.path.exists(perf_file):
+        # killed benchmark
+        return counters
+    with open(perf_file, "r") as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if line.startswith('#') or len(fields) < 3:
+                continue
+            # instructions:u -> instructions
+            name = fields[2].split(':')[0].replace('-', '_')
+            try:
+                counters[name] = float(fields[0])
+            except ValueError:
+                # <not supported> or <not counted>
+                counters[name] = None
+    if counters.get('instructions') and counters.get('cycles'):
+        counters['ipc'] = counters['instructions'] / counters['cycles']
+    return counters
+
+# Typed records of the results, one Arrow IPC file per run in
+#     output/VERSION/HOSTNAME/DATE_TIME/records/
+RECORD_SCHEMA = pa.schema([('ver', pa.string()), ('host', pa.string()), ('date', pa.string()),
+                           ('kind', pa.string()), ('workload', pa.string()),
+                           ('nb_build', pa.string()), ('nb_run', pa.int32()),
+                           ('concurrency', pa.int32()), ('instance', pa.int32()),
+                           ('category', pa.string()), ('name', pa.string()),
+                           ('value', pa.float64()), ('unit', pa.string())])
+
+def stream_output(bench, out_file, record_file, record, results, usage):
+    """
+    Write the output of process bench line by line to out_file and its
+    results to record_file. The resource usage of the process (and its
+    children) goes to the dict usage.
+    """
+    with open(out_file, "w") as text_file, pa.ipc.new_file(record_file + ".part", RECORD_SCHEMA) as writer:
+        for line in bench.stdout:
+            text_file.write(line)
+            text_file.flush()
+            for category, name, value, unit in parse_benchmarks.parse_line(line):
+                results[name] = value
+                row = dict(record or {}, category=category, name=name, value=value, unit=unit)
+                writer.write_batch(pa.record_batch([[row.get(f.name)] for f in RECORD_SCHEMA], schema=RECORD_SCHEMA))
+    # wait4 instead of bench.wait() for the resource usage
+    try:
+        _, status, rusage = os.wait4(bench.pid, 0)
+    except ChildProcessError:
+        # already waited for after Ctrl-C
+        return
+    bench.returncode = os.waitstatus_to_exitcode(status)
+    usage.update({'context_switches': rusage.ru_nvcsw + rusage.ru_nivcsw,
+                  'page_faults': rusage.ru_minflt + rusage.ru_majflt})
+
+def sampled_run(cmds, out_files, interval=SAMPLE_INTERVAL, cores=None, extra=None, record=None, timeout=BENCHMARK_TIMEOUT,
+                counters=None, builds=None):
+    """
+    Run the commands cmds at the same time (command k pinned to the list of
+    cores cores[k] if given) while sampling the load. The output of command
+    k is streamed line by line to out_files[k] and every result in it is
+    appended to records/<out_file>.arrow with the fields of the dict record
+    (kind, nb_build, ...) and its instance k. The samples with their summary
+    (and the dict extra) go to load_<out_file>.json. The runs are killed
+    after timeout seconds. counters: None, 'perf' (the commands run under
+    perf stat, its output in perf_<out_file>.csv) or 'proc' (context
+    switches and page faults of wait4, scheduler counters of /proc); the
+    counters go to the load json as well. builds: pids of concurrent builds
+    (see Sampler).
+    Returns the results {name: value} of every command and the summary of the load.
+    """
+    def pinned(k):
+        def preexec_fn():
+            # own process group, so a timeout kills all processes of the benchmark
+            os.setpgrp()
+            if cores:
+                # before exec, so all threads of the benchmark are pinned
+                # (no psutil in the forked child, the sampler thread runs in the parent)
+                os.sched_setaffinity(0, cores[k])
+        return preexec_fn
+    perf_files = [os.path.join(os.path.dirname(f), "perf_" + Path(f).stem + ".csv") for f in out_files]
+    if counters == 'perf':
+        cmds = [perf_command(cmd, perf_files[k]) for k, cmd in enumerate(cmds)]
+    benches = [subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=pinned(k),
+                                encoding="utf-8", errors="replace") for k, cmd in enumerate(cmds)]
+    sampler = Sampler([bench.pid for bench in benches], interval, thread_counters=counters == 'proc', builds=builds)
+    sampler.start()
+    timed_out = threading.Event()
+    def kill():
+        timed_out.set()
+        for bench in benches:
+            try:
+                os.killpg(bench.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    timer = threading.Timer(timeout, kill)
+    timer.daemon = True
+    timer.start()
+
+    record_dir = os.path.join(os.path.dirname(out_files[0]), "records")
+    os.makedirs(record_dir, exist_ok=True)
+    record_files = [os.path.join(record_dir, Path(f).stem + ".arrow") for f in out_files]
+    results = [{} for cmd in cmds]
+    usages = [{} for cmd in cmds]
+    readers = [threading.Thread(target=stream_output, daemon=True,
+                                args=(bench, out_files[k], record_files[k], dict(record or {}, instance=k), results[k], usages[k]))
+               for k, bench in enumerate(benches)]
+    try:
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+    finally:
+        # also on Ctrl-C: no benchmark left running
+        timer.cancel()
+        sampler.stop()
+        for bench in benches:
+            if bench.poll() is None:
+                os.killpg(bench.pid, signal.SIGKILL)
+                bench.wait()
+    summary = sampler.summary()
+    for f in record_files:
+        os.replace(f + ".part", f)
+    if timed_out.is_set():
+        print("Benchmark killed after {} seconds".format(timeout))
+
+    for k, out_file in enumerate(out_files):
+        load_file = os.path.join(os.path.dirname(out_file), "load_" + Path(out_file).stem + ".json")
+        load = {'interval': interval, 'cores': cores[k] if cores else None, 'instance': k, 'concurrency': len(cmds)}
+        load.update(extra or {})
+        load.update({'returncode': benches[k].returncode, 'timed_out': timed_out.is_set(),
+                     'summary': summary, 'samples': sampler.samples})
+        if counters == 'perf':
+            load['counters'] = dict(read_perf(perf_files[k]), source='perf')
+        elif counters == 'proc':
+            load['counters'] = dict(sampler.counters(k), **usages[k], source='proc')
+        with open(load_file, "w") as f:
+            json.dump(load, f)
+    return results, summary
+
+def wait_for_quiet_host(max_load, timeout=QUIET_TIMEOUT):
+    "Wait until the CPU usage of the host is at most max_load %, returns the seconds waited"
+    t0 = time.monotonic()
+    while True:
+        load = psutil.cpu_percent(interval=0.5)
+        if load <= max_load:
+            break
+        if time.monotonic() - t0 > timeout:
+            print("Host is still busy ({}% CPU), running anyway".format(load))
+            break
+        print("Host is busy ({}% CPU), waiting".format(load))
+        time.sleep(5)
+    return time.monotonic() - t0
+
+def extrinsic_command(workload):
+    "Arguments of the extrinsic benchmark of workload (dict of EXTRINSIC_WORKLOADS)"
+    cmd = ['benchmark', 'extrinsic', '--pallet', workload['pallet'], '--extrinsic', workload['extrinsic'],
+           '--chain', workload['chain']]
+    if workload.get('repeat') is not None:
+        cmd = cmd + ['--repeat', str(workload['repeat'])]
+    if workload.get('warmup') is not None:
+        cmd = cmd + ['--warmup', str(workload['warmup'])]
+    return cmd
+
+@functools.lru_cache(maxsize=None)
+def cpu_only_command(prefix):
+    """
+    Arguments of a machine benchmark with the shortest disk part for the
+    binary of the command prefix (tuple): --disk-duration 0 still runs one
+    short iteration of the disk benchmarks, its scores are ignored. The
+    full MACHINE_BENCHMARK if the benchmark has no --disk-duration
+    """
+    try:
+        usage = subprocess.run(list(prefix) + ['benchmark', 'machine', '--help'], stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, encoding="utf-8", errors="replace", timeout=60).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return MACHINE_BENCHMARK
+    if '--disk-duration' not in usage:
+        return MACHINE_BENCHMARK
+    cmd = ['benchmark', 'machine', '--disk-duration', '0']
+    # no failure because of the (ignored) disk scores
+    if '--allow-fail' in usage:
+        cmd.append('--allow-fail')
+    return cmd
+
+def disk_workloads(disk_targets, disk_durations):
+    "Workloads of the disk stage: every storage target (see DISK_TARGETS) with every duration (seconds)"
+    return [dict(target, duration=d, name="{}-{}s".format(target['name'], d))
+            for target in disk_targets for d in disk_durations]
+
+def disk_command(workload):
+    "Arguments of the machine benchmark of a disk stage workload (see disk_workloads)"
+    cmd = ['benchmark', 'machine', '--disk-duration', str(workload['duration'])]
+    if workload['path'] is not None:
+        os.makedirs(workload['path'], exist_ok=True)
+        cmd = cmd + ['--base-path', workload['path']]
+    return cmd
+
+def physical_cores():
+    "One logical CPU of every physical core (the first of its hyperthreads) that we may run on"
+    allowed = sorted(psutil.Process().cpu_affinity())
+    cores = []
+    seen = set()
+    for cpu in allowed:
+        try:
+            with open("/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list".format(cpu)) as f:
+                siblings = f.read().strip()
+        except OSError:
+            siblings = str(cpu)
+        if siblings not in seen:
+            seen.add(siblings)
+            cores.append(cpu)
+    return cores
+
+def instance_cores(concurrency, cores=None):
+    """
+    Cores of the instances of a run with concurrency instances: instance k
+    on cores[k] (a list of cores) or on its own physical core, only on
+    hyperthreads if there are not enough physical cores
+    """
+    if concurrency == 1:
+        return [cores] if cores else None
+    if cores and len(cores) >= concurrency:
+        return [[c] for c in cores[:concurrency]]
+    available = physical_cores()
+    if len(available) < concurrency:
+        available = sorted(psutil.Process().cpu_affinity())
+    return [[available[k % len(available)]] for k in range(concurrency)]
+
+def scaling_levels(max_instances=None):
+    "Concurrency levels 1, 2, 4, ... up to max_instances (default: the number of physical cores)"
+    n = max_instances or len(physical_cores())
+    levels = [1]
+    while levels[-1] * 2 < n:
+        levels.append(levels[-1] * 2)
+    if n > 1:
+        levels.append(n)
+    return levels
+
+def elf_sections(path):
+    "Sizes (bytes) of the sections of the ELF binary path {name: size}, empty if it is not an ELF binary"
+    with open(path, 'rb') as f:
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != b'\x7fELF':
+            return {}
+        elf64 = ident[4] == 2
+        order = '<' if ident[5] == 1 else '>'
+        header = struct.Struct(order + ('HHIQQQIHHHHHH' if elf64 else 'HHIIIIIHHHHHH'))
+        fields = header.unpack(f.read(header.size))
+        shoff, shentsize, shnum, shstrndx = fields[5], fields[10], fields[11], fields[12]
+        if shoff == 0 or shnum == 0:
+            return {}
+        f.seek(shoff)
+        table = f.read(shentsize * shnum)
+        # name, type, flags, addr, offset, size of every section header
+        entry = struct.Struct(order + ('IIQQQQ' if elf64 else 'IIIIII'))
+        headers = [entry.unpack_from(table, k * shentsize) for k in range(shnum)]
+        f.seek(headers[shstrndx][4])
+        names = f.read(headers[shstrndx][5])
+    sections = {}
+    for h in headers:
+        name = names[h[0]:names.index(b'\0', h[0])].decode(errors='replace')
+        if name:
+            sections[name] = h[5]
+    return sections
+
+def evict_page_cache(path):
+    "Drop the cached pages of file path (pages mapped by a running process stay), False if not possible"
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except (OSError, AttributeError):
+        return False
+    return True
+
+def peak_rss(pid):
+    """
+    Peak RSS (MiB) of the running process pid (VmHWM of /proc, None if not
+    available). Not ru_maxrss of wait4: that includes this process, of which
+    the child is a copy until its exec.
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def startup_once(binary, nb_build, i, processed_dir, cores=None, max_load=None):
+    """
+    Startup run i of binary: milliseconds to --version with the binary
+    evicted from the page cache (Start-Cold) and cached (Start-Warm, median
+    of WARM_STARTS starts), milliseconds to the first log line of a --dev
+    node with a temporary base path (Start-Dev), the peak RSS (MiB) of the
+    node after DEV_SECONDS (RSS-Dev) and the size (MiB) of the binary. The
+    results, the sizes of all ELF sections and the log of the node go to
+    startup_NB_run_I.json and .txt.
+    Returns the results as a list with one dict (as benchmark_once).
+    """
+    def preexec_fn():
+        os.setpgrp()
+        if cores:
+            os.sched_setaffinity(0, cores)
+    def start():
+        "Milliseconds until --version exits"
+        t0 = time.perf_counter()
+        subprocess.run([binary, '--version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       preexec_fn=preexec_fn)
+        return 1000 * (time.perf_counter() - t0)
+
+    waited = 0 if max_load is None else wait_for_quiet_host(max_load)
+    evicted = evict_page_cache(binary)
+    cold = start()
+    warm = statistics.median(start() for k in range(WARM_STARTS))
+
+    out_file = processed_dir + "/startup_{}_run_{}".format(nb_build, i)
+    base_path = tempfile.mkdtemp(prefix="polkadot-startup-")
+    try:
+        with open(out_file + ".txt", "w") as log:
+            t0 = time.perf_counter()
+            node = subprocess.Popen([binary, '--dev', '--base-path', base_path], stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, preexec_fn=preexec_fn, encoding="utf-8", errors="replace")
+            timer = threading.Timer(STARTUP_TIMEOUT, os.killpg, args=(node.pid, signal.SIGKILL))
+            timer.daemon = True
+            timer.start()
+            reader = None
+            try:
+                first_line = node.stdout.readline()
+                dev = 1000 * (time.perf_counter() - t0) if first_line else None
+                log.write(first_line)
+                # the rest of the log, so the node never blocks on a full pipe
+                reader = threading.Thread(target=shutil.copyfileobj, args=(node.stdout, log), daemon=True)
+                reader.start()
+                time.sleep(max(0.0, DEV_SECONDS - (time.perf_counter() - t0)))
+                rss = peak_rss(node.pid)
+            finally:
+                timer.cancel()
+                try:
+                    os.killpg(node.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                node.wait()
+                if reader is not None:
+                    reader.join()
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+    results = {'Start-Cold': cold, 'Start-Warm': warm, 'Start-Dev': dev,
+               'RSS-Dev': rss,
+               'Size': os.path.getsize(binary) / 2**20}
+    results = {name: value for name, value in results.items() if value is not None}
+    with open(out_file + ".json", "w") as f:
+        json.dump({'results': results, 'sections': elf_sections(binary), 'page_cache_evicted': evicted,
+                   'cores': cores, 'waited': waited}, f)
+    return [results]
+
+def benchmark_once(prefix, kind, nb_build, i, processed_dir, sample_interval=SAMPLE_INTERVAL, cores=None, max_load=None,
+                   workload=None, concurrency=1, counters=True, cpu_only=False, builds=None):
+    """
+    Run i of benchmark kind ('machine', 'extrinsic' of workload or 'disk' of
+    a storage target, see disk_workloads) for the
+    command prefix (the binary or a docker exec command) with concurrency
+    instances at the same time, each on its own core (see instance_cores).
+    With max_load (%), the run waits for a quiet host and is repeated when
+    the host got busy during the run. With counters, the hardware counters
+    are collected with perf, or from /proc when perf is not available (not
+    for docker, its processes are not children of the docker command).
+    cpu_only: the machine benchmark runs the shortest disk part if the
+    binary can (see cpu_only_command).
+    builds: function returning the pids of builds running next to the
+    benchmark (see pipeline.py), their CPU usage is recorded in the load json.
+    Returns the results of the run {name: value} of every instance (see sampled_run).
+    Kind 'startup' is a run of startup_once.
+    """
+    if kind == 'startup':
+        return startup_once(prefix[0], nb_build, i, processed_dir, cores, max_load)
+    # instance k of a scaling run: bench_NB_run_I_xCONCURRENCY-K.txt
+    suffix = "" if concurrency == 1 else "_x{}-{{}}".format(concurrency)
+    extra = {}
+    if kind == 'machine':
+        args = cpu_only_command(tuple(prefix)) if cpu_only else MACHINE_BENCHMARK
+        extra['cpu_only'] = args != MACHINE_BENCHMARK
+        out_file = processed_dir + "/bench_{}_run_{}".format(nb_build, i) + suffix + ".txt"
+    elif kind == 'disk':
+        args = disk_command(workload)
+        extra['disk_target'] = workload['name']
+        out_file = processed_dir + "/disk_bench_{}_run_{}".format(nb_build, i) + suffix + "_{}.txt".format(workload['name'])
+    else:
+        args = extrinsic_command(workload)
+        out_file = processed_dir + "/new_bench_{}_run_{}".format(nb_build, i) + suffix + "_{}.txt".format(workload['name'])
+    out_files = [out_file.format(k) for k in range(concurrency)]
+    mode = None
+    if counters and prefix[0] != 'docker':
+        mode = 'perf' if perf_available() else 'proc'
+
+    ver, host, date = Path(processed_dir).parts[-3:]
+    record = {'ver': ver, 'host': host, 'date': date, 'kind': kind, 'nb_build': str(nb_build), 'nb_run': i,
+              'workload': workload['name'] if workload else None, 'concurrency': concurrency}
+    for attempt in range(MAX_ATTEMPTS):
+        waited = 0 if max_load is None else wait_for_quiet_host(max_load)
+        if prefix[0] == 'docker':
+            extra['docker_exec_ms'] = docker_overhead(prefix[2])
+        results, summary = sampled_run([prefix + args] * concurrency, out_files, sample_interval,
+                                       instance_cores(concurrency, cores),
+                                       extra=dict(extra, waited=waited, attempt=attempt), record=record, counters=mode,
+                                       builds=builds)
+        if max_load is None or summary.get('background_max', 0) <= max_load:
+            break
+        print("Host got busy during the run ({:.0f}% CPU), repeating it".format(summary['background_max']))
+    return results
+
+def docker_container(processed_dir):
+    "Name of the long-lived docker container of the session in processed_dir"
+    ver, host, date = Path(processed_dir).parts[-3:]
+    return "polkadot-optimized-{}-{}".format(ver, date)
+
+def docker_start(version, container, cores=None):
+    """
+    Pull the image of version once (never during a timed run), check it and
+    start the long-lived container of a session (pinned to cores). The
+    benchmarks run in it with docker exec, which needs no TTY.
+    Returns the command prefix of the benchmarks and the image, its id and
+    the milliseconds it took to start the container.
+    """
+    image = DOCKER_IMAGE.format(version)
+    if subprocess.run(['docker', 'image', 'inspect', image], stdout=subprocess.DEVNULL,
+                      stderr=subprocess.DEVNULL).returncode != 0:
+        print("Pulling docker image {}".format(image))
+        subprocess.run(['docker', 'pull', image], check=True)
+    inspect = subprocess.run(['docker', 'image', 'inspect', '--format', '{{.Id}} {{json .Config.Entrypoint}}', image],
+                             check=True, stdout=subprocess.PIPE, encoding="utf-8").stdout.split(' ', 1)
+    image_id = inspect[0].strip()
+    # the polkadot binary of the image is its entrypoint
+    entrypoint = json.loads(inspect[1]) if len(inspect) > 1 and inspect[1].strip() not in ('', 'null') else None
+    binary = entrypoint[0] if entrypoint else 'polkadot'
+
+    # a container left over from an interrupted session
+    docker_stop(container)
+    cmd = ['docker', 'run', '--detach', '--rm', '--name', container]
+    if cores:
+        cmd = cmd + ['--cpuset-cpus', ",".join(str(c) for c in cores)]
+    t0 = time.perf_counter()
+    subprocess.run(cmd + ['--entrypoint', 'sleep', image, 'infinity'], check=True, stdout=subprocess.DEVNULL)
+    start_ms = 1000 * (time.perf_counter() - t0)
+    prefix = ['docker', 'exec', container, binary]
+    subprocess.run(prefix + ['--version'], check=True, stdout=subprocess.DEVNULL)
+    return prefix, {'image': image, 'image_id': image_id, 'start_ms': start_ms}
+
+def docker_stop(container):
+    "Remove the container (if it exists)"
+    subprocess.run(['docker', 'rm', '--force', container], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def docker_overhead(container):
+    "Median milliseconds of a docker exec of a command that does nothing: the overhead of a run in the container"
+    def once():
+        t0 = time.perf_counter()
+        subprocess.run(['docker', 'exec', container, 'true'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return 1000 * (time.perf_counter() - t0)
+    return statistics.median(once() for k in range(DOCKER_OVERHEAD_RUNS))
+
+def relative_delta(values):
+    "Δ of the median (as calc_stats of mathcrypto.py) relative to the median, inf with less than 2 values"
+    if len(values) < 2:
+        return math.inf
+    med = statistics.median(values)
+    if med == 0:
+        return math.inf
+    return 1.25 * 1.96 * statistics.stdev(values) / math.sqrt(len(values)) / abs(med)
+
+def live_scores(kind, results, workload=None, cpu_only=False):
+    """
+    Scores of one run from the results of its instances (empty if the output
+    had none): the aggregate throughput of the machine and disk benchmark and the
+    mean latency of the extrinsic over the instances. cpu_only: the machine
+    benchmark ran with --disk-duration 0, its (short and noisy) disk scores
+    are left out.
+    """
+    if kind == 'machine':
+        names = [n for n in MACHINE_SCORES if not (cpu_only and n in DISK_SCORES)]
+        return {n: sum(r[n] for r in results) for n in names if all(n in r for r in results)}
+    if kind == 'startup':
+        return {n: results[0][n] for n in STARTUP_SCORES if n in results[0]}
+    if kind == 'disk':
+        return {n: sum(r[n] for r in results) for n in DISK_SCORES if all(n in r for r in results)}
+    if all('med' in r for r in results):
+        return {"Extr-" + workload: statistics.mean(r['med'] for r in results)}
+    return {}
+
+def precise_enough(history, precision, min_runs=MIN_RUNS):
+    "True if the runs so far (list of live_scores) have a relative Δ of at most precision for every score"
+    if len(history) < min_runs:
+        return False
+    names = [n for n in history[0] if all(n in h for h in history)]
+    return all(relative_delta([h[n] for h in history]) <= precision for n in names)
+
+def load_manifest(processed_dir):
+    "Manifest of the session in processed_dir (None for sessions from before the manifest)"
+    f = processed_dir + "/manifest.json"
+    if not os.path.exists(f):
+        return None
+    with open(f, "r") as text_file:
+        return json.load(text_file)
+
+def save_manifest(processed_dir, manifest):
+    "Write the manifest atomically, a crash leaves either the old or the new manifest"
+    manifest['complete'] = all(t['status'] != 'todo' for t in manifest['tasks'])
+    f = processed_dir + "/manifest.json"
+    with open(f + ".tmp", "w") as text_file:
+        json.dump(manifest, text_file, indent=1)
+        text_file.flush()
+        os.fsync(text_file.fileno())
+    os.replace(f + ".tmp", f)
+
+def benchmark_all(targets, processed_dir, NB_RUNS, NB_EXTRINSIC, interleave=False, seed=None,
+                  precision=None, min_runs=MIN_RUNS, first_run=0, sample_interval=SAMPLE_INTERVAL,
+                  cores=None, max_load=None, workloads=EXTRINSIC_WORKLOADS, concurrency=[1], counters=True,
+                  NB_STARTUP=0, NB_DISK=0, disk_targets=DISK_TARGETS, disk_durations=[30], builds=None,
+                  disk_build=None):
+    """
+    Machine and extrinsic benchmark runs (of every workload, see
+    EXTRINSIC_WORKLOADS) of all targets (nb_build, prefix), at every level
+    of concurrency (number of instances at the same time, e.g.
+    scaling_levels(); docker only runs single instances), and NB_STARTUP
+    startup runs (see startup_once, not for docker). The disk stage has
+    NB_DISK runs of every storage target and duration (see disk_workloads)
+    of the official binary (or the first binary), the machine benchmark of
+    all targets then runs the shortest disk part and its disk scores are
+    ignored (also by the stopping rule of precision). disk_build: the
+    target of the disk stage instead (when targets are benchmarked one by
+    one, see pipeline.py).
+    Interleaved: round i has run i of every target and kind, in random order,
+    so drift of the host (temperature, turbo, background load) is spread over
+    all binaries. Otherwise all runs of one target after each other.
+    With precision (e.g. 0.01), the runs of a target and kind stop once every
+    score has a Δ of at most precision times its median (after at least
+    min_runs runs); NB_RUNS and NB_EXTRINSIC are then the maximum number of runs.
+    first_run > 0 adds runs to earlier runs of the same build.
+    counters: collect hardware counters of every run (see benchmark_once).
+    builds: the builds running at the same time (see pipeline.Builds), their
+    CPU usage is recorded with every run and with builds.pause they are
+    suspended during every run.
+    The planned runs (tasks) are kept in manifest.json of the session and
+    marked done (or skipped when precise enough) one by one, so an
+    interrupted session continues with the tasks that are still todo.
+    Returns a list with the runs and relative Δ of every target and kind.
+    """
+    manifest = load_manifest(processed_dir) or {'tasks': []}
+    tasks = {(t['nb_build'], t['kind'], t['workload'], t.get('concurrency', 1), t['run']): t for t in manifest['tasks']}
+    # results of the runs done before an interruption
+    records = parse_benchmarks.read_records(processed_dir) or {}
+    startup = parse_benchmarks.read_startup(processed_dir)
+    binaries = [nb_build for nb_build, prefix in targets if prefix[0] != 'docker']
+    if disk_build is None:
+        disk_build = 'official' if 'official' in binaries else (binaries or [None])[0]
+    cpu_only = bool(NB_DISK and disk_targets and disk_durations)
+    series = []
+    for nb_build, prefix in targets:
+        kinds = [('machine', None, NB_RUNS)] + [('extrinsic', w, NB_EXTRINSIC) for w in workloads]
+        if NB_STARTUP and prefix[0] != 'docker':
+            kinds.append(('startup', None, NB_STARTUP))
+        if cpu_only and nb_build == disk_build:
+            kinds = kinds + [('disk', w, NB_DISK) for w in disk_workloads(disk_targets, disk_durations)]
+        levels = [1] if prefix[0] == 'docker' else concurrency
+        for (kind, workload, max_runs), c in itertools.product(kinds, levels):
+            if kind in ['startup', 'disk'] and c > 1:
+                continue
+            name = workload['name'] if workload else None
+            planned = []
+            for i in range(first_run, first_run + max_runs):
+                key = (str(nb_build), kind, name, c, i)
+                if key not in tasks:
+                    tasks[key] = {'nb_build': str(nb_build), 'kind': kind, 'workload': name, 'concurrency': c,
+                                  'run': i, 'status': 'todo'}
+                    manifest['tasks'].append(tasks[key])
+                planned.append(tasks[key])
+            if kind == 'startup':
+                history = [live_scores(kind, [startup.get((str(nb_build), t['run']), {})])
+                           for t in planned if t['status'] == 'done']
+            else:
+                history = [live_scores(kind, [records.get((kind, name, str(nb_build), t['run'], c, k), {}) for k in range(c)], name,
+                                       cpu_only)
+                           for t in planned if t['status'] == 'done']
+            series.append({'nb_build': nb_build, 'prefix': prefix, 'kind': kind, 'workload': workload,
+                           'concurrency': c, 'tasks': planned, 'history': history})
+    save_manifest(processed_dir, manifest)
+
+    def todo(s):
+        return [t for t in s['tasks'] if t['status'] == 'todo']
+
+    def finished(s):
+        if not todo(s):
+            return True
+        if precision is not None and precise_enough(s['history'], precision, min_runs):
+            for t in todo(s):
+                t['status'] = 'skipped'
+            save_manifest(processed_dir, manifest)
+            return True
+        return False
+
+    def step(s):
+        t = todo(s)[0]
+        name = s['workload']['name'] if s['workload'] else None
+        instances = "" if s['concurrency'] == 1 else " with {} instances".format(s['concurrency'])
+        print("Performing {} benchmark run {} for polkadot build {}{}".format(name or s['kind'], t['run'], s['nb_build'], instances))
+        with builds.paused() if builds is not None else contextlib.nullcontext():
+            results = benchmark_once(s['prefix'], s['kind'], s['nb_build'], t['run'], processed_dir, sample_interval, cores,
+                                     max_load, s['workload'], s['concurrency'], counters, cpu_only,
+                                     builds.pids if builds is not None else None)
+        s['history'].append(live_scores(s['kind'], results, name, cpu_only))
+        t['status'] = 'done'
+        save_manifest(processed_dir, manifest)
+
+    if interleave:
+        rng = random.Random(seed)
+        todo_series = [s for s in series if not finished(s)]
+        while todo_series:
+            rng.shuffle(todo_series)
+            for s in todo_series:
+                step(s)
+            todo_series = [s for s in todo_series if not finished(s)]
+    else:
+        for s in series:
+            while not finished(s):
+                step(s)
+
+    summary = []
+    for s in series:
+        names = dict.fromkeys(n for h in s['history'] for n in h)
+        delta = {n: relative_delta([h[n] for h in s['history'] if n in h]) for n in names}
+        delta = {n: d for n, d in delta.items() if d != math.inf}
+        name = s['workload']['name'] if s['workload'] else s['kind']
+        if s['concurrency'] > 1:
+            name = name + " x{}".format(s['concurrency'])
+        print("Build {} {}: {} runs, relative Δ {}".format(s['nb_build'], name, len(s['history']),
+              ", ".join("{} {:.2%}".format(n, d) for n, d in delta.items()) or "-"))
+        summary.append({'nb_build': s['nb_build'], 'kind': s['kind'], 'workload': s['workload'],
+                        'concurrency': s['concurrency'], 'runs': len(s['history']), 'delta': delta})
+    return summary
+
+def perform_benchmark(binary, NB_RUNS, nb_build, processed_dir, docker=False, first_run=0, NB_EXTRINSIC=4,
+                      sample_interval=SAMPLE_INTERVAL, precision=None, min_runs=MIN_RUNS, workloads=EXTRINSIC_WORKLOADS):
+    # first_run > 0 adds runs to earlier runs of the same build
+    # with precision, NB_RUNS and NB_EXTRINSIC are the maximum number of runs (see benchmark_all)
+    # docker: the image of the version of processed_dir (output/VERSION/HOST/DATE)
+    if not docker:
+        prefix = [binary]
+    else:
+        container = docker_container(processed_dir)
+        prefix, info = docker_start(Path(processed_dir).parts[-3], container)
     # TODO test for version >= 0.9.27
-    # TODO number of tests i hard coded (idea: take 1/5 of NB_RUNS)
-    for i in range(4):        
-        print("Performing extrinsic benchmark run {} for polkadot build {}".format(i, nb_build)) 
-
-        pct_before = psutil.cpu_percent(interval=2)
-        if not docker:
-            bench = subprocess.run([binary, 'benchmark', 'extrinsic', '--pallet', 'system', '--extrinsic', 'remark', '--chain', 'polkadot-dev'], 
-                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)                    
-        else:
-            #shlex.split("docker run --rm -it parity/polkadot:v0.9.26 benchmark machine --disk-duration 30")
-            bench = subprocess.run(['docker', 'run', '--rm', '-it', 'parity/polkadot:v{}'.format(version), 
-                                    'benchmark', 'extrinsic', '--pallet', 'system', '--extrinsic', 'remark', '--chain', 'polkadot-dev'], 
-                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)                    
-        out = bench.stdout.decode("utf-8")
-        pct_after = psutil.cpu_percent(interval=2)
-
-        with open(processed_dir + "/new_bench_{}_run_{}.txt".format(nb_build, i), "w") as text_file:
-            text_file.write("CPU utilization at start: {}\n".format(pct_before))
-            text_file.write(out)
-            text_file.write("CPU utilization at end: {}\n".format(pct_after))
-
-def run(version, NB_RUNS = 5):
-    os.chdir(os.path.expanduser('~/polkadot-optimized'))
-    bin_dir = 'bin/' + version
-    list_of_files = glob.glob(bin_dir + '/polkadot_*.bin')
+    try:
+        return benchmark_all([(nb_build, prefix)], processed_dir, NB_RUNS, NB_EXTRINSIC, precision=precision,
+                             min_runs=min_runs, first_run=first_run, sample_interval=sample_interval, workloads=workloads)
+    finally:
+        if docker:
+            docker_stop(container)
 
-    # Prepare output directory    
-    host = socket.gethostname()    
-    now = datetime.now().strftime("%Y-%b-%d_%Hh%M")
-    processed_dir = 'output/' + version + "/" + host + "/" + now
-    if not os.path.isdir(processed_dir):
-        os.makedirs(processed_dir)
-
-    # Run all numbered binaries polkadot_NB.bin
-    for binary in list_of_files:
-        nb = int(re.findall("_\d+.bin",binary)[0][1:-4])        
-        perform_benchmark(binary, NB_RUNS, nb, processed_dir)
-        # Copy json build file
-        orig_json = binary[:-4] + '.json'
-        new_json = processed_dir + '/bench_{}.json'.format(nb)
-        shutil.copy2(orig_json, new_json)
-
-    # Run official binary    
-    binary = bin_dir + '/official_polkadot.bin'
+def official_binary(version):
+    "Path of the official binary of version (relative to ~/polkadot-optimized), downloaded if needed"
+    binary = 'bin/' + version + '/official_polkadot.bin'
     if not os.path.exists(binary):
         print("Dowloading polkadot binary since official_polkadot.bin not found.")
         url = "https://github.com/paritytech/polkadot/releases/download/v{}/polkadot".format(version) 
@@ -105,22 +922,133 @@ def run(version, NB_RUNS = 5):
     if not os.access(binary, os.X_OK):
         print("Setting executable permission for official_polkadot.bin.")
         os.chmod(binary, stat.S_IXUSR)
-    perform_benchmark(binary, NB_RUNS, "official", processed_dir)
+    return binary
+
+def unfinished_session(version, host):
+    "Most recent session directory of version on host with tasks todo (None if there is none)"
+    for d in sorted(glob.glob('output/{}/{}/*'.format(version, host)), key=os.path.getmtime, reverse=True):
+        manifest = load_manifest(d)
+        if manifest is not None and not manifest['complete']:
+            return d
+    return None
+
+def run(version, NB_RUNS = 5, NB_EXTRINSIC = 4, interleave=False, cores=None, max_load=None, seed=None,
+        precision=None, min_runs=MIN_RUNS, resume=False, workloads=EXTRINSIC_WORKLOADS, concurrency=[1],
+        counters=True, NB_STARTUP=0, NB_DISK=0, disk_targets=DISK_TARGETS, disk_durations=[30]):
+    """
+    Benchmark all builds of version, the official binary and docker (one
+    container for the session, see docker_start).
+    Noise control: interleave the runs of all binaries, pin the benchmarks to
+    cores (list) and wait for a quiet host (CPU usage at most max_load %).
+    With precision, every binary runs until its scores are precise enough
+    (at most NB_RUNS and NB_EXTRINSIC runs, see benchmark_all).
+    workloads: extrinsic benchmarks (list of dicts as EXTRINSIC_WORKLOADS).
+    concurrency: numbers of instances run at the same time, each on its own
+    core (scaling mode, e.g. scaling_levels()).
+    counters: collect hardware counters (perf stat or /proc) of every run.
+    NB_STARTUP: number of startup runs (startup latency, peak RSS and binary
+    size, see startup_once) of every binary except docker.
+    NB_DISK: number of runs of the disk stage for every storage target of
+    disk_targets (see DISK_TARGETS) and duration (seconds) of disk_durations,
+    the machine benchmarks then run the shortest disk part, which is
+    ignored (0: machine benchmarks with the disk part, as before).
+    resume=True continues the most recent unfinished session of this host
+    (or resume is the session directory) with its binaries and settings.
+    """
+    os.chdir(os.path.expanduser('~/polkadot-optimized'))
+    registry.import_legacy(version)
+    host = socket.gethostname()    
+
+    if resume:
+        processed_dir = resume if isinstance(resume, str) else unfinished_session(version, host)
+        if processed_dir is None:
+            print("No unfinished session of version {} on {} to resume.".format(version, host))
+            return
+        print("Resuming session {}".format(processed_dir))
+        manifest = load_manifest(processed_dir)
+        targets = [(nb_build, prefix) for nb_build, prefix in manifest['targets']]
+        settings = manifest['settings']
+    else:
+        # Prepare output directory    
+        now = datetime.now().strftime("%Y-%b-%d_%Hh%M")
+        processed_dir = 'output/' + version + "/" + host + "/" + now
+        if not os.path.isdir(processed_dir):
+            os.makedirs(processed_dir)
+
+        # All numbered binaries polkadot_NB.bin of the registry
+        # (parse_benchmarks.py reads the build options from the registry as well)
+        builds = registry.builds(version)
+        targets = [(build['nb'], [build['path']]) for build in builds]
 
-    # Run in Docker    
-    perform_benchmark(None, NB_RUNS, "docker", processed_dir, docker=True)
-    # sudo docker run --rm -it parity/polkadot:vVER benchmark machine --disk-duration 30
+        # Official binary    
+        targets.append(("official", [official_binary(version)]))
 
-        
+        # Docker: docker exec in the container of the session (started below)
+        targets.append(("docker", ['docker', 'exec', docker_container(processed_dir)]))
 
-    
+        # everything that is needed to resume the session
+        settings = {'NB_RUNS': NB_RUNS, 'NB_EXTRINSIC': NB_EXTRINSIC, 'interleave': interleave, 'seed': seed,
+                    'precision': precision, 'min_runs': min_runs, 'cores': cores, 'max_load': max_load,
+                    'workloads': workloads, 'concurrency': concurrency, 'counters': counters,
+                    'NB_STARTUP': NB_STARTUP, 'NB_DISK': NB_DISK, 'disk_targets': disk_targets,
+                    'disk_durations': disk_durations}
+        save_manifest(processed_dir, {'version': version, 'settings': settings, 'targets': targets, 'tasks': []})
+
+    # one docker container for the whole session (also when resumed)
+    container = None
+    for k, (nb_build, prefix) in enumerate(targets):
+        if prefix[0] == 'docker':
+            container = docker_container(processed_dir)
+            print("Starting docker container {}".format(container))
+            prefix, info = docker_start(version, container, settings['cores'])
+            targets[k] = (nb_build, prefix)
+            manifest = load_manifest(processed_dir)
+            manifest['targets'] = targets
+            manifest['docker'] = info
+            save_manifest(processed_dir, manifest)
+    try:
+        benchmark_all(targets, processed_dir, **settings)
+    finally:
+        if container is not None:
+            docker_stop(container)
+    for nb_build, prefix in targets:
+        if isinstance(nb_build, int):
+            registry.touch(version, nb_build)
+    if load_manifest(processed_dir)['complete']:
+        print("Session {} is complete.".format(processed_dir))
 
 if __name__=="__main__":
     # Change version here
     version = "0.9.27"    
-    NB_RUNS = 20
+    # Every binary is benchmarked until the 95% CI half-width (Δ) of the
+    # median of each score is at most PRECISION times the median, with at
+    # least MIN_RUNS and at most MAX_RUNS runs (per benchmark kind)
+    PRECISION = 0.01
+    MAX_RUNS = 20
     # For testing:
-    # NB_RUNS = 2
-    run(version, NB_RUNS)
-    
-    
+    # MAX_RUNS = 2
+    # Startup runs (startup latency, peak RSS and binary size) per binary
+    STARTUP_RUNS = 10
+    # Disk stage: runs per storage target (DISK_TARGETS at the top) and
+    # disk duration (seconds), the machine benchmarks run the shortest disk part (ignored)
+    DISK_RUNS = 3
+    DISK_DURATIONS = [30]
+
+    # Noise control: run all binaries interleaved in random order, pin the
+    # benchmarks to CORES (None: no pinning) and wait while the CPU usage of
+    # the host is above MAX_LOAD % (None: never wait). By default the last
+    # physical core, not a hyperthread sibling of a busy core.
+    INTERLEAVE = True
+    CORES = physical_cores()[-1:]
+    MAX_LOAD = 20
+
+    # --resume continues the last unfinished session (or the given session directory)
+    # --scaling also runs 2, 4, ... instances at the same time, up to the number of physical cores
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', nargs='?', const=True, default=False, metavar='SESSION_DIR')
+    parser.add_argument('--scaling', action='store_true')
+    args = parser.parse_args()
+    CONCURRENCY = scaling_levels() if args.scaling else [1]
+    run(version, MAX_RUNS, MAX_RUNS, interleave=INTERLEAVE, cores=CORES, max_load=MAX_LOAD,
+        precision=PRECISION, min_runs=MIN_RUNS, resume=args.resume, concurrency=CONCURRENCY,
+        NB_STARTUP=STARTUP_RUNS, NB_DISK=DISK_RUNS, disk_durations=DISK_DURATIONS)
@@ -0,0 +1,90 @@
+# Checkout from the local mirror with a local polkadot repository
+# (POLKADOT_REPO) and a stub cargo, run with
+#     python3 -m pytest tests
+
+import os
+import sys
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import compile
+
+CARGO_TOML = """[workspace]
+members = []
+
+[profile.release]
+panic = "unwind"
+"""
+
+# cargo vendor --locked DIR: creates DIR and prints the source replacement
+STUB_CARGO = """#!/bin/sh
+echo "cargo $@" >> "$CARGO_LOG"
+if [ "$1" = vendor ]; then
+    mkdir -p "$3"
+    echo '[source.crates-io]'
+    echo 'replace-with = "vendored-sources"'
+fi
+"""
+
+def git(*args, cwd):
+    subprocess.run(['git'] + list(args), cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+@pytest.fixture
+def polkadot_repo(tmp_path, monkeypatch):
+    "Bare repository with the release v0.9.27, and a stub cargo on the PATH"
+    for key in ['GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME']:
+        monkeypatch.setenv(key, 'test')
+    for key in ['GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL']:
+        monkeypatch.setenv(key, 'test@example.com')
+    src = tmp_path / "polkadot"
+    (src / "scripts").mkdir(parents=True)
+    (src / "Cargo.toml").write_text(CARGO_TOML)
+    (src / "scripts" / "init.sh").write_text("#!/bin/sh\ntouch init-done\n")
+    (src / "scripts" / "init.sh").chmod(0o755)
+    git('init', '--quiet', cwd=src)
+    git('add', '.', cwd=src)
+    git('commit', '--quiet', '-m', 'release', cwd=src)
+    git('tag', 'v0.9.27', cwd=src)
+    git('clone', '--quiet', '--bare', str(src), str(tmp_path / "polkadot.git"), cwd=tmp_path)
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "cargo").write_text(STUB_CARGO)
+    (bin_dir / "cargo").chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('CARGO_LOG', str(tmp_path / "cargo.log"))
+
+    base_dir = tmp_path / "polkadot-optimized"
+    base_dir.mkdir()
+    monkeypatch.setattr(compile, 'BASE_DIR', str(base_dir))
+    monkeypatch.setattr(compile, 'CACHE_DIR', str(base_dir / "cache"))
+    monkeypatch.setattr(compile, 'POLKADOT_REPO', str(tmp_path / "polkadot.git"))
+    return tmp_path
+
+def test_checkout_from_local_repo(polkadot_repo):
+    log_file = str(polkadot_repo / "checkout.log")
+    phases = {}
+    work_dir = Path(compile.checkout('0.9.27', log_file, phases))
+    assert set(phases) == {'mirror', 'checkout', 'init', 'vendor'}
+    assert (work_dir / "init-done").exists()
+    # the production profile is set per build (see profile_env)
+    assert 'inherits = "release"' in (work_dir / "Cargo.toml").read_text().split('[profile.production]')[1]
+    assert 'vendored-sources' in (work_dir / ".cargo" / "config.toml").read_text()
+
+    # the next checkout is offline, a clean tree that keeps the target directory
+    shutil.rmtree(polkadot_repo / "polkadot.git")
+    (work_dir / "target").mkdir()
+    (work_dir / "target" / "kept").write_text("")
+    (work_dir / "untracked").write_text("")
+    phases = {}
+    assert Path(compile.checkout('0.9.27', log_file, phases)) == work_dir
+    assert 'init' not in phases
+    assert (work_dir / "target" / "kept").exists()
+    assert not (work_dir / "untracked").exists()
+    # vendored once per version
+    assert (polkadot_repo / "cargo.log").read_text().count("cargo vendor") == 1
@@ -0,0 +1,91 @@
+# Coordinator and agents of distribute.py on localhost, run with
+#     python3 -m pytest tests
+
+import sys
+import json
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import distribute
+import registry
+
+FAKE_POLKADOT = """#!/usr/bin/env python3
+print("| CPU      | BLAKE2-256     | 1.37 GiB/s  | 1.00 GiB/s  | ✅ Pass (101.7 %) |")
+"""
+SETTINGS = {'NB_RUNS': 2, 'NB_EXTRINSIC': 0, 'workloads': [], 'concurrency': [1], 'NB_STARTUP': 0,
+            'NB_DISK': 0, 'disk_targets': [], 'disk_durations': [], 'seed': 1}
+DATE = "2022-Aug-08_13h11"
+
+@pytest.fixture
+def coordinator(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    binary = tmp_path / "polkadot"
+    binary.write_text(FAKE_POLKADOT)
+    binary.chmod(0o755)
+    targets = [("official", [str(binary)], registry.sha256sum(binary))]
+    return distribute.Coordinator("0.9.27", targets, SETTINGS, DATE)
+
+def test_lease_and_requeue(coordinator, monkeypatch):
+    first = coordinator.next_task('a1')['task']
+    second = coordinator.next_task('a1')['task']
+    assert first['id'] != second['id']
+    assert first['sha256'] == second['sha256']
+    # both tasks are leased to a1, but not done yet
+    assert coordinator.next_task('a1') == {'task': None, 'finished': False}
+    # every agent has its own session
+    assert coordinator.next_task('a2')['task']['id'] == first['id']
+
+    coordinator.complete('a1', second['id'], {'bench_official_run_1.txt': b"done\n"})
+    assert coordinator.next_task('a1') == {'task': None, 'finished': False}
+    # an agent that does not report back loses its lease
+    monkeypatch.setattr(distribute, 'LEASE_TIMEOUT', 0)
+    again = coordinator.next_task('a1')['task']
+    assert again['id'] == first['id']
+    coordinator.complete('a1', first['id'], {})
+    assert coordinator.next_task('a1') == {'task': None, 'finished': True}
+    assert coordinator.complete_sessions() == ['a1']
+
+    session = Path('output/0.9.27/a1') / DATE
+    assert (session / 'bench_official_run_1.txt').read_bytes() == b"done\n"
+    with open(session / 'manifest.json') as f:
+        manifest = json.load(f)
+    assert manifest['complete'] and manifest['agent'] == 'a1'
+
+def test_files_outside_the_session(coordinator):
+    task = coordinator.next_task('a1')['task']
+    with pytest.raises(ValueError):
+        coordinator.complete('a1', task['id'], {'../escape.txt': b""})
+    assert not Path('output/0.9.27/escape.txt').exists()
+
+def test_agents_on_localhost(coordinator, tmp_path, monkeypatch):
+    monkeypatch.setattr(distribute, 'CACHE_DIR', str(tmp_path / "cache"))
+    server = ThreadingHTTPServer(('localhost', 0), distribute.Handler)
+    server.coordinator = coordinator
+    server.token = 'secret'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://localhost:{}'.format(server.server_address[1])
+    try:
+        agents = [threading.Thread(target=distribute.agent, args=(url, name),
+                                   kwargs={'counters': False, 'token': 'secret'}) for name in ['a1', 'a2']]
+        for a in agents:
+            a.start()
+        for a in agents:
+            a.join(timeout=60)
+        with pytest.raises(Exception):
+            distribute.agent(url, 'a3', token='wrong')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert sorted(coordinator.complete_sessions()) == ['a1', 'a2']
+    for name in ['a1', 'a2']:
+        session = Path('output/0.9.27') / name / DATE
+        assert sorted(f.name for f in session.glob('bench_*.txt')) == ['bench_official_run_0.txt',
+                                                                       'bench_official_run_1.txt']
+        assert (session / 'records' / 'bench_official_run_0.arrow').exists()
+    # the binary was downloaded once into the shared cache
+    assert len(list((tmp_path / "cache").iterdir())) == 1
@@ -0,0 +1,64 @@
+# Adaptive search with a fake compiler and benchmark, run with
+#     python3 -m pytest tests
+
+import sys
+import random
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import optimize
+
+SPACE = {'toolchain': ['stable', 'nightly'],
+         'arch':      [None, 'native'],
+         'codegen-units': [1, 16],
+         'lto':       ['off', 'fat'],
+         'opt-level': [2, 3]}
+
+def fake_build(failing=()):
+    "build() that 'compiles' every option set except those with an lto in failing"
+    built = []
+    def build(opts):
+        if opts['lto'] in failing:
+            return None
+        built.append(opts)
+        return len(built) - 1
+    return build, built
+
+def fake_benchmark(built, seed=0):
+    "benchmark() with synthetic scores: native and fat LTO are faster, a little noise"
+    rng = random.Random(seed)
+    def benchmark(bid, nb_runs):
+        opts = built[bid]
+        speed = 1 + 0.2 * (opts['arch'] == 'native') + 0.1 * (opts['lto'] == 'fat')
+        return pd.DataFrame([{'BLAKE2-256': 1000 * speed + rng.gauss(0, 1),
+                              'Extr-Remark': 100 / speed + rng.gauss(0, 0.1)} for k in range(nb_runs)])
+    return benchmark
+
+def test_search_finds_the_best_option_set():
+    build, built = fake_build()
+    summary = optimize.search(SPACE, build, fake_benchmark(built), ['BLAKE2-256'], ['Extr-Remark'],
+                              nb_initial=4, max_builds=12)
+    assert len(summary) <= 12
+    best = summary[summary['pareto']]
+    assert (best['arch'] == 'native').all() and (best['lto'] == 'fat').all()
+    # dominated option sets were dropped before the last level of runs
+    assert (summary.loc[~summary['alive'], 'runs'] < 12).all()
+
+def test_search_drops_failed_builds_and_benchmarks():
+    build, built = fake_build(failing=['off'])
+    benchmark = fake_benchmark(built)
+    def flaky(bid, nb_runs):
+        return None if built[bid]['arch'] is None else benchmark(bid, nb_runs)
+    summary = optimize.search(SPACE, build, flaky, ['BLAKE2-256'], ['Extr-Remark'], nb_initial=6, max_builds=10)
+    assert summary['id'].isna().sum() == (summary['lto'] == 'off').sum()
+    assert not summary.loc[summary['arch'].isna(), 'alive'].any()
+    assert (summary.loc[summary['pareto'], 'arch'] == 'native').all()
+
+def test_search_without_results():
+    build, built = fake_build(failing=['off', 'fat'])
+    with pytest.raises(RuntimeError):
+        optimize.search(SPACE, build, fake_benchmark(built), ['BLAKE2-256'], ['Extr-Remark'], nb_initial=3)
@@ -0,0 +1,74 @@
+# Parsing of sessions into the dataset, run with
+#     python3 -m pytest tests
+
+import os
+import sys
+import json
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "notebook"))
+
+import parse_benchmarks
+import mathcrypto
+
+def session(tmp_path, date):
+    p = tmp_path / "output" / "0.9.27" / "testhost" / date
+    os.makedirs(p)
+    return p
+
+def test_partial_session_without_finished_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    p = session(tmp_path, "2022-Aug-08_13h11")
+    manifest = {'version': '0.9.27', 'settings': {}, 'targets': [], 'complete': False,
+                'tasks': [{'nb_build': 'official', 'kind': 'machine', 'workload': None, 'concurrency': 1,
+                           'run': 0, 'status': 'todo'}]}
+    with open(p / "manifest.json", "w") as f:
+        json.dump(manifest, f)
+    parse_benchmarks.parse(partial=True, workers=1)
+    ingest = parse_benchmarks.load_ingest_manifest()
+    assert ingest["0.9.27_testhost_2022-Aug-08_13h11"]['complete'] is False
+    assert not (tmp_path / "processed" / "dataset").exists()
+    # unfinished session stays in output
+    assert p.exists()
+
+def test_empty_legacy_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    empty = session(tmp_path, "2022-Aug-02_06h09")
+    # machine benchmark without a result table (e.g. arch not supported)
+    (empty / "bench_official_run_0.txt").write_text("Error: unsupported\n")
+    (empty / "new_bench_official_run_0.txt").write_text("")
+    # a later session is still parsed
+    later = session(tmp_path, "2022-Aug-08_13h11")
+    (later / "bench_official_run_0.txt").write_text(
+        "| CPU      | BLAKE2-256     | 1.37 GiB/s  | 1.00 GiB/s  | ✅ Pass (101.7 %) |\n")
+    parse_benchmarks.parse(workers=1)
+    ingest = parse_benchmarks.load_ingest_manifest()
+    assert ingest["0.9.27_testhost_2022-Aug-02_06h09"]['complete'] is True
+    assert ingest["0.9.27_testhost_2022-Aug-08_13h11"]['complete'] is True
+    parts = list((tmp_path / "processed" / "dataset" / "machine").glob("*/*/*/part-0.parquet"))
+    assert [q.parent.name for q in parts] == ["date=2022-Aug-08_13h11"]
+
+def test_dataset_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    session = {'host': 'testhost', 'nb_run': 0, 'nb_build': '0', 'BLAKE2-256': 1370.0,
+               'toolchain': 'nightly', 'arch': None}
+    # build options of 0.9.26, without codegen-units and opt-level
+    old = pd.DataFrame([dict(session, ver='0.9.26', date='2022-Aug-02_06h09',
+                             codegen=True, lto_ldd=False, profile='release')])
+    new = pd.DataFrame([dict(session, ver='0.9.27', date='2022-Aug-08_13h11',
+                             **{'codegen-units': 1, 'lto': 'fat', 'opt-level': 3, 'pgo': True})])
+    parse_benchmarks.write_partitions('machine', old)
+    parse_benchmarks.write_partitions('machine', new)
+    df = mathcrypto.load_dataset('machine', dataset=str(tmp_path / "processed" / "dataset"))
+    assert len(df) == 2
+    for col in ['nb_run', 'concurrency', 'codegen-units', 'opt-level']:
+        assert df[col].dtype == 'Int64'
+    for col in ['codegen', 'lto_ldd', 'pgo']:
+        assert df[col].dtype == 'boolean'
+    for col in ['toolchain', 'arch', 'lto', 'profile']:
+        assert df[col].dtype == 'category'
+    assert df['BLAKE2-256'].dtype == 'float64'
+    assert df.set_index('ver').loc['0.9.27', 'codegen-units'] == 1
@@ -0,0 +1,134 @@
+# Hardware counters of the benchmark runs with a stub perf and docker
+# benchmarks with a docker shim, run with
+#     python3 -m pytest tests
+
+import os
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import run_benchmarks
+import parse_benchmarks
+
+FAKE_POLKADOT = """#!/usr/bin/env python3
+print("| CPU      | BLAKE2-256     | 1.37 GiB/s  | 1.00 GiB/s  | ✅ Pass (101.7 %) |")
+"""
+
+# perf stat -x , [-o FILE] -e EVENTS -- CMD: the counts of EVENTS in csv, then runs CMD
+STUB_PERF = """#!/usr/bin/env python3
+import os, sys
+a = sys.argv[1:]
+cmd = a[a.index('--') + 1:]
+events = a[a.index('-e') + 1].split(',')
+lines = [l for l in "{counts}".split("\\n") if l.split(',')[2].split(':')[0] in events]
+if '-o' in a:
+    with open(a[a.index('-o') + 1], 'w') as f:
+        f.write("# started on today\\n\\n" + "\\n".join(lines) + "\\n")
+else:
+    sys.stderr.write("\\n".join(lines) + "\\n")
+os.execvp(cmd[0], cmd)
+"""
+COUNTING = "\\n".join(["2000,,instructions:u,1000,100.00,,", "1000,,cycles:u,1000,100.00,,",
+                        "10,,branch-misses:u,1000,100.00,,", "<not supported>,,cache-misses:u,0,100.00,,",
+                        "3,,context-switches:u,1000,100.00,,"])
+NOT_COUNTING = "<not supported>,,instructions:u,0,100.00,,"
+
+def executable(path, text):
+    path.write_text(text)
+    path.chmod(0o755)
+    return str(path)
+
+@pytest.fixture
+def session(tmp_path):
+    p = tmp_path / "output" / "0.9.27" / "testhost" / "2022-Aug-08_13h11"
+    p.mkdir(parents=True)
+    return p
+
+def machine_run(tmp_path, session, monkeypatch, perf):
+    monkeypatch.setattr(run_benchmarks, 'PERF', perf)
+    run_benchmarks.perf_available.cache_clear()
+    binary = executable(tmp_path / "polkadot", FAKE_POLKADOT)
+    results = run_benchmarks.benchmark_once([binary], 'machine', 'official', 0, str(session), sample_interval=0.05)
+    assert results[0]['BLAKE2-256'] == pytest.approx(1370.0)
+    f = session / "bench_official_run_0.txt"
+    with open(session / "load_bench_official_run_0.json") as text_file:
+        return json.load(text_file)['counters'], parse_benchmarks.get_counters(f)
+
+def test_perf_counters(tmp_path, session, monkeypatch):
+    perf = executable(tmp_path / "perf", STUB_PERF.replace("{counts}", COUNTING))
+    counters, row = machine_run(tmp_path, session, monkeypatch, perf)
+    assert counters['source'] == 'perf'
+    assert row['counters'] == 'perf'
+    assert row['instructions'] == 2000 and row['cycles'] == 1000 and row['ipc'] == 2.0
+    assert row['branch_misses'] == 10 and row['context_switches'] == 3
+    # perf could not count it
+    assert row['cache_misses'] is None
+
+@pytest.mark.parametrize("perf", ["stub", "missing"])
+def test_proc_counters_without_perf(tmp_path, session, monkeypatch, perf):
+    if perf == "stub":
+        perf = executable(tmp_path / "perf", STUB_PERF.replace("{counts}", NOT_COUNTING))
+    else:
+        perf = str(tmp_path / "no-perf")
+    counters, row = machine_run(tmp_path, session, monkeypatch, perf)
+    assert counters['source'] == 'proc'
+    assert row['counters'] == 'proc'
+    assert row['context_switches'] >= 0 and row['page_faults'] > 0
+    assert row['instructions'] is None and row['ipc'] is None
+
+# docker with one image (pulled on first use): every call goes to the log,
+# docker exec runs the command here, the binary of the image is FAKE_POLKADOT
+DOCKER_SHIM = """#!/usr/bin/env python3
+import os, sys, json
+a = sys.argv[1:]
+with open(os.environ['DOCKER_LOG'], 'a') as f:
+    f.write(json.dumps(a) + "\\n")
+pulled = os.environ['DOCKER_LOG'] + '.pulled'
+if a[:2] == ['image', 'inspect']:
+    if not os.path.exists(pulled):
+        sys.exit(1)
+    print('sha256:1234 ["/usr/bin/polkadot"]')
+elif a[0] == 'pull':
+    open(pulled, 'w').close()
+elif a[0] == 'exec':
+    cmd = a[2:]
+    if cmd[0] == '/usr/bin/polkadot':
+        cmd[0] = os.environ['FAKE_POLKADOT']
+    os.execvp(cmd[0], cmd)
+"""
+
+def test_docker_container(tmp_path, session, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable(bin_dir / "docker", DOCKER_SHIM)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('DOCKER_LOG', str(tmp_path / "docker.log"))
+    monkeypatch.setenv('FAKE_POLKADOT', executable(tmp_path / "polkadot", FAKE_POLKADOT))
+
+    container = run_benchmarks.docker_container(str(session))
+    prefix, info = run_benchmarks.docker_start('0.9.27', container, cores=[0])
+    assert prefix == ['docker', 'exec', container, '/usr/bin/polkadot']
+    assert info['image'] == 'parity/polkadot:v0.9.27' and info['image_id'] == 'sha256:1234'
+    results = run_benchmarks.benchmark_once(prefix, 'machine', 'docker', 0, str(session), sample_interval=0.05)
+    assert results[0]['BLAKE2-256'] == pytest.approx(1370.0)
+    # the image is only pulled once
+    run_benchmarks.docker_start('0.9.27', container, cores=[0])
+    run_benchmarks.docker_stop(container)
+
+    with open(tmp_path / "docker.log") as f:
+        calls = [json.loads(line) for line in f]
+    assert [c[0] for c in calls].count('pull') == 1
+    runs = [c for c in calls if c[0] == 'run']
+    assert len(runs) == 2
+    assert runs[0][runs[0].index('--cpuset-cpus') + 1] == '0'
+    assert not any('-it' in c or '-t' in c for c in calls)
+    assert calls[-1] == ['rm', '--force', container]
+    with open(session / "load_bench_docker_run_0.json") as text_file:
+        load = json.load(text_file)
+    # the overhead of docker exec is measured, no counters for docker
+    assert load['docker_exec_ms'] > 0
+    assert 'counters' not in load